@@ -0,0 +1,137 @@
+"""
+Import time and memory of django_roa.
+
+Each run starts a fresh interpreter which sets Django up with minimal
+settings, without the benchmark models which import codecs themselves, then
+imports ``MODULES`` under ``-X importtime``. It reports the cumulative
+import time of each module (best of ``--repeat`` runs) and the resident
+memory they added. Baselines only keep these numbers, the modules imported
+depending on the environment. Requires Python 3.7 or later for
+``-X importtime``.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.imports
+    $ python -m benchmarks.imports --save benchmarks/imports.json
+    $ python -m benchmarks.imports --compare benchmarks/imports.json
+
+Exits with status 1 if an optional codec (``FORBIDDEN``) was imported or,
+with ``--compare``, if a time or memory grew by more than ``--tolerance``
+(25% by default, imports being noisy) and ``--min-change`` milliseconds or
+KiB.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ('django_roa', 'django_roa.db.models', 'django_roa.db.query')
+# Modules only needed by formats or features that are not in use.
+FORBIDDEN = ('rest_framework_yaml', 'rest_framework_xml', 'defusedxml')
+
+CHILD = """
+import json, resource, sys
+import django
+from django.conf import settings
+settings.configure(INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth'],
+                   ROA_MODELS=True, ROA_FORMAT='json')
+django.setup()
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+modules = set(sys.modules)
+for name in %r:
+    __import__(name)
+sys.stdout.write(json.dumps({
+    'rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before,
+    'modules': sorted(set(sys.modules) - modules),
+}))
+"""
+
+
+def measure(modules=MODULES):
+    """
+    Returns the cumulative import time of each module in milliseconds, the
+    resident memory added in KiB and the newly imported modules.
+    """
+    env = dict(os.environ)
+    env.pop('DJANGO_SETTINGS_MODULE', None)
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', CHILD % (modules,)],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                             universal_newlines=True, check=True)
+    result = json.loads(process.stdout)
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        name = name.strip()
+        if name in modules and cumulative.strip().isdigit():
+            times[name] = int(cumulative) / 1000.0
+    result['ms'] = dict((name, times.get(name, 0.0)) for name in modules)
+    return result
+
+
+def run(repeat=5, out=sys.stdout):
+    """
+    Returns the best timings and memory of ``repeat`` runs, and the modules
+    imported by the first one.
+    """
+    runs = [measure() for i in range(repeat)]
+    results = {'rss_kib': min(result['rss_kib'] for result in runs)}
+    for name in MODULES:
+        results['%s_ms' % name] = min(result['ms'][name] for result in runs)
+        out.write('%-24s %8.1f ms\n' % (name, results['%s_ms' % name]))
+    out.write('%-24s %8d KiB\n' % ('resident memory', results['rss_kib']))
+    return results, runs[0]['modules']
+
+
+def compare(results, baseline, tolerance, min_change):
+    lines, regressions = [], 0
+    for metric in sorted(results):
+        if not baseline.get(metric):
+            continue
+        old, new = baseline[metric], results[metric]
+        change = (new - old) / old
+        worse = change > tolerance and new - old > min_change
+        regressions += worse
+        lines.append('%-28s %10.1f %10.1f %+7.1f%%%s' % (
+            metric, old, new, change * 100, '  REGRESSION' if worse else ''))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', metavar='FILE', help="write results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE', help="compare results with a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--min-change', type=float, default=5.0)
+    args = parser.parse_args(argv)
+    if sys.version_info < (3, 7):
+        parser.error('Python 3.7 or later is required for -X importtime, this is %s.%s'
+                     % sys.version_info[:2])
+
+    results, modules = run(repeat=args.repeat)
+    status = 0
+    forbidden = [name for name in modules if name.split('.')[0] in FORBIDDEN]
+    if forbidden:
+        print('optional codecs imported: %s' % ', '.join(forbidden))
+        status = 1
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance, args.min_change)
+        print('\n'.join(lines))
+        print('%d regression(s) beyond %.0f%%' % (regressions, args.tolerance * 100))
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
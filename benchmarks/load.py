@@ -0,0 +1,318 @@
+"""
+End-to-end load harness against the example DRF backend.
+
+Boots ``examples/django_rest_framework/backend`` under a multi-worker WSGI
+server (gunicorn when installed, Django's threaded development server
+otherwise) on a fresh database, then drives the frontend ROA models from
+concurrent threads with a weighted mix of operations and reports latency
+percentiles and throughput per operation::
+
+    $ python -m benchmarks.load --concurrency 16 --duration 30 \\
+          --mix list=40,get=40,count=10,save=5,delete=5
+
+Operations:
+
+- ``list``: evaluates ``Article.objects.all()``,
+- ``get``: ``Article.objects.get(id=...)`` on a fixture article,
+- ``count``: ``Account.objects.count()``,
+- ``save``: creates an ``Account``,
+- ``delete``: deletes an account created by ``save`` (creating one first if
+  none is left).
+
+Use ``--backend-url`` to drive an already running backend instead.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'examples', 'django_rest_framework')
+BACKEND = os.path.join(EXAMPLE, 'backend')
+FRONTEND = os.path.join(EXAMPLE, 'frontend')
+
+DEFAULT_MIX = 'list=40,get=40,count=10,save=5,delete=5'
+FIXTURE_ARTICLES = (1, 2, 3)
+
+
+def parse_mix(value):
+    mix = []
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError('Unknown operation "%s", choose among %s' % (
+                name, ', '.join(sorted(OPERATIONS))))
+        mix.append((name, float(weight)))
+    return mix
+
+
+#################
+# BACKEND SETUP #
+#################
+
+def manage(*args):
+    return subprocess.call([sys.executable, 'manage.py'] + list(args), cwd=BACKEND,
+                           stdout=subprocess.DEVNULL)
+
+
+def wait_for_port(host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('Backend did not start listening on %s:%s' % (host, port))
+
+
+def start_backend(port, workers):
+    """
+    Recreates the backend database from its fixtures and starts serving it.
+    Returns the server process.
+    """
+    db = os.path.join(BACKEND, 'db.sqlite3')
+    if os.path.exists(db):
+        os.remove(db)
+    if manage('migrate', '--run-syncdb', '--noinput') != 0:
+        manage('syncdb', '--noinput')
+    manage('loaddata', 'initial_data')
+
+    bind = '127.0.0.1:%s' % port
+    if shutil.which('gunicorn') or _importable('gunicorn'):
+        command = [sys.executable, '-m', 'gunicorn', 'backend.wsgi:application',
+                   '--workers', str(workers), '--bind', bind, '--log-level', 'warning']
+    else:
+        sys.stderr.write('gunicorn is not installed, falling back to the threaded '
+                         'development server\n')
+        command = [sys.executable, 'manage.py', 'runserver', '--noreload', bind]
+    process = subprocess.Popen(command, cwd=BACKEND, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port('127.0.0.1', port)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process
+
+
+def _importable(name):
+    try:
+        __import__(name)
+    except ImportError:
+        return False
+    return True
+
+
+##################
+# FRONTEND SETUP #
+##################
+
+def setup_frontend(backend_url):
+    sys.path[:0] = [FRONTEND, ROOT]
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'frontend.settings')
+    from django.conf import settings
+    # Must be set before django_roa.db.models reads it.
+    settings.ROA_URL_OVERRIDES_LIST = dict(
+        ('frontend.%s' % name, '%s/%ss/' % (backend_url.rstrip('/'), name))
+        for name in ('account', 'reporter', 'article', 'tag'))
+    import django
+    django.setup()
+
+
+##############
+# OPERATIONS #
+##############
+
+class Context(object):
+    """
+    State shared by the workers: accounts created by ``save``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = []
+
+    def push(self, account):
+        with self.lock:
+            self.created.append(account)
+
+    def pop(self):
+        with self.lock:
+            return self.created.pop() if self.created else None
+
+
+def op_list(context, rnd):
+    from frontend.models import Article
+    list(Article.objects.all())
+
+
+def op_get(context, rnd):
+    from frontend.models import Article
+    Article.objects.get(id=rnd.choice(FIXTURE_ARTICLES))
+
+
+def op_count(context, rnd):
+    from frontend.models import Account
+    Account.objects.count()
+
+
+def op_save(context, rnd):
+    from frontend.models import Account
+    account = Account(email='load%d@example.com' % rnd.randint(0, 10 ** 9))
+    account.save()
+    context.push(account)
+
+
+def op_delete(context, rnd):
+    account = context.pop()
+    if account is None:
+        op_save(context, rnd)
+        account = context.pop()
+    account.delete()
+
+
+OPERATIONS = {
+    'list': op_list,
+    'get': op_get,
+    'count': op_count,
+    'save': op_save,
+    'delete': op_delete,
+}
+
+
+##########
+# DRIVER #
+##########
+
+def worker(index, mix, deadline, warmup_until, context, latencies, errors, seed):
+    rnd = random.Random(seed + index)
+    names = [name for name, weight in mix]
+    weights = [weight for name, weight in mix]
+    while True:
+        now = time.time()
+        if now >= deadline:
+            break
+        name = rnd.choices(names, weights)[0]
+        start = time.perf_counter()
+        try:
+            OPERATIONS[name](context, rnd)
+        except Exception as e:
+            if now >= warmup_until:
+                errors[name].append(repr(e))
+            continue
+        elapsed = time.perf_counter() - start
+        if now >= warmup_until:
+            latencies[name].append(elapsed)
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted ``values``.
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[rank]
+
+
+def summarize(latencies, errors, duration):
+    report = {}
+    for name in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(name, []))
+        report[name] = {
+            'count': len(values),
+            'errors': len(errors.get(name, [])),
+            'throughput': len(values) / duration,
+            'p50_ms': percentile(values, 0.50) * 1000,
+            'p95_ms': percentile(values, 0.95) * 1000,
+            'p99_ms': percentile(values, 0.99) * 1000,
+            'max_ms': values[-1] * 1000 if values else 0.0,
+        }
+    total = sum(len(values) for values in latencies.values())
+    report['total'] = {'count': total, 'throughput': total / duration,
+                       'errors': sum(len(e) for e in errors.values())}
+    return report
+
+
+def run(mix, concurrency, duration, warmup, seed=0):
+    context = Context()
+    latencies = defaultdict(list)
+    errors = defaultdict(list)
+    start = time.time()
+    warmup_until = start + warmup
+    deadline = warmup_until + duration
+    threads = [threading.Thread(target=worker, args=(i, mix, deadline, warmup_until, context,
+                                                     latencies, errors, seed))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Leave the backend as we found it.
+    while context.created:
+        try:
+            context.pop().delete()
+        except Exception:
+            pass
+    return summarize(latencies, errors, duration), errors
+
+
+def print_report(report, out=sys.stdout):
+    out.write('%-8s %8s %7s %10s %9s %9s %9s %9s\n' % (
+        'op', 'count', 'errors', 'ops/s', 'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+    for name, stats in sorted(report.items()):
+        if name == 'total':
+            continue
+        out.write('%-8s %8d %7d %10.1f %9.1f %9.1f %9.1f %9.1f\n' % (
+            name, stats['count'], stats['errors'], stats['throughput'], stats['p50_ms'],
+            stats['p95_ms'], stats['p99_ms'], stats['max_ms']))
+    total = report['total']
+    out.write('%-8s %8d %7d %10.1f\n' % ('total', total['count'], total['errors'],
+                                         total['throughput']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help="weighted operations (default: %s)" % DEFAULT_MIX)
+    parser.add_argument('--concurrency', type=int, default=8, help="client threads")
+    parser.add_argument('--duration', type=float, default=30, help="measured seconds")
+    parser.add_argument('--warmup', type=float, default=5, help="unmeasured seconds first")
+    parser.add_argument('--workers', type=int, default=4, help="backend worker processes")
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backend-url', help="drive a running backend instead of booting one")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help="write the report as JSON")
+    args = parser.parse_args(argv)
+
+    process = None
+    backend_url = args.backend_url
+    if backend_url is None:
+        process = start_backend(args.port, args.workers)
+        backend_url = 'http://127.0.0.1:%s' % args.port
+    try:
+        setup_frontend(backend_url)
+        report, errors = run(args.mix, args.concurrency, args.duration, args.warmup, args.seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    print_report(report)
+    for name, messages in sorted(errors.items()):
+        sys.stderr.write('%s: %d error(s), first: %s\n' % (name, len(messages), messages[0]))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Copies of the ``examples/django_rest_framework`` models.
+"""
+from django.db import models
+from rest_framework.parsers import JSONParser
+from rest_framework_xml.parsers import XMLParser
+
+from django_roa import Model as ROAModel
+
+PARSERS = {
+    'json': JSONParser,
+    'xml': XMLParser,
+}
+
+
+class BenchmarkROAModel(object):
+    # Format of the canned payloads, switched by the runner.
+    benchmark_format = 'json'
+
+    @classmethod
+    def get_resource_url_list(cls):
+        return 'http://benchmarks.invalid/%s/' % (cls.api_base_name)
+
+    @classmethod
+    def get_parser(cls):
+        return PARSERS[cls.benchmark_format]()
+
+
+class Account(BenchmarkROAModel, ROAModel):
+    id = models.IntegerField(primary_key=True)
+    email = models.CharField(max_length=30)
+
+    api_base_name = 'accounts'
+
+    @classmethod
+    def serializer(cls):
+        from .serializers import AccountSerializer
+        return AccountSerializer
+
+
+class Reporter(BenchmarkROAModel, ROAModel):
+    id = models.IntegerField(primary_key=True)
+    # A OneToOneField in the example, equivalent for decoding purposes.
+    account = models.ForeignKey(Account, on_delete=models.CASCADE)
+    first_name = models.CharField(max_length=30)
+    last_name = models.CharField(max_length=30)
+
+    api_base_name = 'reporters'
+
+    @classmethod
+    def serializer(cls):
+        from .serializers import ReporterSerializer
+        return ReporterSerializer
+
+
+class Article(BenchmarkROAModel, ROAModel):
+    id = models.IntegerField(primary_key=True)
+    headline = models.CharField(max_length=100)
+    pub_date = models.DateField()
+    reporter = models.ForeignKey(Reporter, related_name='articles', on_delete=models.CASCADE)
+
+    api_base_name = 'articles'
+
+    @classmethod
+    def serializer(cls):
+        from .serializers import ArticleSerializer
+        return ArticleSerializer
+
+
+class Tag(BenchmarkROAModel, ROAModel):
+    id = models.IntegerField(primary_key=True)
+    label = models.CharField(max_length=30)
+
+    api_base_name = 'tags'
+
+    @classmethod
+    def serializer(cls):
+        from .serializers import TagSerializer
+        return TagSerializer
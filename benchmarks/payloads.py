@@ -0,0 +1,47 @@
+"""
+Canned list payloads of the benchmark models.
+"""
+from datetime import date, timedelta
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework_xml.renderers import XMLRenderer
+
+RENDERERS = {
+    'json': JSONRenderer,
+    'xml': XMLRenderer,
+}
+
+
+def account_rows(size):
+    return [{'id': i, 'email': 'user%d@example.com' % i} for i in range(1, size + 1)]
+
+
+def reporter_rows(size):
+    return [{'id': i, 'account_id': i, 'first_name': 'First %d' % i,
+             'last_name': 'Last %d' % i} for i in range(1, size + 1)]
+
+
+def article_rows(size):
+    start = date(2013, 1, 4)
+    return [{'id': i, 'headline': "Reporter %d's story number %d" % (i % 97, i),
+             'pub_date': (start + timedelta(days=i % 3650)).isoformat(),
+             'reporter_id': i % 97 + 1} for i in range(1, size + 1)]
+
+
+def tag_rows(size):
+    return [{'id': i, 'label': 'tag-%d' % i} for i in range(1, size + 1)]
+
+
+ROWS = {
+    'account': account_rows,
+    'reporter': reporter_rows,
+    'article': article_rows,
+    'tag': tag_rows,
+}
+
+
+def render(model_name, size, fmt):
+    payload = RENDERERS[fmt]().render(ROWS[model_name](size))
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    return payload
@@ -0,0 +1,199 @@
+"""
+CPU micro-benchmarks of the decode/validate/hydrate pipeline.
+
+Canned list payloads are fed through ``ROAModelIterable`` by a fake
+transport, so only the client side work is measured. For each model,
+format and size, throughput (rows per second) comes from the phase timings
+of ``RemoteCall`` (best of several runs) and memory (peak and retained
+KiB, allocated blocks) from ``tracemalloc``, phase by phase.
+
+Run from the root of the repository::
+
+    $ python -m benchmarks.pipeline
+    $ python -m benchmarks.pipeline --sizes 10,1000 --save benchmarks/baseline.json
+    $ python -m benchmarks.pipeline --compare benchmarks/baseline.json
+
+``--compare`` exits with status 1 if any throughput dropped, or peak memory
+grew, by more than ``--tolerance`` (15% by default).
+"""
+import argparse
+import json
+import os
+import sys
+import tracemalloc
+from io import BytesIO
+
+MODELS = ('tag', 'reporter', 'article')
+FORMATS = ('json', 'xml')
+SIZES = (10, 1000, 100000)
+PHASES = ('parse', 'validate', 'hydrate')
+
+# Metrics where a higher value is a regression.
+LOWER_IS_BETTER = ('peak_kib',)
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    import django
+    django.setup()
+
+
+def get_model(name):
+    from django.apps import apps
+    return apps.get_model('benchmarks', name)
+
+
+def prepare(model, fmt, size):
+    from benchmarks.payloads import render
+    from benchmarks.transport import CannedClient
+    model.benchmark_format = fmt
+    CannedClient.payloads[model.get_resource_url_list()] = render(
+        model._meta.model_name, size, fmt)
+
+
+def repeat_for(size):
+    return max(1, min(50, 20000 // size))
+
+
+def measure_throughput(model, size, repeat):
+    """
+    Returns the best time of each phase (and their total) over ``repeat``
+    iterations of the whole queryset.
+    """
+    from django_roa.db.instrumentation import remote_call_finished
+    calls = []
+
+    def collect(sender, call, **kwargs):
+        calls.append(call)
+
+    remote_call_finished.connect(collect, sender=model)
+    try:
+        for i in range(repeat):
+            rows = len(list(model.objects.all()))
+            assert rows == size, "%s rows decoded instead of %s" % (rows, size)
+    finally:
+        remote_call_finished.disconnect(collect, sender=model)
+
+    best = dict((phase, min(call.timings[phase] for call in calls)) for phase in PHASES)
+    best['total'] = min(sum(call.timings[phase] for phase in PHASES) for call in calls)
+    return best
+
+
+def measure_memory(model, size):
+    """
+    Replays the pipeline steps of ``ROAModelIterable`` one by one under
+    ``tracemalloc``. Returns peak and retained KiB and the number of blocks
+    still allocated after each phase.
+    """
+    from benchmarks.transport import CannedClient
+    from django_roa.db.mapping import decode_keys
+    payload = CannedClient.payloads[model.get_resource_url_list()]
+    results = {}
+
+    def run(phase, func):
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        result = func()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count_diff for stat in after.compare_to(before, 'filename')
+                     if stat.count_diff > 0)
+        results[phase] = {'peak_kib': peak / 1024.0, 'retained_kib': current / 1024.0,
+                          'blocks': blocks}
+        return result
+
+    def validate(data):
+        serializer = model.get_serializer(data=data)
+        for name, field in serializer.child.fields.items():
+            field.validators = [validator for validator in field.validators
+                                if validator.__class__.__name__ != "UniqueValidator"]
+        assert serializer.is_valid(), serializer.errors
+        return serializer.validated_data
+
+    data = run('parse', lambda: decode_keys(model, model.get_parser().parse(BytesIO(payload))))
+    validated_data = run('validate', lambda: validate(data))
+    run('hydrate', lambda: [model(**item) for item in validated_data])
+    return results
+
+
+def run(models=MODELS, formats=FORMATS, sizes=SIZES, memory=True, out=sys.stdout):
+    results = {}
+    for name in models:
+        model = get_model(name)
+        for fmt in formats:
+            for size in sizes:
+                prepare(model, fmt, size)
+                timings = measure_throughput(model, size, repeat_for(size))
+                result = {'rows': size}
+                for phase in PHASES + ('total',):
+                    result['%s_rows_per_sec' % phase] = size / timings[phase] if timings[phase] else 0
+                if memory:
+                    for phase, stats in measure_memory(model, size).items():
+                        for metric, value in stats.items():
+                            result['%s_%s' % (phase, metric)] = value
+                key = '%s/%s/%s' % (name, fmt, size)
+                results[key] = result
+                out.write('%-24s %12.0f rows/s (parse %.0f, validate %.0f, hydrate %.0f)\n' % (
+                    key, result['total_rows_per_sec'], result['parse_rows_per_sec'],
+                    result['validate_rows_per_sec'], result['hydrate_rows_per_sec']))
+                out.flush()
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns report lines and the number of regressions of ``results``
+    against ``baseline``, for throughputs and peak memory.
+    """
+    lines, regressions = [], 0
+    lines.append('%-24s %-24s %14s %14s %8s' % ('benchmark', 'metric', 'baseline', 'current', 'change'))
+    for key in sorted(results):
+        if key not in baseline:
+            lines.append('%-24s (not in baseline)' % key)
+            continue
+        for metric in sorted(results[key]):
+            if not (metric.endswith('_rows_per_sec') or metric.endswith('_peak_kib')):
+                continue
+            old, new = baseline[key].get(metric), results[key][metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if metric.endswith(LOWER_IS_BETTER) else change < -tolerance
+            regressions += worse
+            lines.append('%-24s %-24s %14.1f %14.1f %+7.1f%%%s' % (
+                key, metric, old, new, change * 100, '  REGRESSION' if worse else ''))
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--models', default=','.join(MODELS))
+    parser.add_argument('--formats', default=','.join(FORMATS))
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES))
+    parser.add_argument('--no-memory', action='store_true', help="skip tracemalloc measures")
+    parser.add_argument('--save', metavar='FILE', help="write results as a JSON baseline")
+    parser.add_argument('--compare', metavar='FILE', help="compare results with a baseline")
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args(argv)
+
+    setup()
+    results = run(models=args.models.split(','), formats=args.formats.split(','),
+                  sizes=[int(size) for size in args.sizes.split(',')],
+                  memory=not args.no_memory)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance)
+        print('\n'.join(lines))
+        print('%d regression(s) beyond %.0f%%' % (regressions, args.tolerance * 100))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,34 @@
+"""
+Relations are exchanged as primary keys so that validation does not fetch
+related resources, which would measure the transport instead.
+"""
+from rest_framework import serializers
+from .models import Account, Reporter, Article, Tag
+
+
+class AccountSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Account
+        fields = ('id', 'email')
+
+
+class ReporterSerializer(serializers.ModelSerializer):
+    account_id = serializers.IntegerField()
+
+    class Meta:
+        model = Reporter
+        fields = ('id', 'account_id', 'first_name', 'last_name')
+
+
+class ArticleSerializer(serializers.ModelSerializer):
+    reporter_id = serializers.IntegerField()
+
+    class Meta:
+        model = Article
+        fields = ('id', 'headline', 'pub_date', 'reporter_id')
+
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ('id', 'label')
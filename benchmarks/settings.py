@@ -0,0 +1,25 @@
+"""
+Django settings used by the benchmarks, no network nor database access.
+"""
+SECRET_KEY = 'benchmarks'
+
+INSTALLED_APPS = (
+    'django.contrib.contenttypes',
+    'django.contrib.auth',
+    'django_roa',
+    'benchmarks',
+)
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+USE_TZ = True
+
+ROA_MODELS = True
+ROA_FORMAT = 'json'
+ROA_CLIENT = 'benchmarks.transport.CannedClient'
+ROA_QUERY_LOG = False
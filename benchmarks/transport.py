@@ -0,0 +1,26 @@
+"""
+A ROA client answering every GET with a canned payload.
+"""
+
+
+class CannedResponse(object):
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def close(self):
+        pass
+
+
+class CannedClient(object):
+    # URL -> bytes, filled by the runner.
+    payloads = {}
+
+    def get(self, url, **kwargs):
+        return CannedResponse(self.payloads[url])
@@ -0,0 +1,60 @@
+"""
+Django Debug Toolbar panel listing the remote calls of a request.
+
+Add ``'django_roa.contrib.debug_toolbar.ROAPanel'`` to
+``DEBUG_TOOLBAR_PANELS``.
+"""
+from django.utils.html import format_html, format_html_join
+from django.utils.translation import ugettext_lazy as _, ungettext
+from debug_toolbar.panels import Panel
+
+from django_roa.db.querylog import QueryLog, format_origin
+
+
+class ROAPanel(Panel):
+    title = _('Remote resources')
+
+    def enable_instrumentation(self):
+        self._log = QueryLog()
+        self._log.start()
+
+    def disable_instrumentation(self):
+        self._log.stop()
+
+    @property
+    def nav_subtitle(self):
+        stats = self.get_stats()
+        count = len(stats.get('calls', []))
+        return ungettext('%(count)d call in %(duration).1fms',
+                         '%(count)d calls in %(duration).1fms', count) % {
+            'count': count, 'duration': stats.get('duration', 0)}
+
+    def generate_stats(self, request, response):
+        self.record_stats({
+            'calls': [(logged.call, format_origin(logged.origin)) for logged in self._log],
+            'n_plus_one': [(pattern, format_origin(pattern.origin))
+                           for pattern in self._log.n_plus_one()],
+            'duration': self._log.duration * 1000,
+        })
+
+    @property
+    def content(self):
+        stats = self.get_stats()
+        warnings = format_html_join(
+            '', '<li>{} {} ({}) called {} times from {}</li>',
+            ((pattern.method, pattern.url_template, pattern.model.__name__,
+              pattern.count, origin) for pattern, origin in stats['n_plus_one']))
+        rows = format_html_join(
+            '', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{:.1f}</td>'
+                '<td>{:.1f}</td><td>{:.1f}</td><td>{:.1f}</td><td>{:.1f}</td><td>{}</td></tr>',
+            ((call.method, call.url, call.model.__name__, call.status,
+              (call.duration or 0) * 1000, call.timings['network'] * 1000,
+              call.timings['parse'] * 1000, call.timings['validate'] * 1000,
+              call.timings['hydrate'] * 1000, origin)
+             for call, origin in stats['calls']))
+        return format_html(
+            '<h4>N+1 patterns</h4><ul>{}</ul>'
+            '<table><thead><tr><th>Method</th><th>URL</th><th>Model</th><th>Status</th>'
+            '<th>Total (ms)</th><th>Network</th><th>Parse</th><th>Validate</th>'
+            '<th>Hydrate</th><th>Origin</th></tr></thead><tbody>{}</tbody></table>',
+            warnings, rows)
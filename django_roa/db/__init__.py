@@ -1,8 +1,11 @@
-from threading import local
+import os
+from http.cookiejar import DefaultCookiePolicy
+from threading import local, Lock
 from django.conf import settings
 from django.utils.module_loading import import_string
 
 import requests
+from requests.adapters import HTTPAdapter
 
 
 ROA_SESSION_HEADERS_KEY = 'roa_session_headers_key'
@@ -11,6 +14,14 @@ ROA_SESSION_HEADERS_KEY = 'roa_session_headers_key'
 # Current thread access token:
 _roa_headers = local()
 
+# Current thread request, used by per-user authentication providers:
+_roa_request = local()
+
+# Process-wide session pooling connections to ROA hosts:
+_roa_session = None
+_roa_session_pid = None
+_roa_session_lock = Lock()
+
 
 def set_roa_headers(request, headers=None):
 
@@ -37,9 +48,91 @@ def reset_roa_headers():
         del _roa_headers.value
 
 
-def get_roa_client():
-    client = getattr(settings, 'ROA_CLIENT', None)
+def set_roa_request(request):
+    _roa_request.value = request
+
+
+def get_roa_user():
+    request = getattr(_roa_request, 'value', None)
+    return getattr(request, 'user', None)
+
+
+def reset_roa_request():
+    if hasattr(_roa_request, 'value'):
+        del _roa_request.value
+
+
+def get_roa_context():
+    """
+    Returns the ROA headers and request of the current thread, to be passed
+    to ``set_roa_context`` in threads working on its behalf.
+    """
+    return getattr(_roa_headers, 'value', None), getattr(_roa_request, 'value', None)
+
+
+def set_roa_context(context):
+    """
+    Sets the ROA headers and request of the current thread to those of
+    ``context``, as returned by ``get_roa_context``.
+    """
+    for value, store in zip(context, (_roa_headers, _roa_request)):
+        if value is not None:
+            store.value = value
+        elif hasattr(store, 'value'):
+            del store.value
+
+
+class _RejectCookiesPolicy(DefaultCookiePolicy):
+    """
+    Cookie policy of the pooled session, which is shared by every thread
+    and user: cookies set by ROA hosts are neither kept nor sent back.
+    """
+
+    def set_ok(self, cookie, request):
+        return False
+
+    def return_ok(self, cookie, request):
+        return False
+
+
+def get_roa_session():
+    """
+    Returns the ``requests.Session`` of the current process, keeping up to
+    ``ROA_POOL_MAXSIZE`` connections open to each of ``ROA_POOL_CONNECTIONS``
+    hosts. A forked process gets its own session instead of sharing the
+    sockets of its parent. The session keeps no cookies, which would leak
+    from a user to another.
+    """
+    global _roa_session, _roa_session_pid
+    if _roa_session is None or _roa_session_pid != os.getpid():
+        with _roa_session_lock:
+            if _roa_session is None or _roa_session_pid != os.getpid():
+                session = requests.Session()
+                session.cookies.set_policy(_RejectCookiesPolicy())
+                adapter = HTTPAdapter(pool_connections=getattr(settings, 'ROA_POOL_CONNECTIONS', 10),
+                                      pool_maxsize=getattr(settings, 'ROA_POOL_MAXSIZE', 10))
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _roa_session, _roa_session_pid = session, os.getpid()
+    return _roa_session
+
+
+def get_roa_client(model=None):
+    """
+    Returns the client of ``model``, its ``roa_client`` attribute if it has
+    one, the ``ROA_CLIENT`` setting otherwise, defaulting to the pooled
+    session of ``get_roa_session``.
+    """
+    client = getattr(model, 'roa_client', None) or getattr(settings, 'ROA_CLIENT', None)
     if client is not None:
         client_class = import_string(client)
         return client_class()
-    return requests
+    return get_roa_session()
+
+
+def get_roa_models():
+    """
+    Returns the installed models managed by django_roa.
+    """
+    from django.apps import apps
+    return [model for model in apps.get_models() if hasattr(model.objects, 'is_roa_manager')]
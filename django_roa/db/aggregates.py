@@ -0,0 +1,242 @@
+"""
+Aggregation of remote resources.
+
+``aggregate()`` and ``values(...).annotate()`` are sent to the aggregation
+URL of a model, ``get_resource_url_aggregate()`` (``<list URL>aggregate/``
+by default), when its capabilities list the aggregate functions, e.g.
+``'aggregates': ['count', 'sum']``::
+
+    GET /articles/aggregate/?aggregate=score__sum:sum:score,n:count:*&group_by=reporter
+
+The server answers ``{"score__sum": 12, "n": 3}``, or for grouped queries a
+list of such objects also holding the ``group_by`` fields, see
+``ROAModel.aggregate_response``. Filters are sent as for lists.
+
+Otherwise aggregates are computed while streaming the rows of the list,
+without validating them nor building instances, in memory proportional to
+the number of groups (and of distinct values for ``distinct=True``).
+"""
+import math
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.expressions import Star
+
+from django_roa.db.exceptions import ROANotImplementedYetException
+from django_roa.db.lookups import get_field, to_python
+
+ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
+
+AGGREGATE_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('AGGREGATE', 'aggregate')
+GROUP_BY_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('GROUP_BY', 'group_by')
+
+
+class Accumulator(object):
+    """
+    Computes an aggregate over values added one by one.
+    """
+
+    def __init__(self, distinct=False, sample=False):
+        self.seen = set() if distinct else None
+        self.sample = sample
+
+    def add(self, value):
+        if value is None:
+            return
+        if self.seen is not None:
+            if value in self.seen:
+                return
+            self.seen.add(value)
+        self.update(value)
+
+    def update(self, value):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class CountAccumulator(Accumulator):
+    count = 0
+
+    def update(self, value):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+
+class SumAccumulator(Accumulator):
+    total = None
+
+    def update(self, value):
+        self.total = value if self.total is None else self.total + value
+
+    def result(self):
+        return self.total
+
+
+class AvgAccumulator(SumAccumulator):
+    count = 0
+
+    def update(self, value):
+        super(AvgAccumulator, self).update(value)
+        self.count += 1
+
+    def result(self):
+        return self.total / self.count if self.count else None
+
+
+class MinAccumulator(Accumulator):
+    value = None
+
+    def update(self, value):
+        if self.value is None or value < self.value:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+
+class MaxAccumulator(MinAccumulator):
+
+    def update(self, value):
+        if self.value is None or value > self.value:
+            self.value = value
+
+
+class VarianceAccumulator(Accumulator):
+    """
+    Welford's online algorithm.
+    """
+    count = 0
+    mean = 0.0
+    m2 = 0.0
+
+    def update(self, value):
+        value = float(value)
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def result(self):
+        count = self.count - 1 if self.sample else self.count
+        return self.m2 / count if count > 0 else None
+
+
+class StdDevAccumulator(VarianceAccumulator):
+
+    def result(self):
+        variance = super(StdDevAccumulator, self).result()
+        return math.sqrt(variance) if variance is not None else None
+
+
+ACCUMULATORS = {
+    'count': CountAccumulator,
+    'sum': SumAccumulator,
+    'avg': AvgAccumulator,
+    'min': MinAccumulator,
+    'max': MaxAccumulator,
+    'variance': VarianceAccumulator,
+    'stddev': StdDevAccumulator,
+}
+
+
+def get_function(aggregate):
+    """
+    Returns the lowercased name of an aggregate, e.g. ``'sum'``.
+    """
+    return aggregate.name.lower()
+
+
+def get_source(aggregate):
+    """
+    Returns the field name an aggregate applies to, None for ``Count('*')``.
+    """
+    if get_function(aggregate) not in ACCUMULATORS:
+        raise ROANotImplementedYetException('Unsupported aggregate: %s' % aggregate.name)
+    if getattr(aggregate, 'filter', None) is not None:
+        raise ROANotImplementedYetException('Filtered aggregates are not supported: %s' % aggregate)
+    expressions = aggregate.get_source_expressions()
+    if len(expressions) != 1:
+        raise ROANotImplementedYetException('Unsupported aggregate: %s' % aggregate)
+    if isinstance(expressions[0], Star):
+        return None
+    if not hasattr(expressions[0], 'name'):
+        raise ROANotImplementedYetException(
+            'Aggregates of expressions are not supported: %s' % aggregate)
+    return expressions[0].name
+
+
+def get_annotations(args, kwargs):
+    """
+    Returns aggregates by alias, Django's default alias for positional
+    arguments.
+    """
+    annotations = OrderedDict()
+    for aggregate in args:
+        try:
+            alias = aggregate.default_alias
+        except (AttributeError, TypeError):
+            raise TypeError('Complex aggregates require an alias')
+        annotations[alias] = aggregate
+    annotations.update(kwargs)
+    for aggregate in annotations.values():
+        get_source(aggregate)
+    return annotations
+
+
+def encode_annotations(annotations):
+    """
+    Returns the value of the aggregate parameter: ``alias:function:field``
+    items separated by commas.
+    """
+    return ','.join('%s:%s:%s' % (alias, get_function(aggregate), get_source(aggregate) or '*')
+                    for alias, aggregate in annotations.items())
+
+
+def get_row_value(model, row, name):
+    """
+    Returns the value of the field ``name`` in a decoded row, converted to
+    Python.
+    """
+    field = get_field(model, name)
+    value = row.get(field.name, row.get(field.attname))
+    if field.is_relation and isinstance(value, dict):
+        value = value.get(field.target_field.name)
+    return to_python(field, value)
+
+
+def aggregate_objects(objects, annotations, group_by, get_value):
+    """
+    Returns a dict of the aggregates of each group of ``objects``, rows or
+    instances, as in ``values(*group_by).annotate(**annotations)``.
+    ``get_value(obj, name)`` returns the value of a field.
+    """
+    sources = [(alias, get_source(aggregate)) for alias, aggregate in annotations.items()]
+
+    def accumulators():
+        return [(alias, source, ACCUMULATORS[get_function(aggregate)](
+            distinct=getattr(aggregate, 'distinct', False),
+            sample=getattr(aggregate, 'function', '').endswith('SAMP')))
+            for (alias, source), aggregate in zip(sources, annotations.values())]
+
+    groups = OrderedDict()
+    for obj in objects:
+        key = tuple(get_value(obj, name) for name in group_by)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = accumulators()
+        for alias, source, accumulator in group:
+            accumulator.add(1 if source is None else get_value(obj, source))
+    if not group_by and not groups:
+        groups[()] = accumulators()
+
+    results = []
+    for key, group in groups.items():
+        result = OrderedDict(zip(group_by, key))
+        for alias, source, accumulator in group:
+            result[alias] = accumulator.result()
+        results.append(result)
+    return results
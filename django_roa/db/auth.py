@@ -0,0 +1,384 @@
+"""
+Authentication providers for ROA requests.
+
+A provider returns the headers to send with each request. Token based
+providers cache their tokens in-process, up to ``ROA_AUTH_MAX_TOKENS``, and
+in the Django cache (so that every worker shares the same token), refresh
+them ahead of expiry on a background thread and coordinate refreshes
+triggered by a 401 so that only one worker hits the token endpoint. Tokens
+of users are not shared unless asked to, under keys derived from
+``SECRET_KEY``.
+
+Configure one through the ``ROA_AUTH_PROVIDER`` setting::
+
+    ROA_AUTH_PROVIDER = {
+        'BACKEND': 'django_roa.db.auth.ClientCredentialsAuthProvider',
+        'OPTIONS': {
+            'token_url': 'https://auth.example.com/oauth2/token/',
+            'client_id': '...',
+            'client_secret': '...',
+        },
+    }
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+from django.utils.module_loading import import_string
+
+from django_roa.db import get_roa_client, get_roa_user
+from django_roa.db.exceptions import ROAException
+
+logger = logging.getLogger("django_roa")
+
+ROA_AUTH_PROVIDER = getattr(settings, 'ROA_AUTH_PROVIDER', None)
+ROA_AUTH_CACHE = getattr(settings, 'ROA_AUTH_CACHE', 'default')
+ROA_AUTH_REFRESH_MARGIN = getattr(settings, 'ROA_AUTH_REFRESH_MARGIN', 60)
+ROA_AUTH_LOCK_TIMEOUT = getattr(settings, 'ROA_AUTH_LOCK_TIMEOUT', 10)
+ROA_AUTH_MAX_TOKENS = getattr(settings, 'ROA_AUTH_MAX_TOKENS', 1000)
+ROA_SSL_CA = getattr(settings, 'ROA_SSL_CA', None)
+
+
+class Token(namedtuple('Token', 'value expires_at')):
+    """
+    An access token and its absolute expiry timestamp.
+    """
+
+    def expires_in(self):
+        return self.expires_at - time.time()
+
+    def is_fresh(self, margin=0):
+        return self.expires_in() > margin
+
+
+class BaseAuthProvider(object):
+    """
+    Returns the authentication headers sent with ROA requests.
+    """
+
+    def get_headers(self):
+        raise NotImplementedError
+
+    def refresh(self, rejected_headers):
+        """
+        Called once when the server answers 401 to a request sent with
+        ``rejected_headers``. Returns True if the request should be retried.
+        """
+        return False
+
+    def after_fork(self):
+        """
+        Called in worker processes forked after the provider was used.
+        """
+
+
+class TokenAuthProvider(BaseAuthProvider):
+    """
+    Base class of providers sending a cached, expiring token.
+
+    Subclasses implement ``fetch_token`` and may override ``get_token_key``
+    to hold one token per user instead of a single shared one. Tokens are
+    shared with other workers through the Django cache if ``share_tokens``.
+    """
+    header_name = 'Authorization'
+    header_format = 'Bearer %s'
+    background_refresh = True
+    share_tokens = True
+
+    def __init__(self, cache_alias=ROA_AUTH_CACHE, cache_prefix=None,
+                 refresh_margin=ROA_AUTH_REFRESH_MARGIN,
+                 lock_timeout=ROA_AUTH_LOCK_TIMEOUT, background_refresh=None,
+                 share_tokens=None, max_tokens=ROA_AUTH_MAX_TOKENS):
+        self.cache_alias = cache_alias
+        self.cache_prefix = cache_prefix or 'django_roa:token:%s' % self.__class__.__name__
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+        if background_refresh is not None:
+            self.background_refresh = background_refresh
+        if share_tokens is not None:
+            self.share_tokens = share_tokens
+        self.max_tokens = max_tokens
+        # Least recently fetched first.
+        self._tokens = OrderedDict()
+        self._timers = {}
+        # Guards _tokens and _timers, never held while waiting for a token.
+        self._lock = threading.RLock()
+
+    def fetch_token(self, key):
+        """
+        Requests a new token from the authority, returns a ``Token``.
+        """
+        raise NotImplementedError
+
+    def get_token_key(self):
+        """
+        Identifies the token to use for the current request, None when the
+        request must be sent without credentials.
+        """
+        return 'shared'
+
+    def get_headers(self):
+        key = self.get_token_key()
+        if key is None:
+            return {}
+        return {self.header_name: self.header_format % self.get_token(key).value}
+
+    def get_token(self, key):
+        token = self._tokens.get(key)
+        if token is not None and (token.is_fresh(self.refresh_margin) or
+                                  (self.background_refresh and token.is_fresh())):
+            return token
+        token = self._load(key)
+        if token is None or not token.is_fresh(self.refresh_margin):
+            token = self._fetch(key, stale=token)
+        with self._lock:
+            self._remember(key, token)
+        return token
+
+    def refresh(self, rejected_headers):
+        key = self.get_token_key()
+        if key is None:
+            return False
+        rejected = rejected_headers.get(self.header_name)
+        # Another thread may already have replaced the rejected token.
+        token = self._tokens.get(key)
+        if token is not None and self.header_format % token.value != rejected:
+            return True
+        token = self._load(key)
+        if token is None or self.header_format % token.value == rejected:
+            token = self._fetch(key, stale=token, force=True)
+        with self._lock:
+            self._remember(key, token)
+        return True
+
+    def after_fork(self):
+        # Timers are threads, which do not survive a fork.
+        self._lock = threading.RLock()
+        self._timers = {}
+        for key, token in list(self._tokens.items()):
+            self._remember(key, token)
+
+    def _cache_key(self, key):
+        # Keys of user tokens cannot be guessed without SECRET_KEY.
+        return '%s:%s' % (self.cache_prefix, salted_hmac(self.cache_prefix, key).hexdigest())
+
+    def _load(self, key):
+        if not self.share_tokens:
+            return None
+        value = caches[self.cache_alias].get(self._cache_key(key))
+        return Token(*value) if value is not None else None
+
+    def _fetch(self, key, stale=None, force=False):
+        """
+        Fetches a token while holding a cache lock so that only one worker
+        calls the token endpoint, the others wait for its result. Called
+        without holding ``_lock``, so that waiting blocks no other thread.
+        """
+        if not self.share_tokens:
+            return self.fetch_token(key)
+        cache = caches[self.cache_alias]
+        lock_key = '%s:lock' % self._cache_key(key)
+        if cache.add(lock_key, 1, self.lock_timeout):
+            try:
+                token = self.fetch_token(key)
+                cache.set(self._cache_key(key), tuple(token),
+                          max(1, int(token.expires_in())))
+            finally:
+                cache.delete(lock_key)
+            return token
+
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            token = self._load(key)
+            if token is not None and token != stale and \
+                    (force or token.is_fresh(self.refresh_margin)):
+                return token
+        logger.warning("Timed out waiting for another worker to refresh %s", self._cache_key(key))
+        return self.fetch_token(key)
+
+    def _remember(self, key, token):
+        self._forget(key)
+        self._tokens[key] = token
+        if len(self._tokens) > self.max_tokens:
+            # Expired tokens, or the least recently fetched ones.
+            expired = [other for other, value in self._tokens.items() if not value.is_fresh()]
+            for forgotten in expired or list(self._tokens)[:len(self._tokens) - self.max_tokens]:
+                self._forget(forgotten)
+        if not self.background_refresh or key not in self._tokens:
+            return
+        # Never refresh tokens living less than the margin in a tight loop.
+        delay = max(token.expires_in() - self.refresh_margin, token.expires_in() / 2, 1)
+        timer = threading.Timer(delay, self._refresh_in_background, [key, token])
+        timer.daemon = True
+        self._timers[key] = timer
+        timer.start()
+
+    def _forget(self, key):
+        self._tokens.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+    def _refresh_in_background(self, key, token):
+        try:
+            if self._tokens.get(key) != token:
+                return
+            shared = self._load(key)
+            if shared is None or not shared.is_fresh(self.refresh_margin):
+                shared = self._fetch(key, stale=shared)
+            with self._lock:
+                if self._tokens.get(key) == token:
+                    self._remember(key, shared)
+        except Exception:
+            logger.exception("Background refresh of %s failed", self._cache_key(key))
+
+
+class ClientCredentialsAuthProvider(TokenAuthProvider):
+    """
+    OAuth2 client credentials grant (RFC 6749, section 4.4).
+    """
+
+    def __init__(self, token_url, client_id, client_secret, scope=None,
+                 audience=None, **kwargs):
+        super(ClientCredentialsAuthProvider, self).__init__(**kwargs)
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.audience = audience
+
+    def fetch_token(self, key):
+        data = {'grant_type': 'client_credentials'}
+        if self.scope:
+            data['scope'] = self.scope
+        if self.audience:
+            data['audience'] = self.audience
+        kwargs = {'verify': ROA_SSL_CA} if ROA_SSL_CA else {}
+        try:
+            response = get_roa_client().post(self.token_url, data=data,
+                                             auth=(self.client_id, self.client_secret),
+                                             headers={'Accept': 'application/json'},
+                                             **kwargs)
+        except Exception as e:
+            raise ROAException(e)
+        if response.status_code != 200:
+            raise ROAException('Token request to %s failed with status %s: %s' % (
+                self.token_url, response.status_code, response.text))
+        payload = response.json()
+        return Token(payload['access_token'],
+                     time.time() + int(payload.get('expires_in', 3600)))
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+class JWTAuthProvider(TokenAuthProvider):
+    """
+    Sends self-signed JSON Web Tokens.
+
+    HMAC algorithms are handled natively, any other one requires PyJWT.
+    """
+    HMAC_ALGORITHMS = {
+        'HS256': hashlib.sha256,
+        'HS384': hashlib.sha384,
+        'HS512': hashlib.sha512,
+    }
+
+    def __init__(self, key, algorithm='HS256', issuer=None, subject=None,
+                 audience=None, lifetime=300, claims=None, **kwargs):
+        super(JWTAuthProvider, self).__init__(**kwargs)
+        self.key = key
+        self.algorithm = algorithm
+        self.issuer = issuer
+        self.subject = subject
+        self.audience = audience
+        self.lifetime = lifetime
+        self.claims = claims or {}
+
+    def get_claims(self, key, now):
+        claims = dict(self.claims, iat=int(now), exp=int(now + self.lifetime))
+        for name, value in (('iss', self.issuer), ('sub', self.subject), ('aud', self.audience)):
+            if value is not None:
+                claims[name] = value
+        return claims
+
+    def fetch_token(self, key):
+        now = time.time()
+        claims = self.get_claims(key, now)
+        if self.algorithm in self.HMAC_ALGORITHMS:
+            header = {'alg': self.algorithm, 'typ': 'JWT'}
+            signing_input = b'.'.join(
+                _b64(json.dumps(part, separators=(',', ':'), sort_keys=True).encode('utf-8'))
+                for part in (header, claims))
+            key = self.key.encode('utf-8') if isinstance(self.key, str) else self.key
+            signature = hmac.new(key, signing_input, self.HMAC_ALGORITHMS[self.algorithm]).digest()
+            value = (signing_input + b'.' + _b64(signature)).decode('ascii')
+        else:
+            import jwt
+            value = jwt.encode(claims, self.key, algorithm=self.algorithm)
+            if isinstance(value, bytes):
+                value = value.decode('ascii')
+        return Token(value, now + self.lifetime)
+
+
+class DelegatedTokenAuthProvider(TokenAuthProvider):
+    """
+    Holds one token per authenticated user, as set by ``ROAMiddleware``.
+
+    ``token_function`` (a callable or its dotted path) receives the user and
+    returns an ``(access_token, expires_in)`` tuple. Requests made without an
+    authenticated user are sent without credentials. Tokens stay in the
+    process unless ``share_tokens`` is set.
+    """
+    background_refresh = False
+    share_tokens = False
+
+    def __init__(self, token_function, **kwargs):
+        super(DelegatedTokenAuthProvider, self).__init__(**kwargs)
+        if isinstance(token_function, str):
+            token_function = import_string(token_function)
+        self.token_function = token_function
+
+    def get_token_key(self):
+        user = get_roa_user()
+        if user is None or not getattr(user, 'is_authenticated', False):
+            return None
+        return 'user:%s' % user.pk
+
+    def fetch_token(self, key):
+        access_token, expires_in = self.token_function(get_roa_user())
+        return Token(access_token, time.time() + int(expires_in))
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_auth_provider():
+    """
+    Returns the provider configured by ``ROA_AUTH_PROVIDER``, or None.
+
+    The instance is shared by the whole process so that its tokens are.
+    """
+    global _provider
+    if ROA_AUTH_PROVIDER is None:
+        return None
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                config = ROA_AUTH_PROVIDER
+                if isinstance(config, str):
+                    config = {'BACKEND': config}
+                provider_class = import_string(config['BACKEND'])
+                _provider = provider_class(**config.get('OPTIONS', {}))
+    return _provider
@@ -0,0 +1,384 @@
+"""
+Unit of work batching the saves and deletes of ROA models.
+
+In a ``roa_batch()`` block, ``save()`` and ``delete()`` are recorded
+instead of sent, and flushed when the block exits::
+
+    with roa_batch():
+        reporter = Reporter(first_name='John', last_name='Doe', account=account)
+        reporter.save()
+        Article(headline='Hello', pub_date=today, reporter=reporter).save()
+        old_article.delete()
+
+Instances related to instances created in the batch are saved after them,
+with the primary keys assigned by the server. Each dependency level is sent
+as one request to ``ROA_BATCH_URL`` if set, a list of requests answered by a
+list of responses in the same order::
+
+    [{"method": "POST", "url": "<list url>", "body": {...}}, ...]
+    [{"status": 201, "body": {...}}, ...]
+
+otherwise as concurrent requests on up to ``ROA_BATCH_WORKERS`` threads,
+creations of a model whose list accepts arrays of rows, the ``bulk``
+capability, being sent as one request::
+
+    POST <list url>
+    [{...}, {...}]
+    [{"id": 1, ...}, {"id": 2, ...}]
+
+Payloads are serialized when the batch is flushed, primary keys are set and
+``post_save`` sent as responses are handled, on the thread that flushes.
+The first failure is raised once the requests of its level are done, leaving
+later levels unsent, as ``ROAException`` with the operations whose response
+was applied in ``applied``, the others of its level in ``failed`` and those
+of later levels in ``unsent``. Nothing is sent if the block raises.
+"""
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import local
+
+from django.conf import settings
+from django.db.models import signals
+
+from django_roa.db import get_roa_client, get_roa_context, get_roa_headers, set_roa_context
+from django_roa.db.capabilities import get_capabilities
+from django_roa.db.exceptions import ROAException
+from django_roa.db.instrumentation import RemoteCall, get_url_template
+from django_roa.db.lookups import delete_cached_value, get_cached_value, is_cached, set_cached_value
+from django_roa.db.mapping import decode_keys
+from django_roa.db.transport import parse_response, send_request
+
+logger = logging.getLogger("django_roa")
+
+ROA_BATCH_URL = getattr(settings, 'ROA_BATCH_URL', None)
+ROA_BATCH_WORKERS = getattr(settings, 'ROA_BATCH_WORKERS', 4)
+
+# Current thread batch:
+_roa_batch = local()
+
+
+def get_batch():
+    """
+    Returns the batch recording the saves and deletes of the current
+    thread, if any.
+    """
+    return getattr(_roa_batch, 'value', None)
+
+
+class Operation(object):
+    """
+    A recorded save or delete.
+    """
+    __slots__ = ('instance', 'cls', 'origin', 'raw', 'force_update', 'delete',
+                 'relations', 'level', 'created')
+
+    def __init__(self, instance, cls=None, origin=None, raw=False, force_update=False,
+                 delete=False, relations=()):
+        self.instance = instance
+        self.cls = cls or instance.__class__
+        self.origin = origin
+        self.raw = raw
+        self.force_update = force_update
+        self.delete = delete
+        # (field, related instance) pairs, saved first.
+        self.relations = relations
+        self.level = 0
+        self.created = False
+
+
+class Batch(object):
+    """
+    Saves and deletes recorded until ``flush()``.
+    """
+
+    def __init__(self, url=None, workers=None):
+        self.url = url if url is not None else ROA_BATCH_URL
+        self.workers = workers or ROA_BATCH_WORKERS
+        self.operations = []
+        # Last operation recorded on an instance, by id.
+        self.last = {}
+        # Relations to pending instances of instances being saved, by id.
+        self.deferred = {}
+        # Operations whose response was applied by the last flush.
+        self.applied = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def is_pending(self, instance):
+        """
+        Returns True if ``instance`` is created by an unsent operation.
+        """
+        operation = self.last.get(id(instance))
+        return operation is not None and not operation.delete and instance.pk is None
+
+    def get_pending_relations(self, instance):
+        """
+        Returns the ``(field, related instance)`` pairs of the foreign keys of
+        ``instance`` to instances created in the batch.
+        """
+        relations = []
+        for field in instance._meta.concrete_fields:
+            if field.is_relation and is_cached(field, instance):
+                related = get_cached_value(field, instance)
+                if related is not None and self.is_pending(related):
+                    relations.append((field, related))
+        return relations
+
+    @contextmanager
+    def deferring_relations(self, instance):
+        """
+        Hides the relations of ``instance`` to pending instances in its
+        block, Django refusing to save instances related to unsaved ones.
+        """
+        relations = self.deferred[id(instance)] = self.get_pending_relations(instance)
+        for field, related in relations:
+            delete_cached_value(field, instance)
+        try:
+            yield
+        finally:
+            del self.deferred[id(instance)]
+            for field, related in relations:
+                set_cached_value(field, instance, related)
+
+    def record(self, operation):
+        previous = self.last.get(id(operation.instance))
+        if previous is not None:
+            operation.level = previous.level + 1
+        for field, related in operation.relations:
+            operation.level = max(operation.level, self.last[id(related)].level + 1)
+        self.operations.append(operation)
+        self.last[id(operation.instance)] = operation
+
+    def save(self, instance, cls, origin, raw, force_update):
+        relations = self.deferred.get(id(instance))
+        if relations is None:
+            relations = self.get_pending_relations(instance)
+        self.record(Operation(instance, cls, origin, raw, force_update, relations=relations))
+
+    def delete(self, instance):
+        self.record(Operation(instance, delete=True))
+
+    def flush(self):
+        """
+        Sends the recorded operations, level by level.
+        """
+        operations, self.operations, self.last = self.operations, [], {}
+        self.applied = []
+        levels = {}
+        for operation in operations:
+            levels.setdefault(operation.level, []).append(operation)
+        for level in sorted(levels):
+            for operation in levels[level]:
+                for field, related in operation.relations:
+                    setattr(operation.instance, field.attname, related.pk)
+            try:
+                if self.url:
+                    self.send_batch(levels[level])
+                else:
+                    self.send_concurrently(levels[level])
+            except Exception as e:
+                error = e if isinstance(e, ROAException) else ROAException(e)
+                applied = set(map(id, self.applied))
+                error.applied = list(self.applied)
+                error.failed = [operation for operation in levels[level] if id(operation) not in applied]
+                error.unsent = [operation for later in sorted(levels) if later > level
+                                for operation in levels[later]]
+                if error is e:
+                    raise
+                raise error from e
+
+    def get_request(self, operation):
+        """
+        Returns ``(method, url, url_template, payload, headers, client)`` of
+        the request of ``operation``, the payload not rendered yet.
+        """
+        instance = operation.instance
+        headers = get_roa_headers()
+        headers.update(instance.get_serializer_content_type())
+        client = get_roa_client(operation.cls)
+        if operation.delete:
+            url = instance.get_resource_url_detail()
+            logger.debug("""Deleting  : "%s" through %s""", instance, url)
+            return 'delete', url, get_url_template(url, instance.pk), None, headers, client
+        record_exists, method, url, url_template, payload = instance._get_save_request(
+            operation.cls, operation.force_update, headers, client)
+        operation.created = not record_exists
+        return method, url, url_template, payload, headers, client
+
+    def done(self, operation, status, data, call):
+        """
+        Applies the response to ``operation``, ``data`` being its decoded
+        body.
+        """
+        instance = operation.instance
+        if operation.delete:
+            instance._set_deleted(status)
+        else:
+            if status is not None and status >= 400:
+                raise ROAException('Batched save of %s failed with status %s: %s' % (
+                    instance, status, data))
+            obj = instance._set_saved(operation.cls, data, call)
+            if operation.origin:
+                signals.post_save.send(sender=operation.origin, instance=obj,
+                                       created=operation.created, raw=operation.raw)
+        self.applied.append(operation)
+
+    def send_concurrently(self, operations):
+        """
+        Sends ``operations`` as concurrent requests, creations of instances
+        of a model whose list accepts arrays of rows (the ``bulk``
+        capability) as one request.
+        """
+        requests, bulk = [], OrderedDict()
+        for operation in operations:
+            method, url, url_template, payload, headers, client = self.get_request(operation)
+            if operation.created and get_capabilities(operation.cls).bulk:
+                bulk.setdefault((operation.cls, url), []).append((operation, payload, headers, client))
+                continue
+            call = RemoteCall(method, operation.cls, url, url_template=url_template)
+            data = None if payload is None else operation.instance.get_renderer().render(payload)
+            requests.append(([operation], call, (client, method, url),
+                             dict(model=operation.cls, data=data, headers=headers, call=call)))
+        for (cls, url), created in bulk.items():
+            operation, payload, headers, client = created[0]
+            call = RemoteCall('post', cls, url)
+            payloads = [payload for operation, payload, headers, client in created]
+            data = operation.instance.get_renderer().render(payloads if len(payloads) > 1 else payload)
+            requests.append(([operation for operation, payload, headers, client in created], call,
+                             (client, 'post', url), dict(model=cls, data=data, headers=headers, call=call)))
+        futures = run_concurrently([(send_request, args, kwargs)
+                                    for sent, call, args, kwargs in requests], self.workers)
+
+        error = None
+        for (sent, call, args, kwargs), future in zip(requests, futures):
+            try:
+                response = future.result()
+                data = None
+                if not sent[0].delete:
+                    with call.phase('parse'):
+                        data = parse_response(sent[0].instance.get_parser(), response, call)
+                        data = decode_keys(sent[0].cls, data)
+                if len(sent) == 1:
+                    self.done(sent[0], response.status_code, data, call)
+                    continue
+                if response.status_code < 400 and (not isinstance(data, list) or len(data) != len(sent)):
+                    raise ROAException('Bulk creation of %s answered %s rows for %s: %s' % (
+                        sent[0].cls.__name__, len(data) if isinstance(data, list) else 'no',
+                        len(sent), data))
+                for i, operation in enumerate(sent):
+                    self.done(operation, response.status_code,
+                              data[i] if response.status_code < 400 else data, call)
+            except Exception as e:
+                call.finish(exception=e)
+                error = error or e
+            finally:
+                call.finish()
+        if error is not None:
+            raise error
+
+    def send_batch(self, operations):
+        requests = []
+        for operation in operations:
+            method, url, url_template, payload, headers, client = self.get_request(operation)
+            request = {'method': method.upper(), 'url': url}
+            if payload is not None:
+                request['body'] = payload
+            requests.append(request)
+        call = RemoteCall('post', operations[0].cls, self.url)
+        try:
+            responses = post_batch(self.url, operations[0].cls, requests, call)
+            error = None
+            for operation, request, answer in zip(operations, requests, responses):
+                status = answer.get('status') if isinstance(answer, dict) else None
+                if not isinstance(status, int):
+                    error = error or ROAException('Malformed batch response to %s %s: %s' % (
+                        request['method'], request['url'], answer))
+                    continue
+                body = answer.get('body')
+                if body is not None:
+                    body = decode_keys(operation.cls, body)
+                try:
+                    self.done(operation, status, body, call)
+                except ROAException as e:
+                    error = error or e
+            if error is not None:
+                raise error
+        except Exception as e:
+            call.finish(exception=e)
+            raise
+        finally:
+            call.finish()
+
+
+def post_batch(url, model, requests, call):
+    """
+    Posts ``requests`` to the batch endpoint at ``url`` with the client and
+    format of ``model``, returns their responses.
+    """
+    instance = model()
+    headers = get_roa_headers()
+    headers.update(instance.get_serializer_content_type())
+    response = send_request(get_roa_client(model), 'post', url, model=model,
+                            data=instance.get_renderer().render(requests), headers=headers, call=call)
+    with call.phase('parse'):
+        responses = parse_response(model.get_parser(), response, call)
+    if response.status_code >= 400 or not isinstance(responses, list) or \
+            len(responses) != len(requests):
+        raise ROAException('Batch request failed with status %s: %s' % (
+            response.status_code, responses))
+    return responses
+
+
+def run_concurrently(tasks, workers=None):
+    """
+    Runs the ``(function, args, kwargs)`` tasks on up to ``workers`` threads
+    with the ROA context of the current thread, on it if there is a single
+    one, and returns their futures once all are done.
+    """
+    # Imported on first use, out of the import of models.
+    from concurrent.futures import Future, ThreadPoolExecutor
+
+    if len(tasks) <= 1:
+        futures = []
+        for func, args, kwargs in tasks:
+            future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        return futures
+
+    context = get_roa_context()
+
+    def run(func, args, kwargs):
+        # Per-thread headers and user of per-user authentication providers.
+        set_roa_context(context)
+        return func(*args, **kwargs)
+
+    executor = ThreadPoolExecutor(max_workers=min(workers or ROA_BATCH_WORKERS, len(tasks)))
+    try:
+        return [executor.submit(run, *task) for task in tasks]
+    finally:
+        executor.shutdown(wait=True)
+
+
+@contextmanager
+def roa_batch(url=None, workers=None):
+    """
+    Records the saves and deletes of ROA models in its block and flushes
+    them at its end, see the module documentation. Nested blocks join the
+    outermost one.
+    """
+    batch = get_batch()
+    if batch is not None:
+        yield batch
+        return
+    batch = _roa_batch.value = Batch(url, workers)
+    try:
+        yield batch
+    finally:
+        del _roa_batch.value
+    batch.flush()
@@ -0,0 +1,110 @@
+"""
+What the server of each resource can evaluate.
+
+Declared with a ``roa_capabilities`` attribute on the model or in
+``ROA_MODEL_CAPABILITIES`` by ``'app_label.model_name'``. Every key is
+optional, a missing one meaning that the server supports everything, as
+django_roa has always assumed, except ``aggregates`` which requires an
+aggregation URL (see ``django_roa.db.aggregates``)::
+
+    roa_capabilities = {
+        # Field paths and their lookups, '__all__' for any lookup.
+        'filters': {'id': ['exact', 'in'], 'reporter': ['exact'], 'headline': '__all__'},
+        # Defaults to 'filters'.
+        'excludes': {},
+        # Q objects with OR or negated branches, see ROA_FILTER_EXPRESSION.
+        'filter_expression': False,
+        'ordering': ['id', 'pub_date'],
+        'search': True,
+        'slicing': True,
+        # Aggregate functions of the aggregation URL, none by default.
+        'aggregates': ['count', 'sum'],
+        # 'list', 'paginated' (one row page) or 'endpoint' (get_resource_url_count).
+        'count': 'list',
+        # None, 'page', 'limit_offset' or 'cursor', and its page size parameter.
+        'pagination': None,
+        'page_size_parameter': None,
+        # Whether lists create the rows of an array posted to them.
+        'bulk': False,
+        # Parameter selecting the fields of rows, e.g. 'fields'.
+        'sparse_fields': None,
+    }
+
+The query planner sends what the server supports and evaluates the rest
+locally; ``values()`` queries ask for their fields only if the server
+supports sparse fieldsets. Creations of a ``roa_batch()`` block are sent as
+one array of rows to bulk lists. With ``ROA_DISCOVERY``, undeclared keys
+are learned from the server, see ``django_roa.db.discovery``.
+"""
+from django.conf import settings
+
+from django_roa.db.discovery import discover
+from django_roa.db.filters import split_lookup
+from django_roa.db.mapping import get_model_key
+
+ROA_MODEL_CAPABILITIES = getattr(settings, 'ROA_MODEL_CAPABILITIES', {})
+
+ALL = '__all__'
+
+_capabilities = {}
+_UNDECLARED = {}
+
+
+class Capabilities(object):
+    """
+    Capabilities of the server of a resource.
+    """
+
+    def __init__(self, filters=ALL, excludes=None, filter_expression=True, ordering=ALL,
+                 search=True, slicing=True, aggregates=(), count='list', pagination=None,
+                 page_size_parameter=None, bulk=False, sparse_fields=None):
+        self.filters = filters
+        self.excludes = filters if excludes is None else excludes
+        self.filter_expression = filter_expression
+        self.ordering = ordering
+        self.search = search
+        self.slicing = slicing
+        self.aggregates = aggregates
+        self.count = count
+        self.pagination = pagination
+        self.page_size_parameter = page_size_parameter
+        self.bulk = bulk
+        self.sparse_fields = sparse_fields
+
+    def supports_lookup(self, key, exclude=False):
+        lookups = self.excludes if exclude else self.filters
+        if lookups == ALL:
+            return True
+        path, lookup = split_lookup(key)
+        allowed = lookups.get(path)
+        return allowed is not None and (allowed == ALL or lookup in allowed)
+
+    def supports_ordering(self, name):
+        return self.ordering == ALL or name.lstrip('-') in self.ordering
+
+    def supports_aggregate(self, name):
+        return self.aggregates == ALL or name.lower() in self.aggregates
+
+
+DEFAULT_CAPABILITIES = Capabilities()
+
+
+def get_capabilities(model):
+    """
+    Returns the ``Capabilities`` declared for ``model``, completed by those
+    discovered from its server.
+    """
+    if model is None:
+        return DEFAULT_CAPABILITIES
+    declared = getattr(model, 'roa_capabilities', None)
+    if declared is None:
+        declared = ROA_MODEL_CAPABILITIES.get(get_model_key(model), _UNDECLARED)
+    discovered = discover(model)
+    cached = _capabilities.get(model)
+    if cached is not None and cached[0] is declared and cached[1] is discovered:
+        return cached[2]
+    kwargs = dict(discovered)
+    kwargs.update(declared)
+    capabilities = Capabilities(**kwargs)
+    _capabilities[model] = declared, discovered, capabilities
+    return capabilities
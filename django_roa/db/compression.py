@@ -0,0 +1,105 @@
+"""
+Content-Encoding negotiation for ROA traffic.
+
+Responses are advertised through ``Accept-Encoding`` in the codings urllib3
+decodes, br and zstd only with their decoder installed for it, and decoded
+while they are streamed to the parser; request bodies are compressed when the target
+model or host declares support for it and the payload is large enough to be
+worth the CPU.
+"""
+import gzip
+import zlib
+from urllib.parse import urlparse
+
+from django.conf import settings
+from urllib3.response import HTTPResponse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# None means "advertise every coding urllib3 decodes in this process".
+ROA_ACCEPT_ENCODING = getattr(settings, 'ROA_ACCEPT_ENCODING', None)
+# {'app_label.model_name' or 'host[:port]': 'gzip'|'deflate'|'br'|'zstd'}
+ROA_REQUEST_ENCODING = getattr(settings, 'ROA_REQUEST_ENCODING', {})
+ROA_REQUEST_COMPRESSION_MIN_SIZE = getattr(settings, 'ROA_REQUEST_COMPRESSION_MIN_SIZE', 1024)
+ROA_COMPRESSION_LEVEL = getattr(settings, 'ROA_COMPRESSION_LEVEL', 6)
+
+
+def _zstd_compress(data):
+    return zstandard.ZstdCompressor(level=ROA_COMPRESSION_LEVEL).compress(data)
+
+
+# Ordered by preference: (name, compress)
+CODECS = [
+    ('gzip', lambda data: gzip.compress(data, ROA_COMPRESSION_LEVEL)),
+    ('deflate', lambda data: zlib.compress(data, ROA_COMPRESSION_LEVEL)),
+]
+if zstandard is not None:
+    CODECS.insert(0, ('zstd', _zstd_compress))
+if brotli is not None:
+    CODECS.insert(0, ('br', lambda data: brotli.compress(data, quality=ROA_COMPRESSION_LEVEL)))
+
+COMPRESSORS = dict(CODECS)
+
+# Response codings, ordered by preference.
+ACCEPTED_ENCODINGS = ('br', 'zstd', 'gzip', 'deflate')
+
+
+def get_accept_encoding():
+    """
+    Returns the ``Accept-Encoding`` header value sent with every request.
+    """
+    if ROA_ACCEPT_ENCODING is not None:
+        return ROA_ACCEPT_ENCODING
+    decoders = HTTPResponse.CONTENT_DECODERS
+    return ', '.join(name for name in ACCEPTED_ENCODINGS if name in decoders)
+
+
+def get_request_encoding(model, url):
+    """
+    Returns the encoding declared for request bodies sent to ``url`` on
+    behalf of ``model``, or None if the body must be sent as is.
+
+    A ``roa_request_encoding`` attribute on the model wins over the
+    ``ROA_REQUEST_ENCODING`` setting, which is looked up by model key first
+    and then by host.
+    """
+    encoding = getattr(model, 'roa_request_encoding', None)
+    if encoding is None and ROA_REQUEST_ENCODING:
+        if model is not None:
+            opts = model._meta
+            encoding = ROA_REQUEST_ENCODING.get('%s.%s' % (opts.app_label, opts.model_name))
+        if encoding is None:
+            encoding = ROA_REQUEST_ENCODING.get(urlparse(url).netloc)
+    return encoding
+
+
+def compress_payload(model, url, payload):
+    """
+    Compresses ``payload`` if the model/host supports it and it is larger
+    than ``ROA_REQUEST_COMPRESSION_MIN_SIZE``.
+
+    Returns a ``(payload, content_encoding)`` tuple, the encoding being None
+    when the payload has been left untouched.
+    """
+    if isinstance(payload, str):
+        payload = payload.encode(getattr(settings, 'DEFAULT_CHARSET', 'utf-8'))
+    if not isinstance(payload, bytes) or len(payload) < ROA_REQUEST_COMPRESSION_MIN_SIZE:
+        return payload, None
+    encoding = get_request_encoding(model, url)
+    if encoding is None:
+        return payload, None
+    try:
+        compress = COMPRESSORS[encoding]
+    except KeyError:
+        raise ValueError('Unsupported request encoding "%s", available: %s' % (
+            encoding, ', '.join(COMPRESSORS)))
+    return compress(payload), encoding
+
@@ -0,0 +1,246 @@
+"""
+Discovery of server capabilities.
+
+With ``ROA_DISCOVERY`` enabled, the capabilities of a model (see
+``django_roa.db.capabilities``) that are not declared are learned from the
+server, lazily on first use or at startup with ``discover_all()``:
+
+- ``'openapi'``: from the OpenAPI document at ``ROA_OPENAPI_URL`` (a URL, or
+  a dict of URLs by host): query parameters of the list operation give the
+  supported filters, ordering, search, slicing, pagination and sparse
+  fieldsets, the paths the count and aggregation endpoints and the request
+  body of the list POST operation bulk creation,
+- ``'options'``: from the ``OPTIONS`` answer of the list URL, whose
+  ``capabilities`` member, if any, holds the same keys as
+  ``roa_capabilities``.
+
+Results are kept in the ``ROA_DISCOVERY_CACHE`` Django cache for
+``ROA_DISCOVERY_TIMEOUT`` seconds, so that workers share them. After a
+failure, declared capabilities are used alone and discovery is tried again
+``ROA_DISCOVERY_RETRY`` seconds later (60).
+"""
+import hashlib
+import json
+import logging
+from time import monotonic
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_roa.db import get_roa_client, get_roa_headers, get_roa_models
+from django_roa.db.filters import FILTER_EXPRESSION_PARAMETER, split_lookup
+from django_roa.db.instrumentation import RemoteCall
+from django_roa.db.mapping import get_model_key
+from django_roa.db.transport import send_request
+
+logger = logging.getLogger("django_roa")
+
+# False, 'openapi' or 'options'
+ROA_DISCOVERY = getattr(settings, 'ROA_DISCOVERY', False)
+ROA_OPENAPI_URL = getattr(settings, 'ROA_OPENAPI_URL', None)
+ROA_DISCOVERY_CACHE = getattr(settings, 'ROA_DISCOVERY_CACHE', 'default')
+ROA_DISCOVERY_TIMEOUT = getattr(settings, 'ROA_DISCOVERY_TIMEOUT', 3600)
+ROA_DISCOVERY_RETRY = getattr(settings, 'ROA_DISCOVERY_RETRY', 60)
+ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
+
+FILTER_PREFIX = ROA_ARGS_NAMES_MAPPING.get('FILTER_', 'filter_')
+EXCLUDE_PREFIX = ROA_ARGS_NAMES_MAPPING.get('EXCLUDE_', 'exclude_')
+ORDER_BY_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('ORDER_BY', 'order_by')
+SEARCH_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('SEARCH_', 'search')
+LIMIT_START_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_START', 'limit_start')
+LIMIT_STOP_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_STOP', 'limit_stop')
+# Query parameter names of the usual pagination styles and sparse fieldsets
+PAGINATIONS = (
+    ('cursor', ('cursor',), 'page_size'),
+    ('limit_offset', ('limit', 'offset'), 'limit'),
+    ('page', ('page',), 'page_size'),
+)
+SPARSE_FIELDS_PARAMETERS = ('fields', 'fields[]', 'only')
+CAPABILITIES = frozenset((
+    'filters', 'excludes', 'filter_expression', 'ordering', 'search', 'slicing',
+    'aggregates', 'count', 'pagination', 'page_size_parameter', 'bulk', 'sparse_fields',
+))
+
+_NOTHING = {}
+_discovered = {}
+_documents = {}
+# Time of the last failed discovery, by model.
+_failures = {}
+
+
+def _get_cache_key(kind, url):
+    return 'django_roa.discovery.%s.%s' % (kind, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+
+def _fetch(model, method, url):
+    call = RemoteCall(method, model, url)
+    try:
+        response = send_request(get_roa_client(model), method, url, model=model,
+                                headers=get_roa_headers(), stream=False, call=call)
+    except Exception as e:
+        call.finish(exception=e)
+        raise
+    call.finish()
+    if response.status_code != 200:
+        raise ValueError('%s %s answered %s' % (method.upper(), url, response.status_code))
+    return response
+
+
+def get_openapi_document(model):
+    """
+    Returns the OpenAPI document describing ``model``, None if there is none.
+    """
+    url = ROA_OPENAPI_URL
+    if isinstance(url, dict):
+        url = url.get(urlsplit(model.get_resource_url_list()).netloc)
+    if not url:
+        return None
+    if url not in _documents:
+        cache = caches[ROA_DISCOVERY_CACHE]
+        cache_key = _get_cache_key('openapi', url)
+        document = cache.get(cache_key)
+        if document is None:
+            response = _fetch(model, 'get', url)
+            document = json.loads(response.content.decode('utf-8'))
+            cache.set(cache_key, document, ROA_DISCOVERY_TIMEOUT)
+        _documents[url] = document
+    return _documents[url]
+
+
+def _find_path(document, url):
+    paths = document.get('paths', {})
+    path = urlsplit(url).path.rstrip('/')
+    for candidate in sorted(paths, key=len, reverse=True):
+        # Paths are relative to the server URL, whose own path may prefix them.
+        if candidate.rstrip('/') and path.endswith(candidate.rstrip('/')):
+            return candidate, paths[candidate]
+    return None, None
+
+
+def parse_openapi(document, url):
+    """
+    Returns the capabilities of the list operation at ``url`` described in
+    an OpenAPI ``document``.
+    """
+    path, operations = _find_path(document, url)
+    if operations is None:
+        return {}
+    parameters = set(parameter.get('name') for parameter in
+                     operations.get('parameters', []) + operations.get('get', {}).get('parameters', [])
+                     if parameter.get('in') == 'query')
+
+    filters, excludes = {}, {}
+    for name in parameters:
+        for prefix, lookups in ((FILTER_PREFIX, filters), (EXCLUDE_PREFIX, excludes)):
+            if name.startswith(prefix):
+                field, lookup = split_lookup(name[len(prefix):])
+                lookups.setdefault(field, []).append(lookup)
+    capabilities = {
+        'filters': filters,
+        'excludes': excludes,
+        'filter_expression': FILTER_EXPRESSION_PARAMETER in parameters,
+        'ordering': '__all__' if ORDER_BY_PARAMETER in parameters else [],
+        'search': SEARCH_PARAMETER in parameters,
+        'slicing': LIMIT_START_PARAMETER in parameters and LIMIT_STOP_PARAMETER in parameters,
+    }
+
+    for pagination, names, page_size_parameter in PAGINATIONS:
+        if all(name in parameters for name in names):
+            capabilities['pagination'] = pagination
+            if page_size_parameter in parameters:
+                capabilities['page_size_parameter'] = page_size_parameter
+            break
+    for name in SPARSE_FIELDS_PARAMETERS:
+        if name in parameters:
+            capabilities['sparse_fields'] = name
+            break
+
+    count_path = '%s/count/' % path.rstrip('/')
+    if count_path in document.get('paths', {}) or count_path.rstrip('/') in document.get('paths', {}):
+        capabilities['count'] = 'endpoint'
+    elif capabilities.get('page_size_parameter'):
+        capabilities['count'] = 'paginated'
+
+    aggregate_path = '%s/aggregate/' % path.rstrip('/')
+    if aggregate_path in document.get('paths', {}):
+        capabilities['aggregates'] = '__all__'
+
+    schema = operations.get('post', {}).get('requestBody', {}).get('content', {})
+    schema = next(iter(schema.values()), {}).get('schema', {})
+    capabilities['bulk'] = schema.get('type') == 'array' or any(
+        option.get('type') == 'array' for option in schema.get('oneOf', []))
+    return capabilities
+
+
+def parse_options(response):
+    """
+    Returns the capabilities described by an ``OPTIONS`` answer.
+    """
+    capabilities = {}
+    try:
+        metadata = json.loads(response.content.decode('utf-8'))
+    except ValueError:
+        metadata = {}
+    if isinstance(metadata, dict) and isinstance(metadata.get('capabilities'), dict):
+        capabilities.update((key, value) for key, value in metadata['capabilities'].items()
+                            if key in CAPABILITIES)
+    return capabilities
+
+
+def discover(model):
+    """
+    Returns the capabilities of ``model`` learned from its server, as a dict
+    of ``Capabilities`` arguments, empty if discovery is disabled or failed.
+    """
+    if not ROA_DISCOVERY:
+        return _NOTHING
+    try:
+        return _discovered[model]
+    except KeyError:
+        pass
+    failed_at = _failures.get(model)
+    if failed_at is not None and monotonic() - failed_at < ROA_DISCOVERY_RETRY:
+        return _NOTHING
+    url = model.get_resource_url_list()
+    cache = caches[ROA_DISCOVERY_CACHE]
+    cache_key = _get_cache_key('%s.%s' % (ROA_DISCOVERY, get_model_key(model)), url)
+    capabilities = cache.get(cache_key)
+    if capabilities is None:
+        try:
+            if ROA_DISCOVERY == 'openapi':
+                document = get_openapi_document(model)
+                capabilities = parse_openapi(document, url) if document else {}
+            else:
+                capabilities = parse_options(_fetch(model, 'options', url))
+        except Exception as e:
+            logger.warning("Capability discovery failed for %s: %s", model.__name__, e)
+            _failures[model] = monotonic()
+            return _NOTHING
+        cache.set(cache_key, capabilities, ROA_DISCOVERY_TIMEOUT)
+    _failures.pop(model, None)
+    _discovered[model] = capabilities
+    return capabilities
+
+
+def discover_all(models=None):
+    """
+    Discovers the capabilities of ``models``, every ROA model by default.
+    """
+    if models is None:
+        models = get_roa_models()
+    return dict((model, discover(model)) for model in models)
+
+
+def forget(model=None):
+    """
+    Forgets what was discovered in this process, for ``model`` or every
+    model.
+    """
+    if model is None:
+        _discovered.clear()
+        _documents.clear()
+        _failures.clear()
+    else:
+        _discovered.pop(model, None)
+        _failures.pop(model, None)
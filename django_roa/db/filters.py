@@ -0,0 +1,202 @@
+"""
+Server side filter expressions built from Q objects.
+
+Keyword filters are sent as one ``filter_<lookup>`` parameter each, which
+can only express a conjunction. Q objects with OR branches, negations or
+nesting are rendered into a single parameter, ``filter`` by default (see
+``ROA_ARGS_NAMES_MAPPING``), in the syntax selected by
+``ROA_FILTER_EXPRESSION`` or the ``roa_filter_expression`` attribute of a
+model:
+
+- ``'json'``: ``{"or":[{"headline__icontains":"django"},{"not":{"score__gt":3}}]}``
+- ``'rql'``: ``or(icontains(headline,django),not(gt(score,3)))``
+- the dotted path of a ``FilterExpression`` subclass for other syntaxes.
+
+Without a syntax, Q objects made of conjunctions are sent as keyword
+filters, others are evaluated locally (see ``QueryPlan``).
+"""
+import datetime
+import decimal
+import json
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models import Model
+from django.db.models.query_utils import Q
+from django.utils.module_loading import import_string
+
+try:
+    from django.db.models.constants import LOOKUP_SEP
+except ImportError:
+    from django.db.models.sql.constants import LOOKUP_SEP
+
+from django_roa.db.exceptions import ROANotImplementedYetException
+
+ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
+ROA_FILTER_EXPRESSION = getattr(settings, 'ROA_FILTER_EXPRESSION', None)
+
+FILTER_EXPRESSION_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('FILTER', 'filter')
+
+LOOKUPS = frozenset((
+    'exact', 'iexact', 'contains', 'icontains', 'in', 'gt', 'gte', 'lt', 'lte',
+    'startswith', 'istartswith', 'endswith', 'iendswith', 'range', 'isnull',
+    'regex', 'iregex', 'date', 'year', 'month', 'day', 'week_day', 'hour',
+    'minute', 'second', 'search',
+))
+
+
+def split_lookup(key):
+    """
+    Returns ``(field path, lookup)`` of a keyword filter, e.g.
+    ``('reporter__name', 'icontains')``.
+    """
+    path = key.split(LOOKUP_SEP)
+    if len(path) > 1 and path[-1] in LOOKUPS:
+        return LOOKUP_SEP.join(path[:-1]), path[-1]
+    return key, 'exact'
+
+
+def get_filter_value(value):
+    """
+    Returns ``value`` as a JSON compatible value.
+    """
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = [get_filter_value(item) for item in value]
+        return sorted(values, key=str) if isinstance(value, (set, frozenset)) else values
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+def is_conjunction(q):
+    """
+    Whether a Q object is made only of conjunctions of keyword filters.
+    """
+    if q.negated or (q.connector != Q.AND and len(q.children) > 1):
+        return False
+    return all(is_conjunction(child) for child in q.children if isinstance(child, Q))
+
+
+def flatten_q(q):
+    """
+    Returns the keyword filters of a Q object made only of conjunctions.
+    """
+    kwargs = {}
+    if not is_conjunction(q):
+        raise ROANotImplementedYetException(
+            'Q objects with OR or negated branches require ROA_FILTER_EXPRESSION: %s' % q)
+    for child in q.children:
+        if isinstance(child, Q):
+            kwargs.update(flatten_q(child))
+        else:
+            kwargs[child[0]] = child[1]
+    return kwargs
+
+
+class FilterExpression(object):
+    """
+    Renders a Q object into a filter expression.
+    """
+
+    def render(self, q):
+        return self.encode(q)
+
+    def encode(self, node):
+        if isinstance(node, Q):
+            children = [self.encode(child) for child in node.children]
+            expression = children[0] if len(children) == 1 else self.combine(node.connector, children)
+            return self.negate(expression) if node.negated else expression
+        key, value = node
+        path, lookup = split_lookup(key)
+        return self.leaf(key, path, lookup, get_filter_value(value))
+
+    def leaf(self, key, path, lookup, value):
+        raise NotImplementedError
+
+    def combine(self, connector, children):
+        raise NotImplementedError
+
+    def negate(self, expression):
+        raise NotImplementedError
+
+
+class JSONFilterExpression(FilterExpression):
+    """
+    Nested ``{"and": [...]}``, ``{"or": [...]}`` and ``{"not": ...}``
+    objects whose leaves are ``{"<keyword filter>": value}``.
+    """
+
+    def render(self, q):
+        return json.dumps(self.encode(q), sort_keys=True, separators=(',', ':'))
+
+    def leaf(self, key, path, lookup, value):
+        return {key: value}
+
+    def combine(self, connector, children):
+        return {connector.lower(): children}
+
+    def negate(self, expression):
+        return {'not': expression}
+
+
+class RQLFilterExpression(FilterExpression):
+    """
+    Resource Query Language: ``and(eq(a,1),or(gt(b,2),lt(b,0)))``.
+    """
+    operators = {
+        'exact': 'eq',
+        'gte': 'ge',
+        'lte': 'le',
+    }
+
+    def leaf(self, key, path, lookup, value):
+        return '%s(%s,%s)' % (self.operators.get(lookup, lookup),
+                              path.replace(LOOKUP_SEP, '.'), self.value(value))
+
+    def value(self, value):
+        if value is None:
+            return 'null'
+        if value is True or value is False:
+            return str(value).lower()
+        if isinstance(value, list):
+            return '(%s)' % ','.join(self.value(item) for item in value)
+        return quote(str(value), safe='')
+
+    def combine(self, connector, children):
+        return '%s(%s)' % (connector.lower(), ','.join(children))
+
+    def negate(self, expression):
+        return 'not(%s)' % expression
+
+
+FILTER_EXPRESSIONS = {
+    'json': JSONFilterExpression,
+    'rql': RQLFilterExpression,
+}
+
+_instances = {}
+
+
+def get_filter_expression(model=None):
+    """
+    Returns the ``FilterExpression`` of ``model``, None if Q objects must be
+    sent as keyword filters.
+    """
+    name = getattr(model, 'roa_filter_expression', None) or ROA_FILTER_EXPRESSION
+    if name is None:
+        return None
+    try:
+        return _instances[name]
+    except KeyError:
+        pass
+    if name in FILTER_EXPRESSIONS:
+        expression_class = FILTER_EXPRESSIONS[name]
+    else:
+        expression_class = import_string(name)
+    expression = _instances[name] = expression_class()
+    return expression
@@ -0,0 +1,257 @@
+"""
+Concurrent evaluation of independent reads.
+
+``gather()`` evaluates querysets and ``get_lazy()`` lookups together, e.g.
+the reads of a page, so that they take as long as the slowest of them
+instead of their sum::
+
+    from django_roa.db.gather import gather
+
+    articles, reporter, tags = gather(
+        Article.objects.filter(published=True).order_by('-pub_date')[:10],
+        Reporter.objects.get_lazy(pk=3),
+        Tag.objects.all(),
+    )
+
+Querysets are returned as evaluated clones, those given are left untouched,
+lookups as the objects they get. Lookups by primary key and lists requested
+at once are sent as one request to ``ROA_BATCH_URL`` if set, see
+``django_roa.db.batch``::
+
+    [{"method": "GET", "url": "<url>?<parameters>"}, ...]
+    [{"status": 200, "body": {...}}, ...]
+
+Other reads, or all of them without batch endpoint, are requested
+concurrently on up to ``ROA_BATCH_WORKERS`` threads. Reads served locally,
+by mirrors or replicas, are evaluated on the calling thread, which also
+validates rows and finishes calls. The first error is raised once every
+read is done.
+"""
+import logging
+from urllib.parse import urlencode
+
+from django_roa.db.batch import ROA_BATCH_URL, post_batch, run_concurrently
+from django_roa.db.exceptions import ROAException
+from django_roa.db.instrumentation import RemoteCall
+from django_roa.db.mapping import decode_keys
+from django_roa.db.pagination import fetch_page, is_single_page, iter_pages, trim_rows
+from django_roa.db.query import LazyGet, RemoteQuerySet, ROAModelIterable
+
+logger = logging.getLogger("django_roa")
+
+
+class Read(object):
+    """
+    A remote read of ``gather()``: the list of ``queryset``, or the object
+    of its detail URL if ``lookup`` is given.
+    """
+
+    def __init__(self, index, queryset, lookup=None, unique=False):
+        self.index = index
+        self.queryset = queryset
+        self.lookup = lookup
+        # Whether the list answers a get() lookup.
+        self.unique = unique
+        self.pages = None
+
+    def is_single_request(self):
+        return self.lookup is not None or is_single_page(self.queryset.model, self.queryset.query)
+
+    def get_request(self):
+        """
+        Returns the ``(url, url_template, parameters)`` of the request of a
+        single request read.
+        """
+        queryset = self.queryset
+        if self.lookup is not None:
+            url, url_template = queryset._get_detail_url(**self.lookup)
+        else:
+            url = url_template = queryset.model.get_resource_url_list()
+        return url, url_template, queryset.query.parameters
+
+    def get_task(self):
+        queryset = self.queryset
+        client, headers = queryset._get_requests_client(), queryset._get_http_headers()
+        if self.lookup is not None:
+            url, url_template, parameters = self.get_request()
+            return fetch_page, (queryset.model, client, url, parameters, headers, url_template), {}
+        return fetch_pages, (queryset.model, client, queryset.model.get_resource_url_list(),
+                             queryset.query, headers), {}
+
+    def set_result(self, value):
+        """
+        Sets the pages of the read from ``value``, the result of its task.
+        """
+        if self.lookup is not None:
+            call, data, next_url = value
+            self.pages = [(call, [data])]
+        else:
+            self.pages = value
+
+    def set_response(self, call, status, data):
+        """
+        Sets the pages of the read from its response in a batch.
+        """
+        queryset = self.queryset
+        if not isinstance(status, int) or status >= 400:
+            raise ROAException('Batched GET of %s failed with status %s: %s' % (
+                queryset.model.__name__, status, data))
+        data = decode_keys(queryset.model, data)
+        if self.lookup is not None:
+            rows = [data]
+        elif isinstance(data, dict) and isinstance(data.get('results'), list):
+            rows = trim_rows(queryset.query, data['results'])
+        else:
+            rows = trim_rows(queryset.query, data)
+        self.pages = [(_PartCall(call), rows)]
+
+    def evaluate(self):
+        """
+        Returns the result of the read from its pages.
+        """
+        queryset = self.queryset
+        if self.lookup is not None:
+            return list(ROAModelIterable(queryset).instances(self.pages))[0]
+        queryset._prefetched_pages = self.pages
+        queryset._fetch_all()
+        if not self.unique:
+            return queryset
+        model = queryset.model
+        num = len(queryset)
+        if num == 1:
+            return queryset._result_cache[0]
+        if not num:
+            raise model.DoesNotExist("%s matching query does not exist." % model._meta.object_name)
+        raise model.MultipleObjectsReturned("get() returned more than one %s -- it returned %s!" % (
+            model._meta.object_name, num))
+
+    def finish(self):
+        for call, rows in self.pages or ():
+            call.finish()
+
+
+class _PartCall(object):
+    """
+    The part of a batch call answering one read, finished with it.
+    """
+
+    def __init__(self, call):
+        self.call = call
+
+    def phase(self, name):
+        return self.call.phase(name)
+
+    def finish(self, exception=None):
+        pass
+
+
+def fetch_pages(model, client, url, query, headers):
+    """
+    Returns the ``(call, rows)`` pages of the list of ``query``.
+    """
+    pages = []
+    try:
+        for page in iter_pages(model, client, url, query, headers):
+            pages.append(page)
+    except Exception:
+        for call, rows in pages:
+            call.finish()
+        raise
+    return pages
+
+
+def get_reads(reads):
+    """
+    Returns the remote reads of ``reads`` and the indexes of local ones.
+    """
+    remote, local = [], []
+    for index, read in enumerate(reads):
+        if isinstance(read, LazyGet):
+            queryset = read.queryset
+            if not isinstance(queryset, RemoteQuerySet) or queryset.query.plan.is_local:
+                local.append(index)
+                continue
+            lookup = queryset._get_pk_lookup(read.kwargs)
+            if lookup is not None:
+                remote.append(Read(index, queryset._clone(), lookup))
+            else:
+                remote.append(Read(index, queryset.filter(*read.args, **read.kwargs), unique=True))
+        elif not hasattr(read, '_fetch_all'):
+            raise TypeError("gather() takes querysets and get_lazy() lookups, not %r" % (read,))
+        elif isinstance(read, RemoteQuerySet) and read._result_cache is None and \
+                not read.query.plan.is_local and not read.query.annotations:
+            remote.append(Read(index, read._clone()))
+        else:
+            local.append(index)
+    return remote, local
+
+
+def gather(*reads, url=None, workers=None):
+    """
+    Evaluates ``reads``, querysets and ``get_lazy()`` lookups, together and
+    returns their results in order, see the module documentation.
+    """
+    url = url if url is not None else ROA_BATCH_URL
+    results = list(reads)
+    remote, local = get_reads(reads)
+
+    batched = [read for read in remote if read.is_single_request()] if url else []
+    if len(batched) < 2:
+        batched = []
+    concurrent = [read for read in remote if read not in batched]
+    tasks = [read.get_task() for read in concurrent]
+    call = None
+    if batched:
+        model = batched[0].queryset.model
+        requests = []
+        for read in batched:
+            read_url, url_template, parameters = read.get_request()
+            if parameters:
+                read_url = '%s?%s' % (read_url, urlencode(parameters, doseq=True))
+            requests.append({'method': 'GET', 'url': read_url})
+        logger.debug("""Gathering %d reads through %s""", len(requests), url)
+        call = RemoteCall('post', model, url)
+        tasks.append((post_batch, (url, model, requests, call), {}))
+    futures = run_concurrently(tasks, workers)
+
+    error = None
+    if batched:
+        try:
+            responses = futures.pop().result()
+            for read, response in zip(batched, responses):
+                read.set_response(call, response.get('status'), response.get('body'))
+        except Exception as e:
+            call.finish(exception=e)
+            error = e
+    for read, future in zip(concurrent, futures):
+        try:
+            read.set_result(future.result())
+        except Exception as e:
+            error = error or e
+    try:
+        for read in remote:
+            if read.pages is None:
+                continue
+            try:
+                results[read.index] = read.evaluate()
+            except Exception as e:
+                error = error or e
+            finally:
+                read.finish()
+    finally:
+        if call is not None:
+            call.finish()
+
+    for index in local:
+        try:
+            read = reads[index]
+            if isinstance(read, LazyGet):
+                results[index] = read.get()
+            elif read._result_cache is None:
+                results[index] = read._clone()
+                results[index]._fetch_all()
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
@@ -0,0 +1,119 @@
+"""
+Instrumentation of remote calls.
+
+Every remote call is described by a ``RemoteCall`` timing its phases
+(``network``, ``parse``, ``validate`` and ``hydrate``), sent with the
+``remote_call_finished`` signal once done, the model class being the
+sender::
+
+    from django_roa.db.instrumentation import remote_call_finished
+
+    def report_slow_calls(sender, call, **kwargs):
+        if call.duration > 1:
+            logger.warning("Slow ROA call: %s", call)
+
+    remote_call_finished.connect(report_slow_calls)
+
+Nothing is formatted unless the ``django_roa`` logger is enabled for DEBUG.
+"""
+import logging
+from time import perf_counter
+
+from django.dispatch import Signal
+
+logger = logging.getLogger("django_roa")
+
+# Sent with a ``call`` keyword argument holding the finished RemoteCall.
+remote_call_finished = Signal()
+
+PHASES = ('network', 'parse', 'validate', 'hydrate')
+
+
+def get_url_template(url, pk):
+    """
+    Returns ``url`` with its last occurrence of ``pk`` replaced by ``{pk}``,
+    so that calls to detail URLs of the same model can be grouped.
+    """
+    if pk is None:
+        return url
+    return '{pk}'.join(url.rsplit(str(pk), 1))
+
+
+class RemoteCall(object):
+    """
+    A remote call: what was requested, how big it was and where time went.
+    """
+
+    def __init__(self, method, model, url, url_template=None, parameters=None):
+        self.method = method.upper()
+        self.model = model
+        self.url = url
+        self.url_template = url_template or url
+        self.parameters = parameters
+        self.status = None
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.exception = None
+        self.timings = dict.fromkeys(PHASES, 0.0)
+        self.duration = None
+        self.started = perf_counter()
+
+    def __str__(self):
+        return '%s %s (%s) status=%s sent=%sB received=%sB in %.1fms [%s]' % (
+            self.method, self.url, self.model.__name__, self.status,
+            self.request_bytes, self.response_bytes, (self.duration or 0) * 1000,
+            ' '.join('%s=%.1fms' % (name, self.timings[name] * 1000) for name in PHASES))
+
+    def phase(self, name):
+        """
+        Context manager adding the time spent in its block to ``name``.
+        """
+        return _Phase(self, name)
+
+    def count(self, stream):
+        """
+        Wraps a response stream to count the bytes read from it.
+        """
+        return _CountingStream(self, stream)
+
+    def finish(self, exception=None):
+        if self.duration is not None:
+            return
+        self.duration = perf_counter() - self.started
+        self.exception = exception
+        logger.debug("%s", self)
+        remote_call_finished.send(sender=self.model, call=self)
+
+
+class _Phase(object):
+    __slots__ = ('call', 'name', 'start')
+
+    def __init__(self, call, name):
+        self.call = call
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.call.timings[self.name] += perf_counter() - self.start
+
+
+class _CountingStream(object):
+
+    def __init__(self, call, stream):
+        self.call = call
+        self.stream = stream
+
+    def read(self, *args):
+        data = self.stream.read(*args)
+        self.call.response_bytes += len(data)
+        return data
+
+    def readline(self, *args):
+        data = self.stream.readline(*args)
+        self.call.response_bytes += len(data)
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, b'')
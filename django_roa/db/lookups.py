@@ -0,0 +1,219 @@
+"""
+Python evaluation of Django lookups.
+
+Used to apply locally the filters a server cannot evaluate, and by the fake
+backend of ``django_roa.test``. Predicates are compiled once with a
+``resolve(obj, path)`` function returning the field at the end of ``path``
+and its value for ``obj``, a model instance or a remote row.
+"""
+import operator
+import re
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Model
+from django.db.models.query_utils import Q
+
+from django_roa.db.exceptions import ROANotImplementedYetException
+from django_roa.db.filters import split_lookup
+
+
+def _lower(value):
+    return value.lower() if isinstance(value, str) else value
+
+
+def to_list(value):
+    if isinstance(value, str):
+        return value.split(',')
+    return list(value)
+
+
+def to_bool(value):
+    if isinstance(value, str):
+        return value.lower() not in ('', '0', 'false', 'no')
+    return bool(value)
+
+
+def _compare(op):
+    return lambda value, other: value is not None and other is not None and op(value, other)
+
+
+def _text(op, lower=False):
+    def lookup(value, other):
+        if value is None or other is None:
+            return False
+        value, other = str(value), str(other)
+        if lower:
+            value, other = value.lower(), other.lower()
+        return op(value, other)
+    return lookup
+
+
+# name: (function, whether the value is converted by the model field)
+LOOKUPS = {
+    'exact': (operator.eq, True),
+    'iexact': (lambda value, other: _lower(value) == _lower(other), True),
+    'gt': (_compare(operator.gt), True),
+    'gte': (_compare(operator.ge), True),
+    'lt': (_compare(operator.lt), True),
+    'lte': (_compare(operator.le), True),
+    'in': (lambda value, other: value in other, True),
+    'range': (lambda value, other: value is not None and other[0] <= value <= other[1], True),
+    'contains': (_text(lambda value, other: other in value), False),
+    'icontains': (_text(lambda value, other: other in value, lower=True), False),
+    'startswith': (_text(str.startswith), False),
+    'istartswith': (_text(str.startswith, lower=True), False),
+    'endswith': (_text(str.endswith), False),
+    'iendswith': (_text(str.endswith, lower=True), False),
+    'regex': (_text(lambda value, other: re.search(other, value) is not None), False),
+    'iregex': (_text(lambda value, other: re.search(other, value, re.I) is not None), False),
+    'isnull': (lambda value, other: (value is None) == to_bool(other), False),
+}
+
+TEXT_FIELDS = ('CharField', 'TextField', 'EmailField', 'SlugField', 'URLField')
+
+
+def get_field(model, name):
+    """
+    Returns the field of ``model`` called ``name``, ``pk`` or an attname
+    such as ``reporter_id`` included.
+    """
+    if name == 'pk':
+        return model._meta.pk
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        for field in model._meta.concrete_fields:
+            if field.attname == name:
+                return field
+        raise
+
+
+# Related instances cached on instances by foreign keys, in the cache of
+# their descriptor before Django 2.0.
+
+def is_cached(field, obj):
+    if hasattr(field, 'is_cached'):
+        return field.is_cached(obj)
+    return hasattr(obj, field.get_cache_name())
+
+
+def get_cached_value(field, obj):
+    if hasattr(field, 'get_cached_value'):
+        return field.get_cached_value(obj)
+    return getattr(obj, field.get_cache_name())
+
+
+def set_cached_value(field, obj, value):
+    if hasattr(field, 'set_cached_value'):
+        field.set_cached_value(obj, value)
+    else:
+        setattr(obj, field.get_cache_name(), value)
+
+
+def delete_cached_value(field, obj):
+    if hasattr(field, 'delete_cached_value'):
+        field.delete_cached_value(obj)
+    else:
+        delattr(obj, field.get_cache_name())
+
+
+def to_python(field, value):
+    if field is None or value is None:
+        return value
+    try:
+        return field.to_python(value)
+    except ValidationError:
+        return value
+
+
+def resolve_instance(obj, path):
+    """
+    Resolves ``path`` on a model instance, following foreign keys.
+    """
+    field = get_field(obj.__class__, path[0])
+    if field.is_relation and len(path) > 1:
+        related = getattr(obj, field.name, None)
+        if related is None:
+            return None, None
+        return resolve_instance(related, path[1:])
+    if len(path) > 1:
+        raise ROANotImplementedYetException('Unsupported lookup "%s" on %s' % (
+            '__'.join(path), obj.__class__.__name__))
+    return field, getattr(obj, field.attname)
+
+
+def compile_lookup(key, value, resolve):
+    """
+    Returns a predicate of objects for the keyword filter ``key=value``.
+    """
+    path, lookup = split_lookup(key)
+    path = path.split('__')
+    if lookup not in LOOKUPS:
+        raise ROANotImplementedYetException('Lookup "%s" cannot be evaluated locally.' % lookup)
+    function, convert = LOOKUPS[lookup]
+    # Lookups on the related model itself compare primary keys.
+    if isinstance(value, Model):
+        value = value.pk
+    if convert and lookup in ('in', 'range'):
+        value = to_list(value)
+    converted = {}
+
+    def match(obj):
+        field, obj_value = resolve(obj, path)
+        if convert:
+            if field not in converted:
+                if lookup in ('in', 'range'):
+                    converted[field] = [to_python(field, item) for item in value]
+                else:
+                    converted[field] = to_python(field, value)
+            return function(to_python(field, obj_value), converted[field])
+        return function(obj_value, value)
+    return match
+
+
+def compile_q(q, resolve):
+    """
+    Returns a predicate of objects for a Q object.
+    """
+    children = [compile_q(child, resolve) if isinstance(child, Q)
+                else compile_lookup(child[0], child[1], resolve)
+                for child in q.children]
+    combine = all if q.connector == Q.AND else any
+    if q.negated:
+        return lambda obj: not combine(child(obj) for child in children)
+    return lambda obj: combine(child(obj) for child in children)
+
+
+def compile_search(model, search_term, get_value):
+    """
+    Returns a predicate of objects matching every word of ``search_term`` in
+    one of their text fields, like the search filter of Django REST
+    framework. ``get_value(obj, field)`` returns the value of a field.
+    """
+    terms = search_term.replace(',', ' ').lower().split()
+    fields = [field for field in model._meta.concrete_fields
+              if field.get_internal_type() in TEXT_FIELDS]
+
+    def match(obj):
+        values = [str(value).lower() for value in (get_value(obj, field) for field in fields)
+                  if value is not None]
+        return all(any(term in value for value in values) for term in terms)
+    return match
+
+
+def sort(objects, ordering, resolve):
+    """
+    Sorts ``objects`` by field names, ``-`` prefixed for descending order.
+    """
+    objects = list(objects)
+    for name in reversed(ordering):
+        if name == '?':
+            continue
+        path = name.lstrip('-+').split('__')
+
+        def key(obj, path=path):
+            field, value = resolve(obj, path)
+            value = to_python(field, value)
+            return (value is not None, value)
+        objects.sort(key=key, reverse=name.startswith('-'))
+    return objects
@@ -1,6 +1,8 @@
 from django.db.models.manager import Manager
 
-from django_roa.db.query import RemoteQuerySet
+from django_roa.db.exceptions import ROAException
+from django_roa.db.mirror import TableMirror, get_fresh_mirror, get_mirror
+from django_roa.db.query import LazyGet, RemoteQuerySet
 
 
 class ROAManager(Manager):
@@ -19,5 +21,47 @@ class ROAManager(Manager):
     def get_queryset(self):
         return RemoteQuerySet(self.model)
 
+    def max_staleness(self, seconds):
+        """
+        Returns a QuerySet served by the mirror of the model if it was
+        synced within ``seconds`` (its max_age if None), by the remote
+        resources otherwise.
+        """
+        queryset = RemoteQuerySet(self.model)
+        queryset.query.max_staleness = seconds
+        return queryset
+
+    def remote(self):
+        """
+        Returns a QuerySet reading the remote resources, whatever the
+        freshness of the model's mirror.
+        """
+        return self.max_staleness(0)
+
+    def replica(self, max_staleness=None):
+        """
+        Returns a Django QuerySet of the replica of the model, the table of
+        its mirror in a Django database, if it was synced within
+        ``max_staleness`` seconds (its max_age if None), a QuerySet reading
+        the remote resources otherwise.
+        """
+        mirror = get_mirror(self.model)
+        if not isinstance(mirror, TableMirror):
+            raise ROAException('%s has no replica, its mirror needs a database.'
+                               % self.model._meta.label)
+        if max_staleness != 0 and get_fresh_mirror(self.model, max_staleness) is not None:
+            return mirror.get_queryset()
+        return self.remote()
+
+    def get_lazy(self, *args, **kwargs):
+        """
+        Returns a ``get()`` to be evaluated by ``gather()`` along with other
+        reads, see ``django_roa.db.gather``.
+        """
+        return LazyGet(self.get_queryset(), args, kwargs)
+
     def search(self, *args, **kwargs):
-        return self.get_queryset().search(*args, **kwargs)
+        return RemoteQuerySet(self.model).search(*args, **kwargs)
+
+    def parallel_scan(self, *args, **kwargs):
+        return RemoteQuerySet(self.model).parallel_scan(*args, **kwargs)
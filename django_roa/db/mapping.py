@@ -0,0 +1,172 @@
+"""
+Field name mapping between local models and remote resources.
+
+Field mappings are compiled once per model into plain dicts and applied to
+the keys of each decoded row, and of the rows of related models nested in
+it, so the cost does not depend on the size of the values. The names of
+``ROA_MODEL_NAME_MAPPING``, e.g. application labels, are replaced at the
+start of the values of ``ROA_MODEL_NAME_FIELDS``, the keys carrying model
+labels; other values are left alone.
+"""
+from django.conf import settings
+
+# Global (local name, remote name) pairs replaced in the strings of decoded
+# responses, e.g. ('django_roa_client.', 'django_roa_server.').
+ROA_MODEL_NAME_MAPPING = getattr(settings, 'ROA_MODEL_NAME_MAPPING', [])
+# Keys whose values are model labels, e.g. the "model" of Django's
+# serialization format, in which ROA_MODEL_NAME_MAPPING names are replaced.
+ROA_MODEL_NAME_FIELDS = getattr(settings, 'ROA_MODEL_NAME_FIELDS', ('model',))
+# Global (local name, remote name) field renames, applied to every model.
+ROA_FIELD_NAME_MAPPING = getattr(settings, 'ROA_FIELD_NAME_MAPPING', [])
+# {'app_label.model_name': {'local name': 'remote name'}}
+ROA_MODEL_FIELD_MAPPING = getattr(settings, 'ROA_MODEL_FIELD_MAPPING', {})
+# {'app_label.model_name': ['local name', ...] or {'local name': 'remote name'}}
+ROA_MODEL_CREATE_MAPPING = getattr(settings, 'ROA_MODEL_CREATE_MAPPING', {})
+ROA_MODEL_UPDATE_MAPPING = getattr(settings, 'ROA_MODEL_UPDATE_MAPPING', {})
+
+_compiled = {}
+_nested = {}
+
+
+def get_model_key(model):
+    opts = model._meta
+    return '%s.%s' % (opts.app_label, opts.model_name)
+
+
+def _compile_payload_mapping(mapping, encode):
+    if mapping is None:
+        return None
+    if isinstance(mapping, dict):
+        return dict(mapping)
+    return dict((local, encode.get(local, local)) for local in mapping)
+
+
+def get_field_mapping(model):
+    """
+    Returns ``(decode, encode, create, update)`` for ``model``: ``decode``
+    maps remote keys to local ones and ``encode`` the other way around,
+    ``create`` and ``update`` map the local keys allowed in payloads to
+    their remote name (None meaning every key is sent).
+    """
+    try:
+        return _compiled[model]
+    except KeyError:
+        pass
+    key = get_model_key(model)
+    encode = dict(ROA_FIELD_NAME_MAPPING)
+    encode.update(ROA_MODEL_FIELD_MAPPING.get(key, {}))
+    encode = dict((local, remote) for local, remote in encode.items() if local != remote)
+    decode = dict((remote, local) for local, remote in encode.items())
+    create = _compile_payload_mapping(ROA_MODEL_CREATE_MAPPING.get(key), encode)
+    update = _compile_payload_mapping(ROA_MODEL_UPDATE_MAPPING.get(key), encode)
+    _compiled[model] = decode, encode, create, update
+    return _compiled[model]
+
+
+def _get_relations(model):
+    return [(field.name, field.related_model) for field in model._meta.get_fields()
+            if field.is_relation and field.related_model is not None]
+
+
+def _has_mapping(model, seen):
+    if get_field_mapping(model)[1]:
+        return True
+    seen.add(model)
+    return any(_has_mapping(related, seen) for name, related in _get_relations(model)
+               if related not in seen)
+
+
+def get_nested_mapping(model):
+    """
+    Returns the ``(local name, related model)`` pairs of the relations of
+    ``model`` whose nested rows have keys to rename.
+    """
+    try:
+        return _nested[model]
+    except KeyError:
+        pass
+    _nested[model] = [(name, related) for name, related in _get_relations(model)
+                      if _has_mapping(related, set())]
+    return _nested[model]
+
+
+def _replace_name(label):
+    for local, remote in ROA_MODEL_NAME_MAPPING:
+        if label.startswith(remote):
+            return local + label[len(remote):]
+    return label
+
+
+def _replace_names(data):
+    if isinstance(data, dict):
+        return dict((k, _replace_name(v) if k in ROA_MODEL_NAME_FIELDS and isinstance(v, str)
+                     else _replace_names(v)) for k, v in data.items())
+    if isinstance(data, list):
+        return [_replace_names(item) for item in data]
+    return data
+
+
+def _rename_nested(model, row, index):
+    """
+    Renames the keys of the rows nested in ``row`` with the ``index``
+    mapping of ``get_field_mapping``, 0 to decode and 1 to encode.
+    """
+    nested = get_nested_mapping(model)
+    if not nested or not isinstance(row, dict):
+        return row
+    row = dict(row)
+    for name, related in nested:
+        # Keys are still remote when decoding.
+        if index == 0:
+            name = get_field_mapping(model)[1].get(name, name)
+        value = row.get(name)
+        if isinstance(value, dict):
+            row[name] = _rename(related, value, index)
+        elif isinstance(value, list):
+            row[name] = [_rename(related, item, index) for item in value]
+    return row
+
+
+def _rename(model, row, index):
+    if not isinstance(row, dict):
+        return row
+    row = _rename_nested(model, row, index)
+    mapping = get_field_mapping(model)[index]
+    if mapping:
+        return dict((mapping.get(k, k), v) for k, v in row.items())
+    return row
+
+
+def decode_keys(model, data):
+    """
+    Renames remote keys to local field names in a decoded detail, list or
+    paginated list response, after replacing the names of
+    ``ROA_MODEL_NAME_MAPPING`` in its model labels.
+    """
+    if ROA_MODEL_NAME_MAPPING:
+        data = _replace_names(data)
+    if not get_field_mapping(model)[0] and not get_nested_mapping(model):
+        return data
+    if isinstance(data, list):
+        return [_rename(model, row, 0) for row in data]
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        data = dict(data)
+        data['results'] = [_rename(model, row, 0) for row in data['results']]
+        return data
+    return _rename(model, data, 0)
+
+
+def encode_payload(model, data, created):
+    """
+    Restricts ``data`` to the fields declared for creation or update, if
+    any, and renames them, and the keys of the rows nested in it, to their
+    remote names.
+    """
+    decode, encode, create, update = get_field_mapping(model)
+    allowed = create if created else update
+    if allowed is not None:
+        data = _rename_nested(model, data, 1)
+        return dict((remote, data[local]) for local, remote in allowed.items() if local in data)
+    if encode or get_nested_mapping(model):
+        return _rename(model, data, 1)
+    return data
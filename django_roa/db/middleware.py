@@ -1,7 +1,28 @@
-from django_roa.db import set_roa_headers
+try:
+    from django.utils.deprecation import MiddlewareMixin
+# Django < 1.10
+except ImportError:
+    MiddlewareMixin = object
 
+from django_roa.db import set_roa_headers, set_roa_request, reset_roa_request
+from django_roa.db.querylog import ROA_QUERY_LOG, QueryLog
 
-class ROAMiddleware(object):
+
+class ROAMiddleware(MiddlewareMixin):
     def process_request(self, request):
         # Set headers:
         set_roa_headers(request)
+        # Keep the request around for per-user authentication providers:
+        set_roa_request(request)
+        # Record remote calls made while processing the request:
+        if ROA_QUERY_LOG:
+            request.roa_query_log = QueryLog()
+            request.roa_query_log.start()
+
+    def process_response(self, request, response):
+        reset_roa_request()
+        log = getattr(request, 'roa_query_log', None)
+        if log is not None:
+            log.stop()
+            log.report(request.path)
+        return response
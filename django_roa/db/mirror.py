@@ -0,0 +1,584 @@
+"""
+Local mirrors of slowly changing remote resources.
+
+A mirror keeps the rows of a model in a SQLite file and pulls the rows
+changed since its last sync, by a filter on a modification field greater
+than (or equal to) the highest value seen, its high-water mark. Declared
+with a ``roa_mirror`` attribute on the model or in ``ROA_MIRRORS`` by
+``'app_label.model_name'``::
+
+    roa_mirror = {
+        # Modification field of rows, sent as filter_updated_at__gte=<mark>,
+        # renamed through ROA_ARGS_NAMES_MAPPING, e.g. to 'updated_since'.
+        'updated_field': 'updated_at',
+        # 'gte' (default, rows at the mark are pulled again) or 'gt'.
+        'since_lookup': 'gte',
+        # Field of rows marking deleted rows (tombstones), if any.
+        'deleted_field': 'deleted',
+        # Seconds after a sync during which reads are served by the mirror.
+        'max_age': 300,
+        # SQLite file, ROA_MIRROR_DIR/<app_label.model_name>.sqlite3 by default.
+        'path': None,
+        # Django database alias of a replica table, instead of a SQLite file.
+        'database': None,
+    }
+
+Run ``sync()`` periodically, e.g. with the ``roa_sync`` command; a full sync
+also drops the rows deleted without tombstones. Rows are validated when
+pulled and stored as the values of the concrete fields of the model. While
+the last sync is more recent than ``max_age``, querysets of the model are
+evaluated locally over the mirror, without remote calls: SQLite evaluates
+the filters, ordering, slicing and counts of its capabilities, comparisons
+of number, text, boolean, date and foreign key fields, the query plan the
+rest. Saves and deletes still go to the server and are written through to
+the mirror.
+
+With a ``'database'`` alias, the mirror is the table of the model in that
+Django database, a read replica evaluated with the ORM. ``replica()`` of the
+manager returns Django querysets of the table while it is fresh, e.g. for
+joins. ``roa_sync --create-tables`` creates its tables, the one of the model
+unless migrations did.
+"""
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, transaction
+from django.db.models import Model
+from django.db.models.query import QuerySet
+from django.db.models.query_utils import Q
+
+from django_roa.db import get_roa_models
+from django_roa.db.aggregates import get_row_value
+from django_roa.db.capabilities import ALL, Capabilities
+from django_roa.db.exceptions import ROAException, ROANotImplementedYetException
+from django_roa.db.filters import split_lookup
+from django_roa.db.lookups import get_field, to_bool, to_list, to_python
+from django_roa.db.mapping import get_model_key
+
+logger = logging.getLogger("django_roa")
+
+ROA_MIRRORS = getattr(settings, 'ROA_MIRRORS', {})
+ROA_MIRROR_DIR = getattr(settings, 'ROA_MIRROR_DIR', tempfile.gettempdir())
+# Rows per page read from a mirror or written in a batch.
+ROA_MIRROR_BATCH_SIZE = getattr(settings, 'ROA_MIRROR_BATCH_SIZE', 1000)
+# Seconds between checks for a sync by another process of a stale mirror.
+ROA_MIRROR_CHECK_INTERVAL = getattr(settings, 'ROA_MIRROR_CHECK_INTERVAL', 1)
+# Table of the high-water marks of table mirrors.
+STATE_TABLE = 'django_roa_mirror'
+# Version of the stored rows, mirrors of another version are synced again.
+VERSION = 2
+# Fields whose JSON values compare in SQLite as their Python values.
+SQL_FIELDS = ('AutoField', 'BigAutoField', 'SmallAutoField', 'IntegerField', 'BigIntegerField',
+              'SmallIntegerField', 'PositiveIntegerField', 'PositiveSmallIntegerField',
+              'FloatField', 'BooleanField', 'NullBooleanField', 'CharField', 'TextField',
+              'EmailField', 'SlugField', 'URLField', 'DateField')
+SQL_LOOKUPS = {
+    'exact': '%s = ?',
+    'gt': '%s > ?',
+    'gte': '%s >= ?',
+    'lt': '%s < ?',
+    'lte': '%s <= ?',
+    'range': '%s BETWEEN ? AND ?',
+}
+
+_mirrors = {}
+
+
+class Mirror(object):
+    """
+    SQLite mirror of the rows of a model.
+    """
+
+    def __init__(self, model, updated_field, since_lookup='gte', deleted_field=None,
+                 max_age=None, path=None):
+        self.model = model
+        self.updated_field = updated_field
+        self.since_lookup = since_lookup
+        self.deleted_field = deleted_field
+        self.max_age = max_age
+        self.path = path or os.path.join(ROA_MIRROR_DIR, '%s.sqlite3' % get_model_key(model))
+        self.synced_at = None
+        self.checked_at = None
+        self.capabilities = None
+
+    ###########
+    # STORAGE #
+    ###########
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    @contextmanager
+    def connect(self):
+        import sqlite3
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute('CREATE TABLE IF NOT EXISTS rows (pk PRIMARY KEY, data TEXT NOT NULL)')
+            connection.execute('CREATE TABLE IF NOT EXISTS state (name TEXT PRIMARY KEY, value TEXT)')
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def writing(self):
+        """
+        Returns a context manager of a transaction of the storage.
+        """
+        with self.connect() as connection, connection:
+            yield connection
+
+    def get_state(self):
+        with self.connect() as connection:
+            return dict((name, json.loads(value)) for name, value in
+                        connection.execute('SELECT name, value FROM state'))
+
+    def set_state(self, writer, state):
+        writer.executemany('INSERT OR REPLACE INTO state VALUES (?, ?)', [
+            (name, json.dumps(value, cls=DjangoJSONEncoder)) for name, value in state.items()])
+
+    def clear(self, writer):
+        writer.execute('DELETE FROM rows')
+
+    def write(self, writer, objs, deleted):
+        """
+        Inserts or replaces the rows of the instances ``objs`` and deletes
+        the primary keys ``deleted``.
+        """
+        fields = self.model._meta.concrete_fields
+        writer.executemany('INSERT OR REPLACE INTO rows VALUES (?, ?)', [
+            (self.get_key(obj.pk), json.dumps(dict((field.attname, getattr(obj, field.attname))
+                                                   for field in fields), cls=DjangoJSONEncoder))
+            for obj in objs])
+        writer.executemany('DELETE FROM rows WHERE pk = ?', [(self.get_key(pk),) for pk in deleted])
+
+    def hydrate(self, data):
+        """
+        Returns the instance of a stored row, its values converted by their
+        field, without validating them again.
+        """
+        values = json.loads(data)
+        return self.model(**dict((field.attname, to_python(field, values[field.attname]))
+                                 for field in self.model._meta.concrete_fields
+                                 if field.attname in values))
+
+    def get_key(self, pk):
+        """
+        Returns the stored form of a primary key, integers being sorted as
+        such.
+        """
+        pk = self.model._meta.pk.to_python(pk)
+        return pk if isinstance(pk, (int, str)) else str(pk)
+
+    def get(self, pk):
+        """
+        Returns the instance of primary key ``pk``, None if there is none.
+        """
+        with self.connect() as connection:
+            row = connection.execute('SELECT data FROM rows WHERE pk = ?', (self.get_key(pk),)).fetchone()
+        return self.hydrate(row[0]) if row is not None else None
+
+    ###########
+    # READING #
+    ###########
+
+    def get_capabilities(self):
+        """
+        Returns the ``Capabilities`` of the SQL evaluation of queries, see
+        ``QueryPlan``.
+        """
+        if self.capabilities is None:
+            names = ['pk']
+            for field in self.model._meta.concrete_fields:
+                internal_type = (field.target_field if field.is_relation else field).get_internal_type()
+                if internal_type in SQL_FIELDS or field.primary_key:
+                    names.extend(set((field.name, field.attname)))
+            lookups = list(SQL_LOOKUPS) + ['in', 'isnull']
+            self.capabilities = Capabilities(
+                filters=dict((name, lookups) for name in names), ordering=names, search=False)
+        return self.capabilities
+
+    def get_column(self, name):
+        """
+        Returns the field called ``name`` and the SQL expression of its
+        value.
+        """
+        field = get_field(self.model, name)
+        if field.primary_key:
+            return field, 'pk'
+        return field, "json_extract(data, '$.%s')" % field.attname
+
+    def get_value(self, field, value):
+        """
+        Returns a filter value as stored.
+        """
+        if isinstance(value, Model):
+            value = value.pk
+        if field.primary_key:
+            return self.get_key(value)
+        return json.loads(json.dumps(to_python(field, value), cls=DjangoJSONEncoder))
+
+    def compile_lookup(self, key, value):
+        """
+        Returns the SQL condition of the keyword filter ``key=value`` and its
+        parameters.
+        """
+        path, lookup = split_lookup(key)
+        field, column = self.get_column(path)
+        if lookup == 'isnull' or (lookup == 'exact' and value is None):
+            negated = lookup == 'isnull' and not to_bool(value)
+            return '%s IS %sNULL' % (column, 'NOT ' if negated else ''), []
+        if lookup in ('in', 'range'):
+            values = [self.get_value(field, item) for item in to_list(value)]
+            if lookup == 'range':
+                return SQL_LOOKUPS[lookup] % column, values
+            if not values:
+                return '0', []
+            return '%s IN (%s)' % (column, ', '.join('?' * len(values))), values
+        return SQL_LOOKUPS[lookup] % column, [self.get_value(field, value)]
+
+    def compile_q(self, q):
+        conditions, params = [], []
+        for child in q.children:
+            condition, child_params = self.compile_q(child) if isinstance(child, Q) else \
+                self.compile_lookup(*child)
+            conditions.append('(%s)' % condition)
+            params.extend(child_params)
+        condition = (' %s ' % q.connector).join(conditions) or '1'
+        if q.negated:
+            # Comparisons to NULL are false, as in Python.
+            condition = 'NOT COALESCE(%s, 0)' % condition
+        return condition, params
+
+    def compile(self, plan, count=False):
+        """
+        Returns the SQL query of the part of ``plan`` evaluated by SQLite
+        and its parameters.
+        """
+        conditions, params = [], []
+        for q in [Q(**{key: value}) for key, value in plan.filters.items()] + \
+                [~Q(**{key: value}) for key, value in plan.excludes.items()] + plan.q_filters:
+            condition, q_params = self.compile_q(q)
+            conditions.append('(%s)' % condition)
+            params.extend(q_params)
+        sql = 'SELECT %s FROM rows' % ('1' if count else 'data')
+        if conditions:
+            sql += ' WHERE %s' % ' AND '.join(conditions)
+        if not count:
+            ordering = ['%s%s' % (self.get_column(name.lstrip('-'))[1], ' DESC' if name.startswith('-') else '')
+                        for name in plan.order_by]
+            sql += ' ORDER BY %s' % ', '.join(ordering + ['pk'])
+        if plan.limit_start or plan.limit_stop is not None:
+            sql += ' LIMIT ? OFFSET ?'
+            params.extend([-1 if plan.limit_stop is None else plan.limit_stop - (plan.limit_start or 0),
+                           plan.limit_start or 0])
+        if count:
+            sql = 'SELECT COUNT(*) FROM (%s)' % sql
+        return sql, params
+
+    def objects(self, plan):
+        """
+        Yields the instances selected by the part of ``plan`` evaluated by
+        SQLite, its filters, ordering and slicing.
+        """
+        sql, params = self.compile(plan)
+        with self.connect() as connection:
+            cursor = connection.execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(ROA_MIRROR_BATCH_SIZE)
+                if not batch:
+                    return
+                for data, in batch:
+                    yield self.hydrate(data)
+
+    def count(self, plan):
+        """
+        Returns the number of instances selected by the part of ``plan``
+        evaluated by SQLite.
+        """
+        sql, params = self.compile(plan, count=True)
+        with self.connect() as connection:
+            return connection.execute(sql, params).fetchone()[0]
+
+    ###########
+    # SYNCING #
+    ###########
+
+    def is_fresh(self, max_age=None):
+        """
+        Whether the last sync, by any process, is more recent than
+        ``max_age``, the declared one by default.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        if max_age is None:
+            return False
+        now = time.time()
+        if (self.synced_at is None or now - self.synced_at > max_age) and (
+                self.checked_at is None or now - self.checked_at >= ROA_MIRROR_CHECK_INTERVAL):
+            # Synced by another process?
+            self.checked_at = now
+            if self.exists():
+                state = self.get_state()
+                self.synced_at = state.get('synced_at') if state.get('version') == VERSION else None
+        return self.synced_at is not None and now - self.synced_at <= max_age
+
+    def get_changes(self, since=None):
+        """
+        Returns a queryset of the remote rows changed since the mark
+        ``since``, of every row if None.
+        """
+        # Imported here as the query module uses this one.
+        from django_roa.db.query import RemoteQuerySet
+
+        queryset = RemoteQuerySet(self.model)
+        queryset.query.max_staleness = 0
+        if since is not None:
+            queryset = queryset.filter(**{'%s__%s' % (self.updated_field, self.since_lookup): since})
+        return queryset
+
+    def sync(self, full=False):
+        """
+        Pulls the rows changed since the high-water mark, or every row if
+        ``full`` or on the first sync, and returns the number of rows
+        pulled.
+        """
+        from django_roa.db.query import ROAModelIterable
+
+        model = self.model
+        pk_name = model._meta.pk.name
+        # Changes made while pulling are pulled again by the next sync.
+        started_at = time.time()
+        state = self.get_state()
+        full = full or 'high_water' not in state or state.get('version') != VERSION
+        raw_mark = state.get('high_water')
+        mark = None
+        if raw_mark is not None:
+            mark = get_row_value(model, {self.updated_field: raw_mark}, self.updated_field)
+
+        count = 0
+        iterable = ROAModelIterable(self.get_changes(None if full else raw_mark))
+        pages = iter(iterable.pages())
+        with self.writing() as writer, closing(pages):
+            if full:
+                self.clear(writer)
+            for call, rows in pages:
+                try:
+                    count += len(rows)
+                    live, deleted = [], []
+                    for row in rows:
+                        if self.deleted_field and row.get(self.deleted_field):
+                            deleted.append(get_row_value(model, row, pk_name))
+                        else:
+                            live.append(row)
+                        if row.get(self.updated_field) is not None:
+                            value = get_row_value(model, row, self.updated_field)
+                            if mark is None or value > mark:
+                                mark, raw_mark = value, row[self.updated_field]
+                    self.write(writer, list(iterable.hydrate(call, live)) if live else [], deleted)
+                except Exception as e:
+                    call.finish(exception=e)
+                    raise
+                finally:
+                    call.finish()
+            self.set_state(writer, {'high_water': raw_mark, 'synced_at': started_at, 'version': VERSION})
+        self.synced_at = started_at
+        logger.debug("""Synced %s rows of "%s" into %s""", count, model.__name__, self)
+        return count
+
+    def store(self, obj):
+        """
+        Writes through an instance saved on the server.
+        """
+        if not self.exists():
+            return
+        with self.writing() as writer:
+            self.write(writer, [obj], [])
+
+    def remove(self, pk):
+        """
+        Writes through the deletion of a row on the server.
+        """
+        if not self.exists():
+            return
+        with self.writing() as writer:
+            self.write(writer, [], [pk])
+
+    def __str__(self):
+        return self.path
+
+
+class ReplicaQuerySet(QuerySet):
+    """
+    QuerySet of the table of a ``TableMirror``, whose writes go to the
+    server.
+    """
+
+    def delete(self):
+        for obj in self:
+            obj.delete()
+        self._result_cache = None
+    delete.alters_data = True
+
+    def update(self, **kwargs):
+        raise ROANotImplementedYetException('Updates of replicas are not supported, save instances')
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        raise ROANotImplementedYetException('Bulk creations of replicas are not supported, save instances')
+
+
+class TableMirror(Mirror):
+    """
+    Mirror of the rows of a model in its table of a Django database, read
+    with the ORM as a replica.
+    """
+
+    def __init__(self, model, updated_field, database, **kwargs):
+        super(TableMirror, self).__init__(model, updated_field, **kwargs)
+        self.database = database
+        self.created = False
+
+    def get_queryset(self):
+        return ReplicaQuerySet(self.model, using=self.database)
+
+    def exists(self):
+        if not self.created:
+            tables = connections[self.database].introspection.table_names()
+            self.created = STATE_TABLE in tables and self.model._meta.db_table in tables
+        return self.created
+
+    def create_tables(self):
+        """
+        Creates the table of the model, unless migrations did, and the table
+        of the sync states in the database, e.g. with ``roa_sync
+        --create-tables``.
+        """
+        connection = connections[self.database]
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE IF NOT EXISTS %s (name VARCHAR(255) PRIMARY KEY, value TEXT)'
+                           % connection.ops.quote_name(STATE_TABLE))
+        if self.model._meta.db_table not in connection.introspection.table_names():
+            with connection.schema_editor() as editor:
+                editor.create_model(self.model)
+        self.created = True
+
+    @contextmanager
+    def connect(self):
+        yield connections[self.database]
+
+    def sync(self, full=False):
+        if not self.exists():
+            raise ROAException('The replica tables of %s do not exist in %r, migrate them or run '
+                               'roa_sync --create-tables.' % (self.model._meta.label, self.database))
+        return super(TableMirror, self).sync(full)
+
+    @contextmanager
+    def writing(self):
+        with self.connect() as connection, transaction.atomic(using=self.database):
+            yield connection
+
+    def get_state(self):
+        prefix = '%s:' % get_model_key(self.model)
+        with self.connect() as connection, connection.cursor() as cursor:
+            cursor.execute('SELECT name, value FROM %s WHERE name LIKE %%s'
+                           % connection.ops.quote_name(STATE_TABLE), [prefix + '%'])
+            return dict((name[len(prefix):], json.loads(value)) for name, value in cursor.fetchall())
+
+    def set_state(self, writer, state):
+        names = ['%s:%s' % (get_model_key(self.model), name) for name in state]
+        table = writer.ops.quote_name(STATE_TABLE)
+        with writer.cursor() as cursor:
+            cursor.execute('DELETE FROM %s WHERE name IN (%s)' % (table, ', '.join(['%s'] * len(names))),
+                           names)
+            cursor.executemany('INSERT INTO %s (name, value) VALUES (%%s, %%s)' % table, [
+                (name, json.dumps(value, cls=DjangoJSONEncoder)) for name, value in zip(names, state.values())])
+
+    def clear(self, writer):
+        QuerySet(self.model, using=self.database)._raw_delete(self.database)
+
+    def write(self, writer, objs, deleted):
+        pks = [obj.pk for obj in objs] + list(deleted)
+        queryset = QuerySet(self.model, using=self.database)
+        for i in range(0, len(pks), ROA_MIRROR_BATCH_SIZE):
+            queryset.filter(pk__in=pks[i:i + ROA_MIRROR_BATCH_SIZE])._raw_delete(self.database)
+        queryset.bulk_create(objs, batch_size=ROA_MIRROR_BATCH_SIZE)
+
+    def get(self, pk):
+        return QuerySet(self.model, using=self.database).filter(pk=pk).first()
+
+    def get_capabilities(self):
+        if self.capabilities is None:
+            names = ['pk'] + [name for field in self.model._meta.concrete_fields
+                              for name in set((field.name, field.attname))]
+            self.capabilities = Capabilities(filters=dict((name, ALL) for name in names),
+                                             ordering=names, search=False)
+        return self.capabilities
+
+    def select(self, plan):
+        """
+        Returns the Django queryset of the table selected by the part of
+        ``plan`` it evaluates.
+        """
+        queryset = QuerySet(self.model, using=self.database).filter(*plan.q_filters, **plan.filters)
+        for key, value in plan.excludes.items():
+            queryset = queryset.exclude(**{key: value})
+        queryset = queryset.order_by(*(plan.order_by + ['pk']))
+        if plan.limit_start or plan.limit_stop is not None:
+            queryset = queryset[plan.limit_start or 0:plan.limit_stop]
+        return queryset
+
+    def objects(self, plan):
+        return self.select(plan).iterator(ROA_MIRROR_BATCH_SIZE)
+
+    def count(self, plan):
+        return self.select(plan).count()
+
+    def __str__(self):
+        return '%s.%s' % (self.database, self.model._meta.db_table)
+
+
+def get_mirror(model):
+    """
+    Returns the ``Mirror`` declared for ``model``, None if there is none.
+    """
+    config = getattr(model, 'roa_mirror', None) or ROA_MIRRORS.get(get_model_key(model))
+    cached = _mirrors.get(model)
+    if cached is not None and cached[0] is config:
+        return cached[1]
+    mirror = None
+    if config:
+        mirror = (TableMirror if config.get('database') else Mirror)(model, **config)
+    _mirrors[model] = config, mirror
+    return mirror
+
+
+def get_fresh_mirror(model, max_age=None):
+    """
+    Returns the mirror of ``model`` if reads can be served by it, within
+    ``max_age`` seconds if given.
+    """
+    mirror = get_mirror(model)
+    if mirror is not None and mirror.is_fresh(max_age):
+        return mirror
+    return None
+
+
+def sync_all(models=None, full=False):
+    """
+    Syncs the mirrors of ``models``, every ROA model by default, and returns
+    the number of rows pulled by model.
+    """
+    if models is None:
+        models = get_roa_models()
+    results = OrderedDict()
+    for model in models:
+        mirror = get_mirror(model)
+        if mirror is not None:
+            results[model] = mirror.sync(full=full)
+    return results
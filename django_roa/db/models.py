@@ -1,7 +1,6 @@
 import sys
 import copy
 import logging
-from io import BytesIO
 
 import django
 
@@ -18,15 +17,15 @@ from django.db.models.fields.related import (OneToOneField, lazy_related_operati
 from functools import update_wrapper
 
 from django.utils.encoding import force_text
-from rest_framework.parsers import JSONParser
-from rest_framework_yaml.parsers import YAMLParser
-from rest_framework_xml.parsers import XMLParser
-from rest_framework.renderers import JSONRenderer
-from rest_framework_yaml.renderers import YAMLRenderer
-from rest_framework_xml.renderers import XMLRenderer
+from django.utils.module_loading import import_string
 
 from django_roa.db import get_roa_headers, get_roa_client
+from django_roa.db.batch import get_batch
 from django_roa.db.exceptions import ROAException
+from django_roa.db.instrumentation import RemoteCall, get_url_template
+from django_roa.db.mapping import decode_keys, encode_payload
+from django_roa.db.mirror import get_mirror
+from django_roa.db.transport import parse_response, send_request
 
 from requests.exceptions import HTTPError
 
@@ -40,14 +39,37 @@ PYTHON_LT_3_3 = sys.version_info<(3,3,0)
 ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
 ROA_FORMAT = getattr(settings, 'ROA_FORMAT', 'json')
 ROA_FILTERS = getattr(settings, 'ROA_FILTERS', {})
-ROA_MODEL_NAME_MAPPING = getattr(settings, 'ROA_MODEL_NAME_MAPPING', [])
-ROA_MODEL_CREATE_MAPPING = getattr(settings, 'ROA_MODEL_CREATE_MAPPING', {})
-ROA_MODEL_UPDATE_MAPPING = getattr(settings, 'ROA_MODEL_UPDATE_MAPPING', {})
 ROA_CUSTOM_ARGS = getattr(settings, "ROA_CUSTOM_ARGS", {})
-ROA_SSL_CA = getattr(settings, 'ROA_SSL_CA', None)
 
 DEFAULT_CHARSET = getattr(settings, 'DEFAULT_CHARSET', 'utf-8')
 
+# Parser, renderer and content type of each ROA_FORMAT, imported on first
+# use so that unused codecs cost neither import time nor memory.
+CODECS = {
+    'json': ('rest_framework.parsers.JSONParser', 'rest_framework.renderers.JSONRenderer',
+             'application/json'),
+    'xml': ('rest_framework_xml.parsers.XMLParser', 'rest_framework_xml.renderers.XMLRenderer',
+            'application/xml'),
+    'yaml': ('rest_framework_yaml.parsers.YAMLParser', 'rest_framework_yaml.renderers.YAMLRenderer',
+             'text/x-yaml'),
+}
+_codecs = {}
+
+
+def get_codec(format):
+    """
+    Returns the ``(parser class, renderer class, content type)`` of a format.
+    """
+    try:
+        return _codecs[format]
+    except KeyError:
+        pass
+    if format not in CODECS:
+        raise NotImplementedError
+    parser, renderer, content_type = CODECS[format]
+    codec = _codecs[format] = import_string(parser), import_string(renderer), content_type
+    return codec
+
 
 # adapted from:
 # https://github.com/django/django/blob/1.11/django/db/models/fields/related.py#L88
@@ -600,38 +622,17 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
         """
         Cf from rest_framework.renderers import JSONRenderer
         """
-        if ROA_FORMAT == 'json':
-            return JSONRenderer()
-        elif ROA_FORMAT == 'xml':
-            return XMLRenderer()
-        elif ROAException == 'yaml':
-            return YAMLRenderer()
-        else:
-            raise NotImplementedError
+        return get_codec(ROA_FORMAT)[1]()
 
     @classmethod
     def get_parser(cls):
         """
         Cf from rest_framework.parsers import JSONParser
         """
-        if ROA_FORMAT == 'json':
-            return JSONParser()
-        elif ROA_FORMAT == 'xml':
-            return XMLParser()
-        elif ROAException == 'yaml':
-            return YAMLParser()
-        else:
-            raise NotImplementedError
+        return get_codec(ROA_FORMAT)[0]()
 
     def get_serializer_content_type(self):
-        if ROA_FORMAT == 'json':
-            return {'Content-Type' : 'application/json'}
-        elif ROA_FORMAT == 'xml':
-            return {'Content-Type' : 'application/xml'}
-        elif ROAException == 'yaml':
-            return {'Content-Type' : 'text/x-yaml'}
-        else:
-            raise NotImplementedError
+        return {'Content-Type': get_codec(ROA_FORMAT)[2]}
 
     @classmethod
     def get_serializer(cls, instance=None, data=None, partial=False, **kwargs):
@@ -645,7 +646,8 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
             serializer = serializer_class(instance, partial=partial, **kwargs)
         elif data:
             data = data['results'] if 'results' in data else data
-            serializer = serializer_class(data=data, many=isinstance(data, list), **kwargs)
+            serializer = serializer_class(data=data, many=isinstance(data, list), partial=partial,
+                                          **kwargs)
 
         return serializer
 
@@ -671,9 +673,33 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
         # In this case, you just have to override it and return self.get_resource_url_list()
         return "%scount/" % (self.get_resource_url_list(),)
 
+    @classmethod
+    def aggregate_response(cls, data, group_by=None, **kwargs):
+        """
+        Read aggregation query response and return a list of dictionaries,
+        one per group
+        """
+        if isinstance(data, dict) and 'results' in data:
+            data = data['results']  # paginated groups
+        if isinstance(data, dict):
+            return [data]
+        return list(data)
+
+    def get_resource_url_aggregate(self):
+        return "%saggregate/" % (self.get_resource_url_list(),)
+
     def get_resource_url_detail(self):
         return "%s%s/" % (self.get_resource_url_list(), self.pk)
 
+    def save(self, *args, **kwargs):
+        batch = get_batch()
+        if batch is None:
+            return super(ROAModel, self).save(*args, **kwargs)
+        with batch.deferring_relations(self):
+            super(ROAModel, self).save(*args, **kwargs)
+
+    save.alters_data = True
+
     def save_base(self, raw=False, cls=None, origin=None, force_insert=False,
                   force_update=False, using=None, update_fields=None):
         """
@@ -726,70 +752,107 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
                 return
 
         if not meta.proxy:
-            pk_val = self._get_pk_val(meta)
-            pk_is_set = pk_val is not None
-
-            get_args = {}
-            get_args[ROA_ARGS_NAMES_MAPPING.get('FORMAT', 'format')] = ROA_FORMAT
-            get_args.update(ROA_CUSTOM_ARGS)
-
-            # Construct Json payload
-            serializer = self.get_serializer(self)
-            payload = self.get_renderer().render(serializer.data)
+            batch = get_batch()
+            if batch is not None:
+                # Sent when the batch is flushed, followed by post_save
+                batch.save(self, cls, origin, raw, force_update)
+                return
 
             # Add serializer content_type
             headers = get_roa_headers()
             headers.update(self.get_serializer_content_type())
 
-            requests_client = get_roa_client()
+            requests_client = get_roa_client(cls)
 
-            # check if resource use custom primary key
-            if not meta.pk.attname in ['pk', 'id']:
-                # consider it might be inserting so check it first
-                # @todo: try to improve this block to check if custom pripary key is not None first
+            record_exists, method, url, url_template, payload = self._get_save_request(
+                cls, force_update, headers, requests_client)
+            call = RemoteCall(method, cls, url, url_template=url_template)
+            try:
+                response = send_request(requests_client, method, url, model=cls,
+                                        data=self.get_renderer().render(payload),
+                                        headers=headers, call=call)
+            except Exception as e:
+                call.finish(exception=e)
+                if isinstance(e, HTTPError):
+                    raise ROAException(e)
+                raise
 
-                try:
+            try:
+                with call.phase('parse'):
+                    data = parse_response(self.get_parser(), response, call)
+                    data = decode_keys(cls, data)
+                self = self._set_saved(cls, data, call)
+            except Exception as e:
+                call.finish(exception=e)
+                raise
+            finally:
+                call.finish()
 
-                    if ROA_SSL_CA:
-                        response=requests_client.get(self.get_resource_url_detail(),params=None,headers=headers,verify=ROA_SSL_CA)
-                    else:
-                        response=requests_client.get(self.get_resource_url_detail(),params=None,headers=headers)
-                    response=response.text.encode("utf-8")
-                except HTTPError:
-                    pk_is_set = False
+        if origin:
+            signals.post_save.send(sender=origin, instance=self,
+                created=(not record_exists), raw=raw)
 
-            if force_update or pk_is_set and not self.pk is None:
-                record_exists = True
-                try:
-                    logger.debug("""Modifying : "%s" through %s with payload "%s" and GET args "%s" """ % (
-                                  force_text(self),
-                                  force_text(self.get_resource_url_detail()),
-                                  force_text(payload),
-                                  force_text(get_args)))
-                    if ROA_SSL_CA:
-                        response=requests_client.put(self.get_resource_url_detail(),data=payload,headers=headers,verify=ROA_SSL_CA)
-                    else:
-                        response=requests_client.put(self.get_resource_url_detail(),data=payload,headers=headers)
-                    response=response.text.encode("utf-8")
-                except HTTPError as e:
-                    raise ROAException(e)
-            else:
-                record_exists = False
-                try:
-                    logger.debug("""Creating  : "%s" through %s with payload "%s" and GET args "%s" """ % (
-                                  force_text(self),
-                                  force_text(self.get_resource_url_list()),
-                                  force_text(payload),
-                                  force_text(get_args)))
-                    if ROA_SSL_CA:
-                        response=requests_client.post(self.get_resource_url_list(),data=payload,headers=headers,verify=ROA_SSL_CA)
-                    else:
-                        response=requests_client.post(self.get_resource_url_list(),data=payload,headers=headers)
-                    response=response.text.encode("utf-8")
-                except HTTPError as e:
-                    raise ROAException(e)
+    save_base.alters_data = True
+
+    def _get_save_request(self, cls, force_update, headers, requests_client):
+        """
+        Returns ``(record_exists, method, url, url_template, payload)`` of
+        the request saving the instance, the payload not rendered yet.
+        """
+        meta = cls._meta
+        pk_val = self._get_pk_val(meta)
+        pk_is_set = pk_val is not None
+
+        get_args = {}
+        get_args[ROA_ARGS_NAMES_MAPPING.get('FORMAT', 'format')] = ROA_FORMAT
+        get_args.update(ROA_CUSTOM_ARGS)
+
+        # Serialize once, the payload depends on creation or update
+        serializer = self.get_serializer(self)
+        serializer_data = serializer.data
 
-            data = self.get_parser().parse(BytesIO(response))
+        # check if resource use custom primary key
+        if not meta.pk.attname in ['pk', 'id']:
+            # consider it might be inserting so check it first
+            # @todo: try to improve this block to check if custom pripary key is not None first
+
+            url = self.get_resource_url_detail()
+            call = RemoteCall('get', cls, url, url_template=get_url_template(url, pk_val))
+            try:
+                response = send_request(requests_client, 'get', url,
+                                        model=cls, headers=headers, stream=False, call=call)
+            except HTTPError:
+                pk_is_set = False
+            finally:
+                call.finish()
+
+        if force_update or pk_is_set and not self.pk is None:
+            payload = encode_payload(cls, serializer_data, created=False)
+            url = self.get_resource_url_detail()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("""Modifying : "%s" through %s with payload "%s" and GET args "%s" """ % (
+                              force_text(self),
+                              force_text(url),
+                              force_text(payload),
+                              force_text(get_args)))
+            return True, 'put', url, get_url_template(url, self.pk), payload
+
+        payload = encode_payload(cls, serializer_data, created=True)
+        url = self.get_resource_url_list()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("""Creating  : "%s" through %s with payload "%s" and GET args "%s" """ % (
+                          force_text(self),
+                          force_text(url),
+                          force_text(payload),
+                          force_text(get_args)))
+        return False, 'post', url, None, payload
+
+    def _set_saved(self, cls, data, call):
+        """
+        Validates ``data``, the decoded row answered to a save, sets the
+        primary key of the instance from it and returns the saved object.
+        """
+        with call.phase('validate'):
             serializer = self.get_serializer(data=data)
 
             for field in serializer.fields.items():
@@ -801,18 +864,17 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
 
             if not serializer.is_valid():
                 raise ROAException('Invalid deserialization for %s model: %s' % (self, serializer.errors))
+        with call.phase('hydrate'):
             obj = serializer.Meta.model(**serializer.validated_data)
-            try:
-                self.pk = int(obj.pk)
-            except ValueError:
-                self.pk = obj.pk
-            self = obj
+        try:
+            self.pk = int(obj.pk)
+        except ValueError:
+            self.pk = obj.pk
 
-        if origin:
-            signals.post_save.send(sender=origin, instance=self,
-                created=(not record_exists), raw=raw)
-
-    save_base.alters_data = True
+        mirror = get_mirror(cls)
+        if mirror is not None:
+            mirror.store(obj)
+        return obj
 
     def delete(self):
         assert self._get_pk_val() is not None, "%s object can't be deleted " \
@@ -821,24 +883,45 @@ class ROAModel(models.Model, metaclass=ROAModelBase):
 
         # Deletion in cascade should be done server side.
 
-        logger.debug("""Deleting  : "%s" through %s""" % \
-            (str(self), str(self.get_resource_url_detail())))
+        batch = get_batch()
+        if batch is not None:
+            batch.delete(self)
+            return
+
+        url = self.get_resource_url_detail()
+        logger.debug("""Deleting  : "%s" through %s""", self, url)
 
         # Add serializer content_type
         headers = get_roa_headers()
         headers.update(self.get_serializer_content_type())
 
-        requests_client = get_roa_client()
+        requests_client = get_roa_client(self.__class__)
 
-        if ROA_SSL_CA:
-            response=requests_client.delete(self.get_resource_url_detail(),headers=headers,verify=ROA_SSL_CA)
-        else:
-            response=requests_client.delete(self.get_resource_url_detail(),headers=headers)
-        if response.status_code in [200, 202, 204]:
-            self.pk = None
+        call = RemoteCall('delete', self.__class__, url,
+                          url_template=get_url_template(url, self.pk))
+        try:
+            response = send_request(requests_client, 'delete', url,
+                                    model=self.__class__, headers=headers, call=call)
+        except Exception as e:
+            call.finish(exception=e)
+            raise
+        finally:
+            call.finish()
+        self._set_deleted(response.status_code)
 
     delete.alters_data = True
 
+    def _set_deleted(self, status_code):
+        """
+        Forgets the primary key of the instance if ``status_code`` answered
+        to its deletion tells it is deleted.
+        """
+        if status_code in [200, 202, 204]:
+            mirror = get_mirror(self.__class__)
+            if mirror is not None:
+                mirror.remove(self.pk)
+            self.pk = None
+
     def _get_unique_checks(self, exclude=None):
         """
         We don't want to check unicity that way for now.
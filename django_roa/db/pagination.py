@@ -0,0 +1,373 @@
+"""
+Paginated iteration of remote lists, with read-ahead.
+
+With a page size, the ``chunk_size`` of ``iterator()``, the
+``roa_page_size`` attribute of a model or ``ROA_PAGE_SIZE``, lists are
+requested page by page:
+
+- following the ``next`` links of paginated answers (``{"count", "next",
+  "results"}`` as rendered by Django REST framework), opaque cursors
+  included, when the model's capabilities declare a ``pagination`` style,
+- by keyset conditions on the last row of the previous page, e.g.
+  ``filter_id__gt=<last id>``, when the server can filter by the ordering
+  (completed by the primary key), so that deep pages cost as much as the
+  first one,
+- by ``limit_start``/``limit_stop`` windows otherwise.
+
+While a page is being consumed, the next ``ROA_READ_AHEAD`` pages (1 by
+default, 0 to fetch pages on demand) are requested and parsed on a
+background thread, as long as the response bodies waiting to be consumed
+weigh less than ``ROA_READ_AHEAD_MAX_BYTES``.
+"""
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models.query_utils import Q
+
+from django_roa.db import get_roa_context, set_roa_context
+from django_roa.db.aggregates import get_row_value
+from django_roa.db.capabilities import get_capabilities
+from django_roa.db.exceptions import ROAException
+from django_roa.db.instrumentation import RemoteCall
+from django_roa.db.lookups import get_field
+from django_roa.db.mapping import decode_keys
+from django_roa.db.transport import parse_response, send_request
+
+logger = logging.getLogger("django_roa")
+
+ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
+ROA_PAGE_SIZE = getattr(settings, 'ROA_PAGE_SIZE', None)
+ROA_READ_AHEAD = getattr(settings, 'ROA_READ_AHEAD', 1)
+ROA_READ_AHEAD_MAX_BYTES = getattr(settings, 'ROA_READ_AHEAD_MAX_BYTES', 16 * 1024 * 1024)
+
+LIMIT_START_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_START', 'limit_start')
+LIMIT_STOP_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_STOP', 'limit_stop')
+# Page size parameter of each pagination style, unless discovered.
+PAGE_SIZE_PARAMETERS = {
+    'cursor': 'page_size',
+    'limit_offset': 'limit',
+    'page': 'page_size',
+}
+
+
+def get_page_size(model):
+    return getattr(model, 'roa_page_size', None) or ROA_PAGE_SIZE
+
+
+def fetch_page(model, client, url, parameters, headers, url_template=None):
+    """
+    Requests and parses a page, returns ``(call, rows, next URL)``. The call
+    is left to be finished by the consumer of the rows.
+    """
+    call = None
+    try:
+        logger.debug("""Retrieving : "%s" through %s with parameters "%s" """,
+                     model.__name__, url, parameters)
+        call = RemoteCall('get', model, url, url_template=url_template, parameters=parameters)
+        response = send_request(client, 'get', url, model=model, params=parameters,
+                                headers=headers, call=call)
+    except Exception as e:
+        if call is not None:
+            call.finish(exception=e)
+        raise ROAException(e)
+
+    try:
+        with call.phase('parse'):
+            data = parse_response(model.get_parser(), response, call)
+            data = decode_keys(model, data)
+    except Exception as e:
+        call.finish(exception=e)
+        raise
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return call, data['results'], data.get('next')
+    return call, data, None
+
+
+def get_keyset(model, query):
+    """
+    Returns the keyset of the ordering sent for ``query``, ``[(field,
+    descending)]`` ending with a unique field (the primary key is appended
+    otherwise), or None if the server cannot order and filter by it.
+    """
+    plan = query.plan
+    capabilities = plan.capabilities
+    keyset = []
+    for name in plan.order_by:
+        descending = name.startswith('-')
+        try:
+            field = get_field(model, name.lstrip('-+'))
+        except FieldDoesNotExist:
+            return None
+        # Keys must be ordered and never null.
+        if not field.concrete or field.many_to_many or field.null:
+            return None
+        keyset.append((field, descending))
+        if field.unique:
+            break
+    else:
+        pk = model._meta.pk
+        if not capabilities.supports_ordering(pk.name):
+            return None
+        keyset.append((pk, keyset[-1][1] if keyset else False))
+
+    lookups = ['%s__%s' % (field.name, 'lt' if descending else 'gt') for field, descending in keyset]
+    if len(keyset) > 1:
+        if plan.expression is None or not capabilities.filter_expression:
+            return None
+        lookups.extend('%s__exact' % field.name for field, descending in keyset[:-1])
+    if not all(capabilities.supports_lookup(lookup) for lookup in lookups):
+        return None
+    return keyset
+
+
+def get_keyset_condition(keyset, key):
+    """
+    Returns a Q object matching the rows after ``key`` in the ordering of
+    ``keyset``.
+    """
+    condition = Q()
+    for i, (field, descending) in enumerate(keyset):
+        after = Q(**{'%s__%s' % (field.name, 'lt' if descending else 'gt'): key[i]})
+        for (previous, descending), value in zip(keyset[:i], key):
+            after &= Q(**{previous.name: value})
+        condition |= after
+    return condition
+
+
+def is_after(keyset, key, other):
+    """
+    Whether ``key`` comes after ``other`` in the ordering of ``keyset``.
+    """
+    for (field, descending), value, other_value in zip(keyset, key, other):
+        if value != other_value:
+            return (value < other_value) if descending else (value > other_value)
+    return False
+
+
+def fetch_windows(model, client, url, parameters, headers, page_size, start, stop):
+    """
+    Yields ``(call, rows)`` for each ``limit_start``/``limit_stop`` window
+    of ``page_size`` rows from ``start`` to ``stop``.
+    """
+    while stop is None or start < stop:
+        window_stop = start + page_size if stop is None else min(start + page_size, stop)
+        window = dict(parameters)
+        window.pop(LIMIT_START_PARAMETER, None)
+        if start:
+            window[LIMIT_START_PARAMETER] = start
+        window[LIMIT_STOP_PARAMETER] = window_stop
+        call, rows, next_url = fetch_page(model, client, url, window, headers)
+        if isinstance(rows, list) and len(rows) > window_stop - start:
+            # The server ignores slicing and returned the whole list.
+            yield call, rows[start:stop]
+            return
+        yield call, rows
+        if not isinstance(rows, list) or len(rows) < window_stop - start:
+            return
+        start = window_stop
+
+
+def fetch_keyset(model, client, url, query, headers, page_size, keyset, start, stop):
+    """
+    Yields ``(call, rows)`` for each page of ``page_size`` rows from
+    ``start`` to ``stop``, pages after the first being selected by a keyset
+    condition on the last row of the previous one instead of an offset.
+    """
+    base = query.clone()
+    base.set_limits()
+    if len(keyset) > len(base.plan.order_by):
+        field, descending = keyset[-1]
+        base.add_ordering('%s%s' % ('-' if descending else '', field.name))
+    parameters = window = base.parameters
+    if start:
+        window = dict(parameters, **{LIMIT_START_PARAMETER: start})
+    last = None
+    while stop is None or start < stop:
+        size = page_size if stop is None else min(page_size, stop - start)
+        window = dict(window, **{LIMIT_STOP_PARAMETER: size if last is not None else start + size})
+        call, rows, next_url = fetch_page(model, client, url, window, headers)
+        if not isinstance(rows, list):
+            yield call, rows
+            return
+        if len(rows) > size and last is None:
+            # The server ignores slicing and returned the whole list.
+            yield call, rows[start:stop]
+            return
+        if last is not None and rows and not is_after(keyset, get_key(model, keyset, rows[0]), last):
+            logger.debug("Keyset conditions ignored for %s, paginating by offset", model.__name__)
+            # Finished by the consumer, as every call.
+            yield call, []
+            for page in fetch_windows(model, client, url, parameters, headers, page_size, start, stop):
+                yield page
+            return
+        yield call, rows
+        if len(rows) < size:
+            return
+        start += size
+        last = get_key(model, keyset, rows[-1])
+        page = base.clone()
+        if len(keyset) == 1:
+            page.filter(**{'%s__%s' % (keyset[0][0].name, 'lt' if keyset[0][1] else 'gt'): last[0]})
+        else:
+            page.filter(get_keyset_condition(keyset, last))
+        window = page.parameters
+
+
+def get_key(model, keyset, row):
+    return tuple(get_row_value(model, row, field.name) for field, descending in keyset)
+
+
+def iter_pages(model, client, url, query, headers, page_size=None):
+    """
+    Yields ``(call, rows)`` for each page of the list of ``query`` at
+    ``url``, within its sent ``limit_start`` and ``limit_stop``.
+    """
+    page_size = page_size or get_page_size(model)
+    parameters = query.parameters
+    plan = query.plan
+    capabilities = plan.capabilities
+    limit_start, limit_stop = plan.limit_start, plan.limit_stop
+    sliced = limit_start is not None or limit_stop is not None
+
+    if page_size and capabilities.pagination and not sliced:
+        name = capabilities.page_size_parameter or PAGE_SIZE_PARAMETERS.get(
+            capabilities.pagination, 'page_size')
+        parameters = dict(parameters, **{name: page_size})
+        while url:
+            call, rows, url = fetch_page(model, client, url, parameters, headers)
+            # Next links carry the parameters.
+            parameters = None
+            yield call, rows
+        return
+
+    if page_size and capabilities.slicing:
+        start = limit_start or 0
+        keyset = None
+        if limit_stop is None or limit_stop - start > page_size:
+            keyset = get_keyset(model, query)
+        if keyset is not None:
+            pages = fetch_keyset(model, client, url, query, headers, page_size, keyset,
+                                 start, limit_stop)
+        else:
+            pages = fetch_windows(model, client, url, parameters, headers, page_size,
+                                  start, limit_stop)
+        for page in pages:
+            yield page
+        return
+
+    call, rows, next_url = fetch_page(model, client, url, parameters, headers)
+    yield call, trim_rows(query, rows)
+
+
+def is_single_page(model, query, page_size=None):
+    """
+    Returns True if the list of ``query`` is requested at once, with its
+    parameters, by ``iter_pages``.
+    """
+    page_size = page_size or get_page_size(model)
+    plan = query.plan
+    sliced = plan.limit_start is not None or plan.limit_stop is not None
+    return not page_size or not (plan.capabilities.pagination and not sliced or
+                                 plan.capabilities.slicing)
+
+
+def trim_rows(query, rows):
+    """
+    Returns the rows of the list of ``query`` requested at once within its
+    limits, in case the server did not apply them.
+    """
+    plan = query.plan
+    limit_start, limit_stop = plan.limit_start, plan.limit_stop
+    # Check limit_start and limit_stop arguments for pagination and only
+    # slice data if they are both numeric and there are results left to go.
+    # We only perform this check on lists.
+    if (isinstance(limit_start, int) and isinstance(limit_stop, int) and
+       limit_stop - limit_start < len(rows) and limit_stop <= len(rows) and
+       isinstance(rows, list)):
+            rows = rows[limit_start:limit_stop]
+    return rows
+
+
+class ReadAhead(object):
+    """
+    Iterates over ``pages``, a generator of ``(call, rows)``, which a
+    background thread advances up to ``depth`` pages or ``max_bytes`` of
+    response bodies ahead of the consumer.
+    """
+
+    def __init__(self, pages, depth=ROA_READ_AHEAD, max_bytes=ROA_READ_AHEAD_MAX_BYTES):
+        self.pages = pages
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.buffer = deque()
+        self.size = 0
+        self.done = self.closed = False
+        self.error = None
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, args=(get_roa_context(),),
+                                       name='django_roa-read-ahead')
+        self.thread.daemon = True
+
+    def run(self, context):
+        # Per-thread headers and user of per-user authentication providers.
+        set_roa_context(context)
+        try:
+            for call, rows in self.pages:
+                with self.condition:
+                    self.buffer.append((call, rows))
+                    self.size += call.response_bytes
+                    self.condition.notify_all()
+                    while not self.closed and (len(self.buffer) >= self.depth or
+                                               self.size >= self.max_bytes):
+                        self.condition.wait()
+                    if self.closed:
+                        break
+        except Exception as e:
+            with self.condition:
+                self.error = e
+        finally:
+            self.pages.close()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def __iter__(self):
+        self.thread.start()
+        try:
+            while True:
+                with self.condition:
+                    while not self.buffer and not self.done:
+                        self.condition.wait()
+                    if not self.buffer:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    call, rows = self.buffer.popleft()
+                    self.size -= call.response_bytes
+                    self.condition.notify_all()
+                yield call, rows
+        finally:
+            self.close()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        # Pages fetched ahead but never consumed.
+        while self.buffer:
+            self.buffer.popleft()[0].finish()
+
+
+def get_pages(model, client, url, query, headers, page_size=None):
+    """
+    Returns an iterable of ``(call, rows)`` for each page of the list of
+    ``query``, read ahead if it is paginated.
+    """
+    pages = iter_pages(model, client, url, query, headers, page_size)
+    if (page_size or get_page_size(model)) and ROA_READ_AHEAD > 0:
+        return ReadAhead(pages)
+    return pages
@@ -1,8 +1,14 @@
+import copy
+import hashlib
 import logging
-from io import BytesIO
+from collections import OrderedDict
+from contextlib import closing
+from itertools import islice
+from urllib.parse import urlencode
 
 from django.conf import settings
-from django.db.models import query
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import query, Model
 from django.db.models.query import BaseIterable
 # Django >= 1.5
 from django_roa.db import get_roa_headers, get_roa_client
@@ -13,28 +19,83 @@ try:
 except:
     from django.db.models.sql.constants import LOOKUP_SEP
 from django.db.models.query_utils import Q
-from django.utils.encoding import force_text
 
 from django_roa.db.exceptions import ROAException, ROANotImplementedYetException
+from django_roa.db.aggregates import AGGREGATE_PARAMETER, GROUP_BY_PARAMETER, aggregate_objects, \
+    encode_annotations, get_annotations, get_row_value, get_source
+from django_roa.db.capabilities import get_capabilities
+from django_roa.db.filters import FILTER_EXPRESSION_PARAMETER, flatten_q, get_filter_expression, \
+    is_conjunction, split_lookup
+from django_roa.db.lookups import compile_lookup, compile_q, compile_search, get_cached_value, get_field, \
+    is_cached, resolve_instance, set_cached_value, sort
+from django_roa.db.instrumentation import RemoteCall, get_url_template
+from django_roa.db.mapping import decode_keys, get_field_mapping
+from django_roa.db.mirror import get_fresh_mirror
+from django_roa.db.pagination import get_pages
+from django_roa.db.scan import scan
+from django_roa.db.transport import parse_response, send_request
 
 logger = logging.getLogger("django_roa")
 
-ROA_MODEL_NAME_MAPPING = getattr(settings, 'ROA_MODEL_NAME_MAPPING', [])
 ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
 ROA_FORMAT = getattr(settings, 'ROA_FORMAT', 'json')
 ROA_FILTERS = getattr(settings, 'ROA_FILTERS', {})
-ROA_SSL_CA = getattr(settings, 'ROA_SSL_CA', None)
+
+ROA_CUSTOM_ARGS = getattr(settings, 'ROA_CUSTOM_ARGS', {})
+# Instances whose related instances are fetched at once for local evaluation.
+ROA_PREFETCH_BATCH_SIZE = getattr(settings, 'ROA_PREFETCH_BATCH_SIZE', 100)
 
 DEFAULT_CHARSET = getattr(settings, 'DEFAULT_CHARSET', 'utf-8')
 
+SEARCH_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('SEARCH_', 'search')
+ORDER_BY_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('ORDER_BY', 'order_by')
+LIMIT_START_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_START', 'limit_start')
+LIMIT_STOP_PARAMETER = ROA_ARGS_NAMES_MAPPING.get('LIMIT_STOP', 'limit_stop')
+# Sent with every query.
+STATIC_PARAMETERS = {ROA_ARGS_NAMES_MAPPING.get('FORMAT', 'format'): ROA_FORMAT}
+STATIC_PARAMETERS.update(ROA_CUSTOM_ARGS)
+
+_parameter_names = {}
+
+
+def get_parameter_name(prefix, lookup):
+    """
+    Returns the name of the parameter of a ``lookup`` for ``prefix``,
+    ``FILTER_`` or ``EXCLUDE_``, renamed through ``ROA_ARGS_NAMES_MAPPING``.
+    """
+    try:
+        return _parameter_names[prefix, lookup]
+    except KeyError:
+        pass
+    key = '%s%s' % (ROA_ARGS_NAMES_MAPPING.get(prefix, prefix.lower()), lookup)
+    name = _parameter_names[prefix, lookup] = ROA_ARGS_NAMES_MAPPING.get(key, key)
+    return name
+
+
+def get_parameter_value(value):
+    """
+    Model instances are sent as their primary key, lists and sets as
+    tuples, sets being sorted so that their order is stable.
+    """
+    if isinstance(value, Model):
+        return value.pk
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value, key=str))
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
 
 class Query(object):
-    def __init__(self):
+    def __init__(self, model=None):
+        self.model = model
         self.order_by = []
         self.extra_order_by = []
         self.default_ordering = []
         self.filters = {}
         self.excludes = {}
+        # Q objects rendered as a filter expression
+        self.q_filters = []
         self.search_term = None
         self.filterable = True
         self.limit_start = None
@@ -46,31 +107,84 @@ class Query(object):
         self.select_for_update = False
         self.distinct_fields = []
         self.combinator = None
+        # values() fields and the aggregates annotated by group of them
+        self.values_fields = None
+        self.annotations = OrderedDict()
+        # Seconds since the last sync of the model's mirror within which
+        # reads are served by it, its max_age if None.
+        self.max_staleness = None
+        self._plan = None
+        self._parameters = None
 
     def can_filter(self):
         return self.filterable
 
     def clone(self):
-        return self
+        obj = copy.copy(self)
+        obj.order_by = list(self.order_by)
+        obj.filters = dict(self.filters)
+        obj.excludes = dict(self.excludes)
+        obj.q_filters = list(self.q_filters)
+        obj.select_related = copy.deepcopy(self.select_related)
+        if self.values_fields is not None:
+            obj.values_fields = list(self.values_fields)
+        obj.annotations = OrderedDict(self.annotations)
+        return obj
+
+    def changed(self):
+        """
+        Forgets the memoized plan and parameters, to be called after any
+        change.
+        """
+        self._plan = None
+        self._parameters = None
 
     def clear_ordering(self):
         self.order_by = []
+        self.changed()
+
+    def add_ordering(self, *field_names):
+        self.order_by.extend(field_names)
+        self.changed()
 
     def filter(self, *args, **kwargs):
+        for q in args:
+            self.add_q(q)
         self.filters.update(kwargs)
+        self.changed()
+
+    def add_q(self, q, negated=False):
+        if not q:
+            # Q() filters nothing, as in Django.
+            return
+        self.q_filters.append(~q if negated else q)
+        self.changed()
 
     def search(self, search_term, limit_start=None, limit_stop=None):
         self.search_term = search_term
         self.limit_start = limit_start
         self.limit_stop = limit_stop
+        self.changed()
 
     def exclude(self, *args, **kwargs):
+        for q in args:
+            self.add_q(q, negated=True)
         self.excludes.update(kwargs)
+        self.changed()
 
     def set_limits(self, low=None, high=None):
         self.limit_start = low
         self.limit_stop = high
         self.filterable = False
+        self.changed()
+
+    def set_values(self, fields):
+        self.values_fields = list(fields)
+        self.changed()
+
+    def add_annotations(self, annotations):
+        self.annotations.update(annotations)
+        self.changed()
 
     def add_select_related(self, fields):
         """
@@ -88,50 +202,76 @@ class Query(object):
         self.related_select_fields = []
 
     @property
-    def parameters(self):
+    def plan(self):
         """
-        Returns useful parameters as a dictionary.
+        Returns the ``QueryPlan`` of the query, computed once until it
+        changes or its model's mirror turns fresh or stale.
         """
-        parameters = {}
-
-        # Filtering
-        for k, v in self.filters.items():
-            key = '%s%s' % (ROA_ARGS_NAMES_MAPPING.get('FILTER_', 'filter_'), k)
-            # v could be an object
-            try:
-                v = v.id
-            except:
-                pass
-
-            if key in ROA_ARGS_NAMES_MAPPING:
-                parameters[ROA_ARGS_NAMES_MAPPING[key]] = v
-            else:
-                parameters[key] = v
-        for k, v in self.excludes.items():
-            key = '%s%s' % (ROA_ARGS_NAMES_MAPPING.get('EXCLUDE_', 'exclude_'), k)
-            if key in ROA_ARGS_NAMES_MAPPING:
-                parameters[ROA_ARGS_NAMES_MAPPING[key]] = v
-            else:
-                parameters[key] = v
-        if self.search_term:
-            parameters[ROA_ARGS_NAMES_MAPPING.get('SEARCH_', 'search')] = self.search_term
+        mirror = None
+        if self.max_staleness != 0:
+            mirror = get_fresh_mirror(self.model, self.max_staleness)
+        if self._plan is None or self._plan.mirror is not mirror:
+            self._plan = QueryPlan(self.model, self, mirror)
+            self._parameters = None
+        return self._plan
 
-        # Ordering
-        if self.order_by:
-            order_by = ','.join(self.order_by)
-            parameters[ROA_ARGS_NAMES_MAPPING.get('ORDER_BY', 'order_by')] = order_by
-
-        # Slicing
-        if self.limit_start:
-            parameters[ROA_ARGS_NAMES_MAPPING.get('LIMIT_START', 'limit_start')] = self.limit_start
-        if self.limit_stop:
-            parameters[ROA_ARGS_NAMES_MAPPING.get('LIMIT_STOP', 'limit_stop')] = self.limit_stop
+    @property
+    def parameter_items(self):
+        """
+        Returns parameters as a tuple of ``(name, value)`` pairs sorted by
+        name, computed once until the query changes. Only the part of the
+        query the server supports is sent, see ``QueryPlan``.
+        """
+        if self._parameters is None:
+            plan = self.plan
+            parameters = {}
+
+            # Filtering
+            for k, v in plan.filters.items():
+                parameters[get_parameter_name('FILTER_', k)] = get_parameter_value(v)
+            for k, v in plan.excludes.items():
+                parameters[get_parameter_name('EXCLUDE_', k)] = get_parameter_value(v)
+            # Mirrors evaluate Q objects without expression.
+            if plan.q_filters and plan.expression is not None:
+                parameters[FILTER_EXPRESSION_PARAMETER] = get_filter_expression(
+                    self.model).render(Q(*plan.q_filters))
+            if plan.search_term:
+                parameters[SEARCH_PARAMETER] = plan.search_term
+
+            # Ordering
+            if plan.order_by:
+                parameters[ORDER_BY_PARAMETER] = ','.join(plan.order_by)
+
+            # Sparse fieldsets
+            if plan.fields:
+                name = plan.capabilities.sparse_fields
+                parameters[name] = tuple(plan.fields) if name.endswith('[]') else ','.join(plan.fields)
+
+            # Slicing
+            if plan.limit_start:
+                parameters[LIMIT_START_PARAMETER] = plan.limit_start
+            if plan.limit_stop:
+                parameters[LIMIT_STOP_PARAMETER] = plan.limit_stop
+
+            # Format and custom arguments
+            parameters.update(STATIC_PARAMETERS)
+            self._parameters = tuple(sorted(parameters.items()))
+        return self._parameters
 
-        # Format
-        parameters[ROA_ARGS_NAMES_MAPPING.get('FORMAT', 'format')] = ROA_FORMAT
+    @property
+    def parameters(self):
+        """
+        Returns useful parameters as a dictionary.
+        """
+        return dict(self.parameter_items)
 
-        parameters.update(getattr(settings, 'ROA_CUSTOM_ARGS', {}))
-        return parameters
+    @property
+    def parameters_hash(self):
+        """
+        Returns a hash of the parameters, stable across processes, usable
+        as a cache key: identical queries give identical hashes and URLs.
+        """
+        return hashlib.sha1(urlencode(self.parameter_items, doseq=True).encode('utf-8')).hexdigest()
 
     ##########################################
     # Fake methods required by admin options #
@@ -154,8 +294,223 @@ class Query(object):
         pass
 
     def has_results(self, *args, **kwargs):
-        """ Fake method. """
-        return True
+        return RemoteQuerySet(self.model, self).exists()
+
+
+def _q_keys(q):
+    for child in q.children:
+        if isinstance(child, Q):
+            for key in _q_keys(child):
+                yield key
+        else:
+            yield child[0]
+
+
+def _get_attribute(obj, field):
+    return getattr(obj, field.attname)
+
+
+def get_relation_path(model, name):
+    """
+    Returns the names of the foreign keys followed by the lookup or ordering
+    ``name`` from ``model``, empty if it follows none.
+    """
+    path = split_lookup(name.lstrip('-+'))[0].split(LOOKUP_SEP)
+    relations = []
+    for part in path[:-1]:
+        try:
+            field = get_field(model, part)
+        except FieldDoesNotExist:
+            break
+        if not (field.many_to_one or field.one_to_one) or field.related_model is None:
+            break
+        relations.append(part)
+        model = field.related_model
+    return tuple(relations)
+
+
+def prefetch_related(objects, model, paths, batch_size=None):
+    """
+    Yields ``objects``, instances of ``model``, after caching their related
+    instances along the foreign key ``paths``, fetched with one query by
+    foreign key for each batch of instances instead of one by instance.
+    """
+    objects = iter(objects)
+    while True:
+        batch = list(islice(objects, batch_size or ROA_PREFETCH_BATCH_SIZE))
+        if not batch:
+            return
+        for path in paths:
+            level, level_model = batch, model
+            for name in path:
+                field = get_field(level_model, name)
+                pending = [obj for obj in level
+                           if not is_cached(field, obj) and getattr(obj, field.attname) is not None]
+                values = set(getattr(obj, field.attname) for obj in pending)
+                if values:
+                    target = field.target_field
+                    related = dict((getattr(obj, target.attname), obj) for obj in
+                                   field.related_model._default_manager.filter(**{
+                                       '%s__in' % target.name: sorted(values, key=str)}))
+                    for obj in pending:
+                        set_cached_value(field, obj, related.get(getattr(obj, field.attname)))
+                level = [get_cached_value(field, obj) for obj in level if is_cached(field, obj)]
+                level = [obj for obj in level if obj is not None]
+                level_model = field.related_model
+        for obj in batch:
+            yield obj
+
+
+class QueryPlan(object):
+    """
+    Splits a query between what the server of its model supports, according
+    to its capabilities, and what is evaluated locally:
+
+    - ``filters``, ``excludes``, ``q_filters``, ``search_term``,
+      ``order_by``, ``limit_start`` and ``limit_stop`` are sent,
+    - ``predicates`` are then applied to the streamed instances, which are
+      sorted by ``local_order_by`` and sliced by ``local_limits`` after.
+
+    The related instances these follow, ``relation_paths``, are fetched by
+    batches of instances, see ``prefetch_related()``.
+
+    Slicing is only sent when nothing is evaluated locally, so that the
+    server always returns a superset of the results. Queries served by a
+    ``mirror`` are split the same way between what it evaluates in SQL and
+    the predicates, see ``Mirror.get_capabilities()``.
+    """
+
+    def __init__(self, model, query, mirror=None):
+        self.model = model
+        self.mirror = mirror
+        if mirror is not None:
+            self.capabilities = capabilities = mirror.get_capabilities()
+        else:
+            self.capabilities = capabilities = get_capabilities(model)
+        self.expression = get_filter_expression(model)
+        self.filters, self.excludes, self.q_filters = {}, {}, []
+        self.predicates = []
+        self.relation_paths = set()
+
+        for key, value in query.filters.items():
+            if capabilities.supports_lookup(key):
+                self.filters[key] = value
+            else:
+                self.add_predicate(compile_lookup(key, value, resolve_instance), [key])
+        for key, value in query.excludes.items():
+            if capabilities.supports_lookup(key, exclude=True):
+                self.excludes[key] = value
+            else:
+                predicate = compile_lookup(key, value, resolve_instance)
+                self.add_predicate(lambda obj, predicate=predicate: not predicate(obj), [key])
+        for q in query.q_filters:
+            self.add_q(q)
+
+        self.search_term = None
+        if query.search_term:
+            if capabilities.search:
+                self.search_term = query.search_term
+            else:
+                self.predicates.append(compile_search(model, query.search_term, _get_attribute))
+
+        # Groups of annotated queries are sorted and sliced locally.
+        self.order_by, self.local_order_by = [], []
+        if not query.annotations and all(capabilities.supports_ordering(name)
+                                         for name in query.order_by):
+            self.order_by = list(query.order_by)
+        else:
+            self.local_order_by = list(query.order_by)
+            self.add_relation_paths(self.local_order_by)
+
+        self.limit_start = self.limit_stop = self.local_limits = None
+        if not self.is_partial and capabilities.slicing and not query.annotations:
+            self.limit_start, self.limit_stop = query.limit_start, query.limit_stop
+        elif query.limit_start is not None or query.limit_stop is not None:
+            self.local_limits = query.limit_start or 0, query.limit_stop
+
+        # Rows of values() queries evaluated remotely are restricted to their
+        # fields when the server supports sparse fieldsets.
+        self.fields = None
+        if capabilities.sparse_fields and query.values_fields and not query.annotations \
+                and not self.is_local:
+            encode = get_field_mapping(model)[1]
+            names = set(get_field(model, name.split(LOOKUP_SEP)[0]).name for name in query.values_fields)
+            self.fields = sorted(encode.get(name, name) for name in names)
+
+    @property
+    def is_local(self):
+        """
+        Whether part of the query is evaluated locally, by a mirror or in
+        Python.
+        """
+        return bool(self.mirror is not None or self.is_partial)
+
+    @property
+    def is_partial(self):
+        """
+        Whether part of the query is evaluated in Python, after its server or
+        mirror.
+        """
+        return bool(self.predicates or self.local_order_by)
+
+    def add_q(self, q):
+        if not q:
+            return
+        capabilities = self.capabilities
+        if all(capabilities.supports_lookup(key) for key in _q_keys(q)):
+            if (self.expression is not None or self.mirror is not None) and capabilities.filter_expression:
+                self.q_filters.append(q)
+                return
+            if is_conjunction(q):
+                self.filters.update(flatten_q(q))
+                return
+            if q.negated and len(q.children) == 1 and not isinstance(q.children[0], Q) \
+                    and capabilities.supports_lookup(q.children[0][0], exclude=True):
+                self.excludes[q.children[0][0]] = q.children[0][1]
+                return
+        if not q.negated and q.connector == Q.AND and len(q.children) > 1:
+            # Conjunctions are split: what can be sent is sent.
+            for child in q.children:
+                self.add_q(child if isinstance(child, Q) else Q(child))
+            return
+        self.add_predicate(compile_q(q, resolve_instance), _q_keys(q))
+
+    def add_predicate(self, predicate, keys):
+        self.predicates.append(predicate)
+        self.add_relation_paths(keys)
+
+    def add_relation_paths(self, names):
+        for name in names:
+            path = get_relation_path(self.model, name)
+            if path:
+                self.relation_paths.add(path)
+
+    def prefetch(self, objects, names=()):
+        """
+        Caches the related instances of an iterable of instances that the
+        local part of the plan, and the field paths ``names``, follow.
+        """
+        paths = set(self.relation_paths)
+        paths.update(path for path in (get_relation_path(self.model, name) for name in names) if path)
+        if not paths:
+            return objects
+        return prefetch_related(objects, self.model, sorted(paths))
+
+    def apply(self, objects, names=()):
+        """
+        Applies the local part of the plan to an iterable of instances,
+        whose related instances followed by it or by the field paths
+        ``names`` are prefetched.
+        """
+        objects = self.prefetch(objects, names)
+        if self.predicates:
+            predicates = self.predicates
+            objects = (obj for obj in objects if all(predicate(obj) for predicate in predicates))
+        if self.local_order_by:
+            objects = sort(objects, self.local_order_by, resolve_instance)
+        if self.local_limits is not None:
+            objects = islice(objects, *self.local_limits)
+        return objects
 
 
 class ROAModelIterable(BaseIterable):
@@ -163,48 +518,55 @@ class ROAModelIterable(BaseIterable):
     Iterator that yields a model instance for each row of a ROAModel.
     """
 
-    def __iter__(self):
-        queryset = self.queryset
-        query = queryset.query
-        try:
-            parameters = query.parameters
-            resource_url_list = queryset.model.get_resource_url_list()
-            logger.debug("""Retrieving : "%s" through %s with parameters "%s" """ % (
-                queryset.model.__name__,
-                resource_url_list,
-                force_text(parameters)))
-            if ROA_SSL_CA:
-                response = queryset._get_requests_client().get(
-                    resource_url_list,
-                    params=parameters,
-                    headers=queryset._get_http_headers(),
-                    verify=ROA_SSL_CA)
-            else:
-                response = queryset._get_requests_client().get(
-                    resource_url_list,
-                    params=parameters,
-                    headers=queryset._get_http_headers())
-        except Exception as e:
-            raise ROAException(e)
+    def __init__(self, queryset, chunked_fetch=False, chunk_size=None):
+        # Not forwarded, BaseIterable only takes chunk_size from Django 2.0.
+        self.queryset = queryset
+        self.chunked_fetch = chunked_fetch
+        self.chunk_size = chunk_size
 
-        # Deserializing objects:
-        response = response.text.encode("utf-8")
-        data = queryset.model.get_parser().parse(BytesIO(response))
+    def __iter__(self):
+        return iter(self.queryset.query.plan.apply(self.fetch()))
 
-        # Check limit_start and limit_stop arguments for pagination and only
-        # slice data if they are both numeric and there are results left to go.
-        # We only perform this check on lists.
-        limit_start = getattr(query, 'limit_start', None)
-        limit_stop = getattr(query, 'limit_stop', None)
-        if (isinstance(limit_start, int) and isinstance(limit_stop, int) and
-           limit_stop - limit_start < len(data) and limit_stop <= len(data) and
-           isinstance(data, list)):
-                data = data[limit_start:limit_stop]
+    def fetch(self):
+        """
+        Yields the instances returned by the server, page by page, or
+        selected by the model's mirror.
+        """
+        queryset = self.queryset
+        mirror = queryset.query.plan.mirror
+        if mirror is not None and queryset._prefetched_pages is None:
+            return mirror.objects(queryset.query.plan)
+        return self.instances(self.pages())
 
+    def instances(self, pages):
+        """
+        Yields the instances of each ``(call, rows)`` page, finishing calls
+        as they are consumed.
+        """
+        for call, data in pages:
+            try:
+                for obj in self.hydrate(call, data):
+                    yield obj
+            except Exception as e:
+                call.finish(exception=e)
+                raise
+            finally:
+                call.finish()
+
+    def hydrate(self, call, data):
+        """
+        Yields the instances of the decoded ``data`` rows, validated, timing
+        ``call``.
+        """
+        queryset = self.queryset
         # [] is the case of empty no-paginated result
-        if data != []:
+        if data == []:
+            return
 
-            serializer = queryset.model.get_serializer(data=data)
+        with call.phase('validate'):
+            # Sparse rows lack fields
+            serializer = queryset.model.get_serializer(
+                data=data, partial=queryset.query.plan.fields is not None)
             for field in serializer.child.fields.items():
                 validators = field[1].validators
                 field[1].validators = []
@@ -216,9 +578,86 @@ class ROAModelIterable(BaseIterable):
                 raise ROAException('Invalid deserialization for %s model: %s' % (
                     queryset.model, serializer.errors))
 
-            for item in serializer.validated_data:
-                obj = serializer.child.Meta.model(**item)
-                yield obj
+        model = serializer.child.Meta.model
+        phase = call.phase('hydrate')
+        for item in serializer.validated_data:
+            with phase:
+                obj = model(**item)
+            yield obj
+
+    def rows(self):
+        """
+        Yields the decoded rows returned by the server, without validating
+        them.
+        """
+        for call, data in self.pages():
+            try:
+                for row in data:
+                    yield row
+            except Exception as e:
+                call.finish(exception=e)
+                raise
+            finally:
+                call.finish()
+
+    def pages(self):
+        """
+        Returns an iterable of ``(call, rows)`` for each page of the list,
+        see ``django_roa.db.pagination``, unless ``gather()`` fetched them.
+        """
+        queryset = self.queryset
+        pages = queryset._prefetched_pages
+        if pages is not None:
+            queryset._prefetched_pages = None
+            return pages
+        return get_pages(queryset.model, queryset._get_requests_client(),
+                         queryset.model.get_resource_url_list(), queryset.query,
+                         queryset._get_http_headers(),
+                         self.chunk_size if self.chunked_fetch else None)
+
+
+def _reverse_ordering(ordering):
+    return [name[1:] if name.startswith('-') else '-%s' % name.lstrip('+') for name in ordering]
+
+
+class ROAValuesIterable(ROAModelIterable):
+    """
+    Iterator that yields a dict for each row, or for each group of rows of
+    annotated queries.
+    """
+
+    def __iter__(self):
+        queryset = self.queryset
+        query = queryset.query
+        fields = query.values_fields or [field.attname for field in queryset.model._meta.concrete_fields]
+        if query.annotations:
+            results = queryset._aggregate(query.annotations, fields)
+            plan = query.plan
+            if plan.local_order_by:
+                results = sort(results, plan.local_order_by, lambda result, path: (
+                    None, result['__'.join(path)]))
+            if plan.local_limits is not None:
+                results = islice(results, *plan.local_limits)
+            return iter(results)
+        return (dict((name, resolve_instance(obj, name.split('__'))[1]) for name in fields)
+                for obj in query.plan.apply(self.fetch(), fields))
+
+
+class LazyGet(object):
+    """
+    A ``get()`` left to be evaluated by ``gather()``.
+    """
+
+    def __init__(self, queryset, args, kwargs):
+        self.queryset = queryset
+        self.args = args
+        self.kwargs = kwargs
+
+    def __repr__(self):
+        return '<LazyGet %s %s>' % (self.queryset.model.__name__, self.kwargs)
+
+    def get(self):
+        return self.queryset.get(*self.args, **self.kwargs)
 
 
 class RemoteQuerySet(query.QuerySet):
@@ -227,7 +666,7 @@ class RemoteQuerySet(query.QuerySet):
     """
     def __init__(self, model=None, query=None):
         self.model = model
-        self.query = query or Query()
+        self.query = query or Query(model)
         self._result_cache = None
         self._iter = None
         self._sticky_filter = False
@@ -235,6 +674,8 @@ class RemoteQuerySet(query.QuerySet):
         self._for_write = False
         self._hints = {}
         self._iterable_class = ROAModelIterable
+        # Pages fetched by gather(), consumed by the next evaluation.
+        self._prefetched_pages = None
 
         self.params = {}
 
@@ -257,47 +698,157 @@ class RemoteQuerySet(query.QuerySet):
     # METHODS THAT DO RESOURCE QUERIES #
     ####################################
 
-    def iterator(self):
+    def iterator(self, chunk_size=None):
         """
         An iterator over the results from applying this QuerySet to the
-        remote web service.
+        remote web service, fetched by pages of ``chunk_size`` rows if
+        given.
         """
-        return iter(self._iterable_class(self))
+        return iter(self._iterable_class(self, chunked_fetch=chunk_size is not None,
+                                         chunk_size=chunk_size))
+
+    def parallel_scan(self, workers=None, partitions=None, ordered=False, chunk_size=None):
+        """
+        An iterator over the results, fetched by partitions of primary key
+        ranges or offsets on ``workers`` threads, see
+        ``django_roa.db.scan``. Results come as partitions complete, or in
+        the order of the QuerySet if ``ordered``.
+        """
+        return scan(self, workers=workers, partitions=partitions, ordered=ordered,
+                    chunk_size=chunk_size)
 
     def count(self):
         """
         Returns the number of records as an integer.
 
         The result is not cached nor comes from cache, cache must be handled
-        by the server.
+        by the server. Queries with predicates evaluated locally, and groups
+        of annotated queries, are counted while streaming their results,
+        slices evaluated locally from the count of the whole query.
         """
         clone = self._clone()
-
-        # Instantiation of clone.model is necessary because we can't set
+        # Ordering does not change counts, of slices included.
+        clone.query.clear_ordering()
+        plan = clone.query.plan
+        if plan.predicates or clone.query.annotations:
+            return sum(1 for obj in clone.iterator())
+        count = plan.mirror.count(plan) if plan.mirror is not None else clone._count_remotely()
+        if plan.local_limits is not None:
+            start, stop = plan.local_limits
+            count = max(0, (count if stop is None else min(count, stop)) - start)
+        return count
+
+    def _count_remotely(self):
+        """
+        Returns the number of records counted by the server.
+        """
+        # Instantiation of self.model is necessary because we can't set
         # a staticmethod for get_resource_url_count and avoid to set it
         # for all model without relying on get_resource_url_list
-        instance = clone.model()
+        instance = self.model()
 
+        capabilities = get_capabilities(self.model)
+        parameters = self.query.parameters
+        if capabilities.count == 'endpoint':
+            url = instance.get_resource_url_count()
+        else:
+            url = self.model.get_resource_url_list()
+            if capabilities.count == 'paginated' and capabilities.page_size_parameter:
+                # A single row page still carries the total count.
+                parameters = dict(parameters, **{capabilities.page_size_parameter: 1})
+        call = None
         try:
-            parameters = clone.query.parameters
-            logger.debug("""Retrieving : "%s" through %s with parameters "%s" """ % (
-                clone.model.__name__,
-                self.model.get_resource_url_list(),
-                force_text(parameters)))
-            if ROA_SSL_CA:
-                response = self._get_requests_client().get(self.model.get_resource_url_list(), params=parameters,
-                                        headers=self._get_http_headers(),verify=ROA_SSL_CA)
-            else:
-                response = self._get_requests_client().get(self.model.get_resource_url_list(), params=parameters,
-                                        headers=self._get_http_headers())
+            logger.debug("""Retrieving : "%s" through %s with parameters "%s" """,
+                         self.model.__name__, url, parameters)
+            call = RemoteCall('get', self.model, url, parameters=parameters)
+            response = send_request(self._get_requests_client(), 'get', url,
+                                    model=self.model, params=parameters,
+                                    headers=self._get_http_headers(), call=call)
         except Exception as e:
+            if call is not None:
+                call.finish(exception=e)
             raise ROAException(e)
 
-        response=response.text.encode("utf-8")
-
-        data = self.model.get_parser().parse(BytesIO(response))
+        try:
+            with call.phase('parse'):
+                data = parse_response(self.model.get_parser(), response, call)
+        finally:
+            call.finish()
         return self.model.count_response(data)
 
+    def aggregate(self, *args, **kwargs):
+        """
+        Returns a dictionary of the aggregates, computed by the server if it
+        supports them, while streaming the rows otherwise.
+        """
+        return self._aggregate(get_annotations(args, kwargs))[0]
+
+    def _aggregate(self, annotations, group_by=()):
+        """
+        Returns the aggregates of each group as a list of dictionaries.
+        """
+        plan = self.query.plan
+        capabilities = plan.capabilities
+        group_by = list(group_by)
+        sliced = plan.limit_start is not None or plan.limit_stop is not None or \
+            (plan.local_limits is not None and not group_by)
+        if not plan.predicates and not sliced and all(
+                capabilities.supports_aggregate(aggregate.name) for aggregate in annotations.values()):
+            return self._aggregate_remotely(annotations, group_by)
+
+        names = group_by + [source for source in map(get_source, annotations.values()) if source]
+        if plan.predicates or plan.mirror is not None or (plan.is_local and not group_by) or \
+                any(LOOKUP_SEP in name for name in names):
+            # Local predicates, ordered slices and related fields need instances.
+            objects = plan.prefetch(ROAModelIterable(self).fetch(), names)
+            if group_by:
+                objects = (obj for obj in objects if all(predicate(obj) for predicate in plan.predicates))
+            else:
+                objects = plan.apply(objects)
+            return aggregate_objects(objects, annotations, group_by,
+                                     lambda obj, name: resolve_instance(obj, name.split(LOOKUP_SEP))[1])
+        with closing(ROAModelIterable(self).rows()) as rows:
+            if plan.local_limits is not None and not group_by:
+                rows = islice(rows, *plan.local_limits)
+            return aggregate_objects(rows, annotations, group_by,
+                                     lambda row, name: get_row_value(self.model, row, name))
+
+    def _aggregate_remotely(self, annotations, group_by):
+        # Instantiation of clone.model is necessary because we can't set
+        # a staticmethod for get_resource_url_aggregate.
+        instance = self.model()
+        url = instance.get_resource_url_aggregate()
+        parameters = dict(self.query.parameters)
+        parameters.pop(ORDER_BY_PARAMETER, None)
+        parameters[AGGREGATE_PARAMETER] = encode_annotations(annotations)
+        if group_by:
+            parameters[GROUP_BY_PARAMETER] = ','.join(group_by)
+        call = None
+        try:
+            logger.debug("""Aggregating : "%s" through %s with parameters "%s" """,
+                         self.model.__name__, url, parameters)
+            call = RemoteCall('get', self.model, url, parameters=parameters)
+            response = send_request(self._get_requests_client(), 'get', url,
+                                    model=self.model, params=parameters,
+                                    headers=self._get_http_headers(), call=call)
+        except Exception as e:
+            if call is not None:
+                call.finish(exception=e)
+            raise ROAException(e)
+
+        try:
+            if response.status_code != 200:
+                raise ROAException('Aggregation of %s failed with status %s: %s' % (
+                    self.model.__name__, response.status_code, response.text))
+            with call.phase('parse'):
+                data = parse_response(self.model.get_parser(), response, call)
+        except Exception as e:
+            call.finish(exception=e)
+            raise
+        finally:
+            call.finish()
+        return self.model.aggregate_response(data, group_by=group_by)
+
     def _get_from_id_or_pk(self, id=None, pk=None, **kwargs):
         """
         Returns an object given an id or pk, request directly with the
@@ -305,49 +856,70 @@ class RemoteQuerySet(query.QuerySet):
         (as Django's ORM do).
         """
         clone = self._clone()
+        mirror = clone.query.plan.mirror
+        if mirror is not None:
+            obj = mirror.get(id if pk is None else pk)
+            if obj is None:
+                raise self.model.DoesNotExist("%s matching query does not exist." %
+                                              self.model._meta.object_name)
+            return obj
+
+        url, url_template = clone._get_detail_url(id, pk)
+        call = None
+        try:
+            parameters = clone.query.parameters
+            logger.debug("""Retrieving : "%s" through %s with parameters "%s" """,
+                         clone.model.__name__, url, parameters)
+            call = RemoteCall('get', self.model, url, url_template=url_template,
+                              parameters=parameters)
+            response = send_request(self._get_requests_client(), 'get', url,
+                                    model=self.model, params=parameters,
+                                    headers=self._get_http_headers(), call=call)
+        except Exception as e:
+            if call is not None:
+                call.finish(exception=e)
+            raise ROAException(e)
 
-        # Instantiation of clone.model is necessary because we can't set
+        try:
+            # Deserializing objects:
+            with call.phase('parse'):
+                data = parse_response(self.model.get_parser(), response, call)
+                data = decode_keys(self.model, data)
+            with call.phase('validate'):
+                serializer = self.model.get_serializer(data=data)
+                for field in serializer.fields.items():
+                    validators = field[1].validators
+                    field[1].validators =[]
+                    for validator in validators:
+                        if validator.__class__.__name__ != "UniqueValidator":
+                            field[1].validators.append(validator)
+
+                if not serializer.is_valid():
+                    raise ROAException('Invalid deserialization for %s model: %s' % (self.model, serializer.errors))
+
+            with call.phase('hydrate'):
+                return serializer.Meta.model(**serializer.validated_data)
+        except Exception as e:
+            call.finish(exception=e)
+            raise
+        finally:
+            call.finish()
+
+    def _get_detail_url(self, id=None, pk=None):
+        """
+        Returns the detail URL of the object with the given id or pk and its
+        template.
+        """
+        # Instantiation of self.model is necessary because we can't set
         # a staticmethod for get_resource_url_detail and avoid to set it
         # for all model without relying on get_resource_url_list
-        instance = clone.model()
+        instance = self.model()
         if pk is None:
             instance.id = id
         else:
             instance.pk = pk
-        try:
-            parameters = clone.query.parameters
-            logger.debug("""Retrieving : "%s" through %s with parameters "%s" """ % (
-                clone.model.__name__,
-                instance.get_resource_url_detail(),
-                force_text(parameters)))
-            if ROA_SSL_CA:
-                response = self._get_requests_client().get(instance.get_resource_url_detail(), params=parameters,
-                                        headers=self._get_http_headers(),verify=ROA_SSL_CA)
-            else:
-                response = self._get_requests_client().get(instance.get_resource_url_detail(), params=parameters,
-                                        headers=self._get_http_headers())
-        except Exception as e:
-            raise ROAException(e)
-
-        response=response.text.encode("utf-8")
-
-        for local_name, remote_name in ROA_MODEL_NAME_MAPPING:
-            response = response.replace(remote_name, local_name)
-
-        # Deserializing objects:
-        data = self.model.get_parser().parse(BytesIO(response))
-        serializer = self.model.get_serializer(data=data)
-        for field in serializer.fields.items():
-            validators = field[1].validators
-            field[1].validators =[]
-            for validator in validators:
-                if validator.__class__.__name__ != "UniqueValidator":
-                    field[1].validators.append(validator)
-
-        if not serializer.is_valid():
-            raise ROAException('Invalid deserialization for %s model: %s' % (self.model, serializer.errors))
-
-        return serializer.Meta.model(**serializer.validated_data)
+        url = instance.get_resource_url_detail()
+        return url, get_url_template(url, instance.pk)
 
     def get(self, *args, **kwargs):
         """
@@ -356,7 +928,25 @@ class RemoteQuerySet(query.QuerySet):
         """
         # special case, get(id=X) directly request the resource URL and do not
         # filter on ids like Django's ORM do.
+        lookup = self._get_pk_lookup(kwargs)
+        if lookup is not None:
+            return self._get_from_id_or_pk(**lookup)
+        # filter the request rather than retrieve it through get method
+        return super(RemoteQuerySet, self).get(*args, **kwargs)
 
+    def get_lazy(self, *args, **kwargs):
+        """
+        Returns a ``get()`` to be evaluated by ``gather()`` along with other
+        reads, see ``django_roa.db.gather``.
+        """
+        return LazyGet(self, args, kwargs)
+
+    def _get_pk_lookup(self, kwargs):
+        """
+        Returns the ``id`` or ``pk`` keyword argument of
+        ``_get_from_id_or_pk`` if the ``get()`` keyword arguments ``kwargs``
+        look up a primary key, None otherwise.
+        """
         # keep the custom attribute name of model for later use
         custom_pk = self.model._meta.pk.attname
         # search PK, ID or custom PK attribute name for exact match and get set
@@ -365,31 +955,92 @@ class RemoteQuerySet(query.QuerySet):
         exact_match = list(attributes_set)
         # common way of getting particular object
         if list(kwargs.keys()) == ['id']:
-            return self._get_from_id_or_pk(id=kwargs['id'])
+            return {'id': kwargs['id']}
         # useful for admin which relies on PKs
         elif list(kwargs.keys()) == ['pk']:
-            return self._get_from_id_or_pk(pk=kwargs['pk'])
+            return {'pk': kwargs['pk']}
         # check the case of PK attribute with custom name
         elif list(kwargs.keys()) == [custom_pk]:
-            return self._get_from_id_or_pk(pk=kwargs[custom_pk])
+            return {'pk': kwargs[custom_pk]}
         # check if there's an exact match filter
         elif len(exact_match) == 1:
             # use the value of exact match filter to retrieve object by PK
-            return self._get_from_id_or_pk(pk=kwargs[exact_match[0]])
-        else:
-            # filter the request rather than retrieve it through get method
-            return super(RemoteQuerySet, self).get(*args, **kwargs)
+            return {'pk': kwargs[exact_match[0]]}
+        return None
 
-    def latest(self, field_name=None):
+    def exists(self):
+        """
+        Returns whether the query has results, fetching at most one row
+        without deserializing it.
+        """
+        if self._result_cache is not None:
+            return bool(self._result_cache)
+        clone = self._single_row()
+        if clone.query.plan.is_local:
+            return any(True for obj in clone.iterator())
+        with closing(ROAModelIterable(clone).rows()) as rows:
+            return next(rows, None) is not None
+
+    def first(self):
         """
-        Returns the latest object, according to the model's 'get_latest_by'
-        option or optional given field_name.
+        Returns the first object, by primary key if the query is not
+        ordered, or None.
         """
-        latest_by = field_name or self.model._meta.get_latest_by
-        assert bool(latest_by), "latest() requires either a field_name parameter or 'get_latest_by' in the model"
+        queryset = self if self.query.order_by else self.order_by(self.model._meta.pk.name)
+        for obj in queryset._single_row():
+            return obj
 
-        self.query.order_by.append('-%s' % latest_by)
-        return next(self.iterator())
+    def last(self):
+        """
+        Returns the last object, by primary key if the query is not ordered,
+        or None.
+        """
+        ordering = self.query.order_by or [self.model._meta.pk.name]
+        for obj in self._reordered(_reverse_ordering(ordering))._single_row():
+            return obj
+
+    def earliest(self, *fields):
+        """
+        Returns the earliest object, according to the given fields or the
+        model's 'get_latest_by' option.
+        """
+        return self._earliest(fields)
+
+    def latest(self, *fields):
+        """
+        Returns the latest object, according to the given fields or the
+        model's 'get_latest_by' option.
+        """
+        return self._earliest(fields, reverse=True)
+
+    def _earliest(self, fields, reverse=False):
+        ordering = fields or self.model._meta.get_latest_by
+        if not ordering:
+            raise ValueError("earliest() and latest() require either fields as positional "
+                             "arguments or 'get_latest_by' in the model's Meta.")
+        if isinstance(ordering, str):
+            ordering = [ordering]
+        for obj in self._reordered(_reverse_ordering(ordering) if reverse else ordering)._single_row():
+            return obj
+        raise self.model.DoesNotExist("%s matching query does not exist." % self.model._meta.object_name)
+
+    def _reordered(self, ordering):
+        assert self.query.can_filter(), \
+                "Cannot reorder a query once a slice has been taken."
+        clone = self._clone()
+        clone.query.clear_ordering()
+        clone.query.add_ordering(*ordering)
+        return clone
+
+    def _single_row(self):
+        """
+        Returns a clone limited to the first row of the query.
+        """
+        clone = self._clone()
+        start = clone.query.limit_start or 0
+        stop = clone.query.limit_stop
+        clone.query.set_limits(start, start + 1 if stop is None else min(stop, start + 1))
+        return clone
 
     def delete(self):
         """
@@ -423,13 +1074,6 @@ class RemoteQuerySet(query.QuerySet):
             assert self.query.can_filter(), \
                     "Cannot filter a query once a slice has been taken."
 
-        if not kwargs and args:
-            kwargs = {}
-            for arg in args:
-                for child in arg.children:
-                    if len(child) == 2 and arg.connector == "AND":
-                        kwargs.update({child[0]: child[1]})
-
         clone = self._clone()
         clone.query.filter(*args, **kwargs)
         return clone
@@ -466,7 +1110,9 @@ class RemoteQuerySet(query.QuerySet):
         This exists to support framework features such as 'limit_choices_to',
         and usually it will be more natural to use other methods.
         """
-        if isinstance(filter_obj, Q) or hasattr(filter_obj, 'add_to_query'):
+        if isinstance(filter_obj, Q):
+            return self.filter(filter_obj)
+        if hasattr(filter_obj, 'add_to_query'):
             raise ROAException('Not implemented yet')
         return self.filter(**filter_obj)
 
@@ -492,6 +1138,28 @@ class RemoteQuerySet(query.QuerySet):
             obj.query.max_depth = depth
         return obj
 
+    def values(self, *fields, **expressions):
+        """
+        Returns a QuerySet yielding dictionaries instead of instances.
+        """
+        if expressions:
+            raise ROANotImplementedYetException('values() does not support expressions.')
+        clone = self._clone()
+        clone.query.set_values(fields)
+        clone._iterable_class = ROAValuesIterable
+        return clone
+
+    def annotate(self, *args, **kwargs):
+        """
+        Returns a QuerySet yielding the aggregates of each group of rows
+        with the same ``values()``.
+        """
+        if self._iterable_class is not ROAValuesIterable:
+            raise ROANotImplementedYetException('annotate() is only supported after values().')
+        clone = self._clone()
+        clone.query.add_annotations(get_annotations(args, kwargs))
+        return clone
+
     def order_by(self, *field_names):
         """
         Returns a QuerySet instance with the ordering changed.
@@ -500,8 +1168,7 @@ class RemoteQuerySet(query.QuerySet):
                 "Cannot reorder a query once a slice has been taken."
 
         clone = self._clone()
-        for field_name in field_names:
-            clone.query.order_by.append(field_name)
+        clone.query.add_ordering(*field_names)
         return clone
 
     def extra(self, select=None, where=None, params=None, tables=None,
@@ -546,6 +1213,7 @@ class RemoteQuerySet(query.QuerySet):
         if self._sticky_filter:
             query.filter_is_sticky = True
         c = klass(model=self.model, query=query)
+        c._iterable_class = self._iterable_class
         c.__dict__.update(kwargs)
         if setup and hasattr(c, '_setup_query'):
             c._setup_query()
@@ -564,4 +1232,4 @@ class RemoteQuerySet(query.QuerySet):
         return get_roa_headers()
 
     def _get_requests_client(self):
-        return get_roa_client()
+        return get_roa_client(self.model)
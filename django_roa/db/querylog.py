@@ -0,0 +1,152 @@
+"""
+Per-request log of remote calls and N+1 detection.
+
+Calls finished while a ``QueryLog`` is active in the current thread are
+recorded with the user code frames they originate from. ``ROAMiddleware``
+activates one per request when ``ROA_QUERY_LOG`` is enabled (by default
+when ``DEBUG`` is) and reports N+1 patterns, i.e. at least
+``ROA_N_PLUS_ONE_THRESHOLD`` calls to the same detail URL template of a
+model, as warnings. Tests can use the context manager::
+
+    with record_remote_calls() as log:
+        for article in Article.objects.all():
+            article.reporter
+    assert not log.n_plus_one()
+"""
+import logging
+import os
+import sys
+import threading
+import traceback
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+import django
+import rest_framework
+from django.conf import settings
+
+import django_roa
+from django_roa.db.instrumentation import remote_call_finished
+
+logger = logging.getLogger("django_roa")
+
+ROA_QUERY_LOG = getattr(settings, 'ROA_QUERY_LOG', settings.DEBUG)
+ROA_N_PLUS_ONE_THRESHOLD = getattr(settings, 'ROA_N_PLUS_ONE_THRESHOLD', 3)
+ROA_QUERY_LOG_STACK_DEPTH = getattr(settings, 'ROA_QUERY_LOG_STACK_DEPTH', 3)
+
+# Frames from these packages are never reported as the origin of a call.
+LIBRARY_PATHS = tuple(os.path.dirname(module.__file__) + os.sep
+                      for module in (django, rest_framework, django_roa, threading))
+
+LoggedCall = namedtuple('LoggedCall', 'call origin')
+NPlusOne = namedtuple('NPlusOne', 'model method url_template count origin')
+
+_active = threading.local()
+
+
+def get_origin(depth=ROA_QUERY_LOG_STACK_DEPTH):
+    """
+    Returns the ``depth`` innermost frames of user code as
+    ``(filename, lineno, function)`` tuples.
+    """
+    origin = []
+    for frame, lineno in traceback.walk_stack(sys._getframe(1)):
+        filename = frame.f_code.co_filename
+        if filename.startswith(LIBRARY_PATHS) or filename.startswith('<'):
+            continue
+        origin.append((filename, lineno, frame.f_code.co_name))
+        if len(origin) >= depth:
+            break
+    return origin
+
+
+class QueryLog(object):
+    """
+    Remote calls recorded while active.
+    """
+
+    def __init__(self, stack_depth=ROA_QUERY_LOG_STACK_DEPTH):
+        self.stack_depth = stack_depth
+        self.calls = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __iter__(self):
+        return iter(self.calls)
+
+    def start(self):
+        logs = getattr(_active, 'logs', None)
+        if logs is None:
+            logs = _active.logs = []
+        logs.append(self)
+
+    def stop(self):
+        logs = getattr(_active, 'logs', [])
+        if self in logs:
+            logs.remove(self)
+
+    def record(self, call, origin):
+        self.calls.append(LoggedCall(call, origin))
+
+    @property
+    def duration(self):
+        return sum(logged.call.duration or 0 for logged in self.calls)
+
+    def n_plus_one(self, threshold=ROA_N_PLUS_ONE_THRESHOLD):
+        """
+        Returns the detail URL templates called at least ``threshold`` times
+        for the same model and method, with the origin of the first call.
+        """
+        groups = OrderedDict()
+        for logged in self.calls:
+            call = logged.call
+            if call.url_template == call.url:
+                continue
+            key = call.model, call.method, call.url_template
+            if key in groups:
+                groups[key][0] += 1
+            else:
+                groups[key] = [1, logged.origin]
+        return [NPlusOne(model, method, url_template, count, origin)
+                for (model, method, url_template), (count, origin) in groups.items()
+                if count >= threshold]
+
+    def report(self, label=''):
+        """
+        Logs a warning for each N+1 pattern found.
+        """
+        for pattern in self.n_plus_one():
+            logger.warning("N+1 remote calls%s: %s %s (%s) called %d times from %s",
+                           label and ' in %s' % label, pattern.method,
+                           pattern.url_template, pattern.model.__name__,
+                           pattern.count, format_origin(pattern.origin))
+
+
+def format_origin(origin):
+    return ' <- '.join('%s:%s in %s' % frame for frame in origin) or 'unknown'
+
+
+@contextmanager
+def record_remote_calls(stack_depth=ROA_QUERY_LOG_STACK_DEPTH):
+    """
+    Records the remote calls made by the current thread in its block.
+    """
+    log = QueryLog(stack_depth)
+    log.start()
+    try:
+        yield log
+    finally:
+        log.stop()
+
+
+def _record(sender, call, **kwargs):
+    logs = getattr(_active, 'logs', None)
+    if not logs:
+        return
+    origin = get_origin(max(log.stack_depth for log in logs))
+    for log in logs:
+        log.record(call, origin[:log.stack_depth])
+
+
+remote_call_finished.connect(_record, dispatch_uid='django_roa.querylog')
@@ -0,0 +1,194 @@
+"""
+Parallel partitioned scans of remote lists.
+
+``RemoteQuerySet.parallel_scan(workers=N)`` splits a queryset into
+partitions fetched concurrently by ``N`` threads over the pooled session:
+
+- primary key ranges (``filter_id__gte``/``filter_id__lt``) between the
+  bounds of the primary key, learned from a ``min``/``max`` aggregate or two
+  single-row queries, for unordered querysets or querysets ordered by an
+  integer primary key,
+- ``limit_start``/``limit_stop`` windows of the count of the queryset
+  otherwise, when the server supports slicing and counts without returning
+  the list (``'count'`` capability).
+
+Pages of partitions are validated and their remote calls finished by the
+thread consuming the scan, so that query logs see them. At most ``N``
+partitions are fetched ahead of the consumer.
+"""
+import logging
+import math
+from collections import deque
+
+from django.conf import settings
+from django.db.models import Max, Min
+
+from django_roa.db import get_roa_context, set_roa_context
+from django_roa.db.filters import split_lookup
+from django_roa.db.pagination import iter_pages
+
+logger = logging.getLogger("django_roa")
+
+ROA_SCAN_WORKERS = getattr(settings, 'ROA_SCAN_WORKERS', 4)
+# Partitions per worker, unless given.
+ROA_SCAN_PARTITIONS_PER_WORKER = getattr(settings, 'ROA_SCAN_PARTITIONS_PER_WORKER', 4)
+
+
+def get_remote_part(queryset):
+    """
+    Returns an unordered queryset of what the server evaluates of
+    ``queryset``, a superset of its results.
+    """
+    plan = queryset.query.plan
+    remote = queryset._clone()
+    query = remote.query
+    query.filters = dict(plan.filters)
+    query.excludes = dict(plan.excludes)
+    query.q_filters = list(plan.q_filters)
+    query.search_term = plan.search_term
+    query.order_by = []
+    query.changed()
+    return remote
+
+
+def get_pk_bounds(queryset):
+    """
+    Returns the lowest and highest primary keys of the results of
+    ``queryset`` as integers, ``(None, None)`` if there are none, or None
+    if they cannot be learned.
+    """
+    model = queryset.model
+    pk = model._meta.pk
+    capabilities = queryset.query.plan.capabilities
+    remote = get_remote_part(queryset)
+    if capabilities.supports_aggregate('min') and capabilities.supports_aggregate('max'):
+        bounds = remote.aggregate(low=Min(pk.name), high=Max(pk.name))
+        low, high = bounds['low'], bounds['high']
+    elif capabilities.supports_ordering(pk.name):
+        first, last = remote.order_by(pk.name).first(), remote.order_by('-%s' % pk.name).first()
+        low, high = first and first.pk, last and last.pk
+    else:
+        return None
+    if low is None or high is None:
+        return None, None
+    if not isinstance(low, int) or not isinstance(high, int):
+        return None
+    return low, high
+
+
+def get_partitions(queryset, count):
+    """
+    Returns up to ``count`` querysets partitioning the results of
+    ``queryset``, in its order, or None if it cannot be partitioned.
+    """
+    model = queryset.model
+    query = queryset.query
+    plan = query.plan
+    capabilities = plan.capabilities
+    pk = model._meta.pk
+    if plan.local_order_by or query.annotations or \
+            query.limit_start is not None or query.limit_stop is not None:
+        return None
+
+    ordering = [name.lstrip('+') for name in plan.order_by]
+    descending = ordering in (['-pk'], ['-%s' % pk.name])
+    filters_pk = any(split_lookup(key)[0] in ('pk', pk.name)
+                     for key in list(query.filters) + list(query.excludes))
+    if (not ordering or descending or ordering in (['pk'], [pk.name])) and not filters_pk and \
+            capabilities.supports_lookup('%s__gte' % pk.name) and \
+            capabilities.supports_lookup('%s__lt' % pk.name):
+        bounds = get_pk_bounds(queryset)
+        if bounds is not None:
+            low, high = bounds
+            if low is None:
+                return []
+            step = int(math.ceil((high - low + 1) / float(count)))
+            partitions = [queryset.filter(**{'%s__gte' % pk.name: start,
+                                             '%s__lt' % pk.name: min(start + step, high + 1)})
+                          for start in range(low, high + 1, step)]
+            return partitions[::-1] if descending else partitions
+
+    # Counting by downloading the list would defeat the purpose.
+    if capabilities.slicing and capabilities.count != 'list' and not plan.is_local and \
+            (ordering or capabilities.supports_ordering(pk.name)):
+        total = queryset.count()
+        if not total:
+            return []
+        # Offsets need a stable order.
+        ordered = queryset if ordering else queryset.order_by(pk.name)
+        step = int(math.ceil(total / float(count)))
+        return [ordered[start:start + step] for start in range(0, total, step)]
+    return None
+
+
+def scan(queryset, workers=None, partitions=None, ordered=False, chunk_size=None):
+    """
+    Yields the instances of ``queryset`` as its partitions are fetched by
+    ``workers`` threads, in the order of the queryset if ``ordered``.
+    Querysets that cannot be partitioned are iterated serially.
+    """
+    # Imported on first use, the query module using this one.
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+    from django_roa.db.query import ROAModelIterable
+
+    workers = workers or ROA_SCAN_WORKERS
+    parts = get_partitions(queryset, partitions or workers * ROA_SCAN_PARTITIONS_PER_WORKER)
+    if parts is None:
+        logger.debug("""Cannot partition "%s", scanning serially""", queryset.model.__name__)
+        for obj in queryset.iterator(chunk_size):
+            yield obj
+        return
+
+    model = queryset.model
+    url = model.get_resource_url_list()
+    client = queryset._get_requests_client()
+    headers = queryset._get_http_headers()
+    context = get_roa_context()
+
+    def fetch(partition):
+        # Per-thread headers and user of per-user authentication providers.
+        set_roa_context(context)
+        pages = []
+        try:
+            for page in iter_pages(model, client, url, partition.query, headers, chunk_size):
+                pages.append(page)
+        except Exception:
+            for call, rows in pages:
+                call.finish()
+            raise
+        return partition, pages
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    parts = iter(parts)
+    pending = deque()
+    for partition in parts:
+        pending.append(executor.submit(fetch, partition))
+        if len(pending) >= workers:
+            break
+    try:
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+                future = next(future for future in pending if future in done)
+                pending.remove(future)
+            partition, pages = future.result()
+            for next_partition in parts:
+                pending.append(executor.submit(fetch, next_partition))
+                break
+            try:
+                for obj in partition.query.plan.apply(ROAModelIterable(partition).instances(pages)):
+                    yield obj
+            finally:
+                for call, rows in pages:
+                    call.finish()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        # Partitions fetched but never consumed.
+        for future in pending:
+            if not future.cancelled() and future.exception() is None:
+                for call, rows in future.result()[1]:
+                    call.finish()
@@ -0,0 +1,93 @@
+"""
+Sends ROA requests through the configured client.
+
+Every remote call made by querysets and models goes through
+``send_request`` so that cross-cutting concerns (SSL CA, content
+negotiation, compression) are handled in one place.
+"""
+from io import BytesIO
+from time import perf_counter
+
+from django.conf import settings
+
+from django_roa.db.auth import get_auth_provider
+from django_roa.db.compression import get_accept_encoding, compress_payload
+
+ROA_SSL_CA = getattr(settings, 'ROA_SSL_CA', None)
+
+
+def send_request(client, method, url, model=None, headers=None, data=None,
+                 call=None, **kwargs):
+    """
+    Performs ``method`` on ``url`` with a requests-like ``client``.
+
+    GET responses are streamed so that compressed bodies can be decoded
+    while being parsed, see ``parse_response``. A 401 answer is
+    retried once after the authentication provider refreshed its token.
+    The network time, sizes and status are recorded on ``call``, a
+    ``RemoteCall``, if given.
+    """
+    headers = dict(headers or {})
+    headers.setdefault('Accept-Encoding', get_accept_encoding())
+    provider = get_auth_provider()
+    if provider is not None:
+        headers.update(provider.get_headers())
+    if data is not None:
+        data, content_encoding = compress_payload(model, url, data)
+        if content_encoding is not None:
+            headers['Content-Encoding'] = content_encoding
+        kwargs['data'] = data
+        if call is not None:
+            call.request_bytes = len(data)
+    if method == 'get':
+        kwargs.setdefault('stream', True)
+    if ROA_SSL_CA:
+        kwargs['verify'] = ROA_SSL_CA
+    started = perf_counter()
+    try:
+        response = getattr(client, method)(url, headers=headers, **kwargs)
+        if provider is not None and getattr(response, 'status_code', None) == 401 \
+                and provider.refresh(headers):
+            if hasattr(response, 'close'):
+                response.close()
+            headers.update(provider.get_headers())
+            response = getattr(client, method)(url, headers=headers, **kwargs)
+    finally:
+        if call is not None:
+            call.timings['network'] += perf_counter() - started
+    if call is not None:
+        call.status = getattr(response, 'status_code', None)
+    return response
+
+
+def get_response_stream(response, call=None):
+    """
+    Returns a file-like object over the decoded body of ``response``.
+
+    Streamed responses are read straight from the connection, the client
+    decoding ``Content-Encoding`` on the fly, instead of buffering the whole
+    compressed and decompressed bodies in memory. Bytes read are counted on
+    ``call`` if given.
+    """
+    raw = getattr(response, 'raw', None)
+    if raw is not None and getattr(response, '_content_consumed', True) is False:
+        raw.decode_content = True
+        stream = raw
+    else:
+        stream = BytesIO(response.content)
+    if call is not None:
+        stream = call.count(stream)
+    return stream
+
+
+def parse_response(parser, response, call=None):
+    """
+    Returns the body of ``response`` parsed by ``parser``, closing the
+    response, and the connection of a streamed one not read to its end,
+    even if parsing fails.
+    """
+    try:
+        return parser.parse(get_response_stream(response, call))
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
@@ -0,0 +1,147 @@
+"""
+Warming up a process before it serves traffic.
+
+``warmup()`` opens pooled connections to every host of the ROA models (DNS
+resolution and TLS handshakes included), fetches the authentication token,
+discovers capabilities (see ``ROA_DISCOVERY``) and loads the hot resources
+listed in ``ROA_WARMUP_RESOURCES``::
+
+    ROA_WARMUP_RESOURCES = [
+        # A mirrored model, whose mirror is synced (see django_roa.db.mirror).
+        'catalog.category',
+        # Or a callable, e.g. filling a project cache.
+        'catalog.warmup.load_menus',
+    ]
+
+Run it with the ``roa_warmup`` command, or in every worker with the
+``post_fork`` hook, e.g. in ``gunicorn.conf.py``::
+
+    from django_roa.db.warmup import post_fork
+
+or with uWSGI::
+
+    from uwsgidecorators import postfork
+    from django_roa.db.warmup import post_fork
+    postfork(post_fork)
+"""
+import logging
+import threading
+from collections import OrderedDict
+from time import perf_counter
+from urllib.parse import urlsplit
+
+from django.apps import apps
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from django_roa.db import get_roa_client, get_roa_headers, get_roa_models
+from django_roa.db.auth import get_auth_provider
+from django_roa.db.discovery import ROA_DISCOVERY, discover_all
+from django_roa.db.exceptions import ROAException
+from django_roa.db.mirror import get_mirror
+from django_roa.db.transport import send_request
+
+logger = logging.getLogger("django_roa")
+
+ROA_WARMUP_RESOURCES = getattr(settings, 'ROA_WARMUP_RESOURCES', [])
+# Connections opened to each host, at most ROA_POOL_MAXSIZE are kept.
+ROA_WARMUP_CONNECTIONS = getattr(settings, 'ROA_WARMUP_CONNECTIONS', 1)
+
+
+def get_hosts(models):
+    """
+    Returns a model for each host, ``'scheme://netloc'``, serving ``models``.
+    """
+    hosts = OrderedDict()
+    for model in models:
+        split = urlsplit(model.get_resource_url_list())
+        hosts.setdefault('%s://%s' % (split.scheme, split.netloc), model)
+    return hosts
+
+
+def connect(model, connections=ROA_WARMUP_CONNECTIONS):
+    """
+    Opens ``connections`` connections to the host of ``model`` with ``HEAD``
+    requests to its list URL, sent concurrently so that each one takes a
+    connection of the pool.
+    """
+    url = model.get_resource_url_list()
+    errors = []
+
+    def head():
+        try:
+            send_request(get_roa_client(model), 'head', url, model=model,
+                         headers=get_roa_headers()).close()
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target=head) for i in range(connections)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def load_resource(resource):
+    """
+    Loads a hot resource: syncs the mirror of a model label, or calls the
+    dotted path of a callable.
+    """
+    try:
+        model = apps.get_model(resource)
+    except (LookupError, ValueError):
+        return import_string(resource)()
+    mirror = get_mirror(model)
+    if mirror is None:
+        raise ROAException('%s has no mirror to load, declare one or warm it up with a callable.'
+                           % model._meta.label)
+    return mirror.sync()
+
+
+def _step(report, name, function, *args):
+    started = perf_counter()
+    try:
+        function(*args)
+    except Exception as e:
+        logger.warning("Warmup of %s failed: %s", name, e)
+        report[name] = e
+    else:
+        report[name] = perf_counter() - started
+
+
+def warmup(models=None, resources=None):
+    """
+    Warms up connections, tokens, capabilities and hot resources.
+
+    Returns an ordered dict of the seconds spent on each step, or the
+    exception it raised: a failed step is logged and does not stop the
+    others.
+    """
+    if models is None:
+        models = get_roa_models()
+    if resources is None:
+        resources = ROA_WARMUP_RESOURCES
+    report = OrderedDict()
+    provider = get_auth_provider()
+    if provider is not None:
+        _step(report, 'auth', provider.get_headers)
+    for host, model in get_hosts(models).items():
+        _step(report, host, connect, model)
+    if ROA_DISCOVERY:
+        _step(report, 'discovery', discover_all, models)
+    for resource in resources:
+        _step(report, resource, load_resource, resource)
+    return report
+
+
+def post_fork(*args, **kwargs):
+    """
+    Warms up a worker right after its fork, usable as the ``post_fork`` hook
+    of gunicorn or with uWSGI's ``postfork`` decorator.
+    """
+    # The pooled session is per process already, timers are not.
+    provider = get_auth_provider()
+    if provider is not None:
+        provider.after_fork()
+    warmup()
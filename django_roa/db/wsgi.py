@@ -0,0 +1,252 @@
+"""
+In-process transport for backends served by the same process.
+
+``WSGIClient`` is a requests-like client dispatching ROA requests straight
+into a WSGI application, without sockets, and turning its answer into a
+``requests.Response``: status, headers and body are those the application
+produced. Select it globally or for some models only::
+
+    ROA_CLIENT = 'django_roa.db.wsgi.WSGIClient'
+
+    class Article(ROAModel):
+        roa_client = 'django_roa.db.wsgi.WSGIClient'
+
+``ROA_WSGI_APPLICATION`` is the dotted path of the application, by default
+the project's ``WSGI_APPLICATION``. It can also map hosts to applications,
+requests to other hosts then going over the network with ``requests``::
+
+    ROA_WSGI_APPLICATION = {'api.example.com': 'backend.wsgi.application'}
+"""
+import sys
+from datetime import timedelta
+from io import BytesIO
+from time import perf_counter
+from urllib.parse import urljoin, urlsplit, unquote_to_bytes
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler, get_script_name
+from django.urls import get_script_prefix, get_urlconf, set_script_prefix, set_urlconf
+from django.utils import translation
+from django.utils.module_loading import import_string
+
+from django_roa.db import get_roa_context, get_roa_session, set_roa_context
+
+ROA_WSGI_APPLICATION = getattr(settings, 'ROA_WSGI_APPLICATION', None)
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 30
+
+_applications = {}
+
+
+def get_wsgi_application(host):
+    """
+    Returns the WSGI application serving ``host`` in this process, or None
+    if requests to it must go over the network.
+    """
+    path = ROA_WSGI_APPLICATION
+    if isinstance(path, dict):
+        path = path.get(host)
+        if path is None:
+            return None
+    if host not in _applications:
+        if path is None:
+            from django.core.servers.basehttp import get_internal_wsgi_application
+            application = get_internal_wsgi_application()
+        else:
+            application = import_string(path)
+        _applications[host] = application
+    return _applications[host]
+
+
+class _nested_request(object):
+    """
+    Keeps a request dispatched from within a request from changing the
+    URLconf, script prefix, language and ROA context of the outer one.
+    """
+
+    def __enter__(self):
+        self.urlconf = get_urlconf()
+        self.script_prefix = get_script_prefix()
+        self.language = translation.get_language()
+        self.context = get_roa_context()
+
+    def __exit__(self, *exc_info):
+        set_roa_context(self.context)
+        set_urlconf(self.urlconf)
+        set_script_prefix(self.script_prefix)
+        if self.language:
+            translation.activate(self.language)
+        else:
+            translation.deactivate()
+
+
+def _close_response(response):
+    """
+    Closes the resources of a Django response like ``response.close()``,
+    without sending ``request_finished``.
+    """
+    closers = list(getattr(response, '_resource_closers', ()))
+    closers.extend(closable.close for closable in getattr(response, '_closable_objects', ()))
+    for closer in closers:
+        try:
+            closer()
+        except Exception:
+            pass
+
+
+class WSGIClient(object):
+    """
+    Requests-like client calling WSGI applications in-process.
+    """
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def options(self, url, **kwargs):
+        return self.request('options', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('head', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('post', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('put', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('patch', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def request(self, method, url, params=None, data=None, headers=None, json=None,
+                auth=None, allow_redirects=True, **kwargs):
+        application = get_wsgi_application(urlsplit(url).netloc)
+        if application is None:
+            return get_roa_session().request(method, url, params=params, data=data,
+                                             headers=headers, json=json, auth=auth,
+                                             allow_redirects=allow_redirects, **kwargs)
+        prepared = requests.Request(method.upper(), url, params=params, data=data,
+                                    headers=headers, json=json, auth=auth).prepare()
+        # Nothing to gain from compressing bytes that never leave the process.
+        prepared.headers['Accept-Encoding'] = 'identity'
+        response = self.send(application, prepared)
+
+        redirects = 0
+        while allow_redirects and response.status_code in REDIRECT_STATUSES:
+            redirects += 1
+            if redirects > MAX_REDIRECTS:
+                raise requests.TooManyRedirects('Exceeded %s redirects.' % MAX_REDIRECTS,
+                                                response=response)
+            location = urljoin(response.url, response.headers['Location'])
+            if get_wsgi_application(urlsplit(location).netloc) is not application:
+                break
+            redirected = prepared.copy()
+            redirected.url = location
+            if response.status_code == 303 and method != 'head' or \
+                    response.status_code in (301, 302) and method == 'post':
+                redirected.method = 'GET'
+                redirected.body = None
+                for name in ('Content-Length', 'Content-Type', 'Content-Encoding'):
+                    redirected.headers.pop(name, None)
+            response = self.send(application, redirected)
+            prepared = redirected
+        return response
+
+    def send(self, application, prepared):
+        """
+        Calls ``application`` with the WSGI environ of a prepared request
+        and returns its response, body read.
+        """
+        started = perf_counter()
+        environ = self.get_environ(prepared)
+        status_headers = []
+
+        def start_response(status, response_headers, exc_info=None):
+            status_headers[:] = [status, response_headers]
+            return lambda chunk: body.append(chunk)
+
+        body = []
+        with _nested_request():
+            if isinstance(application, WSGIHandler):
+                status_headers = self.call_handler(application, environ, body)
+            else:
+                result = application(environ, start_response)
+                try:
+                    body.extend(result)
+                finally:
+                    if hasattr(result, 'close'):
+                        result.close()
+
+        status, response_headers = status_headers
+        response = requests.Response()
+        response.status_code = int(status.split(' ', 1)[0])
+        response.reason = status.split(' ', 1)[1] if ' ' in status else ''
+        response.headers = CaseInsensitiveDict()
+        for name, value in response_headers:
+            if name in response.headers:
+                value = '%s, %s' % (response.headers[name], value)
+            response.headers[name] = value
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = b''.join(body)
+        response.url = prepared.url
+        response.request = prepared
+        response.elapsed = timedelta(seconds=perf_counter() - started)
+        return response
+
+    def call_handler(self, handler, environ, body):
+        """
+        Calls a Django WSGI handler as it calls itself, except for the
+        ``request_started`` and ``request_finished`` signals: their
+        receivers would close the database connections of the outer request.
+        Appends the body to ``body`` and returns the status and headers.
+        """
+        set_script_prefix(get_script_name(environ))
+        request = handler.request_class(environ)
+        response = handler.get_response(request)
+        try:
+            body.extend(response)
+        finally:
+            _close_response(response)
+        headers = list(response.items())
+        headers.extend(('Set-Cookie', cookie.output(header='')) for cookie in response.cookies.values())
+        return '%d %s' % (response.status_code, response.reason_phrase), headers
+
+    def get_environ(self, prepared):
+        parts = urlsplit(prepared.url)
+        body = prepared.body or b''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': prepared.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': unquote_to_bytes(parts.path or '/').decode('iso-8859-1'),
+            'QUERY_STRING': parts.query,
+            'SERVER_NAME': parts.hostname or 'localhost',
+            'SERVER_PORT': str(parts.port or (443 if parts.scheme == 'https' else 80)),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': parts.scheme or 'http',
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'HTTP_HOST': parts.netloc,
+        }
+        for name, value in prepared.headers.items():
+            key = name.upper().replace('-', '_')
+            if key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                environ[key] = value
+            else:
+                environ['HTTP_%s' % key] = value
+        return environ
@@ -1,14 +1,15 @@
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import BaseCommand
 
-class Command(NoArgsCommand):
+from django_roa.db import get_roa_models
+
+
+class Command(BaseCommand):
     help = "Introspects the models and outputs a representation of resources."
 
-    requires_model_validation = False
+    requires_system_checks = False
 
-    def handle_noargs(self, **options):
-        from django.db.models import get_models
-        for model in get_models():
-            if hasattr(model.objects, 'is_roa_manager'):
-                print('%s (%s)' % (model.__name__, model.get_resource_url_list()))
-                for field in model._meta.fields:
-                    print('  %s (%s)' % (field.attname, field.__class__.__name__))
\ No newline at end of file
+    def handle(self, **options):
+        for model in get_roa_models():
+            self.stdout.write('%s (%s)' % (model.__name__, model.get_resource_url_list()))
+            for field in model._meta.fields:
+                self.stdout.write('  %s (%s)' % (field.attname, field.__class__.__name__))
@@ -0,0 +1,37 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_roa.db import get_roa_models
+from django_roa.db.mirror import TableMirror, get_mirror, sync_all
+
+
+class Command(BaseCommand):
+    help = "Pulls the rows changed since the last sync into the mirrors of ROA models."
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', metavar='app_label.ModelName',
+                            help="Models to sync instead of every mirrored model.")
+        parser.add_argument('--full', action='store_true',
+                            help="Pull every row, dropping the rows deleted without tombstones.")
+        parser.add_argument('--create-tables', action='store_true',
+                            help="Create the tables of the replicas in their database first.")
+
+    def handle(self, *args, **options):
+        models = None
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as e:
+                raise CommandError(e)
+            for model in models:
+                if get_mirror(model) is None:
+                    raise CommandError('%s has no mirror.' % model._meta.label)
+        if options['create_tables']:
+            for model in models or get_roa_models():
+                mirror = get_mirror(model)
+                if isinstance(mirror, TableMirror):
+                    mirror.create_tables()
+        for model, count in sync_all(models, full=options['full']).items():
+            self.stdout.write('%s: %s row(s)' % (model._meta.label, count))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_roa.db.warmup import warmup
+
+
+class Command(BaseCommand):
+    help = "Opens connections, fetches tokens and capabilities of ROA models and loads hot resources."
+
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument('resources', nargs='*',
+                            help="Hot resources to load instead of ROA_WARMUP_RESOURCES.")
+        parser.add_argument('--fail-on-error', action='store_true',
+                            help="Exit with an error if a step failed.")
+
+    def handle(self, *args, **options):
+        report = warmup(resources=options['resources'] or None)
+        failed = 0
+        for name, result in report.items():
+            if isinstance(result, Exception):
+                failed += 1
+                self.stderr.write('%s: %s' % (name, result))
+            else:
+                self.stdout.write('%s: %.1fms' % (name, result * 1000))
+        if failed and options['fail_on_error']:
+            raise CommandError('%s warmup step(s) failed.' % failed)
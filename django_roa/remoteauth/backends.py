@@ -1,3 +1,4 @@
+from django_roa.remoteauth.cache import cache_user, get_cached_user
 from django_roa.remoteauth.models import User
 from django.contrib.auth.backends import ModelBackend
 
@@ -10,6 +11,8 @@ class RemoteUserModelBackend(ModelBackend):
         try:
             user = User.objects.get(username=username)
             if user.check_password(password):
+                # Resolved by get_user on the next requests
+                cache_user(user)
                 return user
         except User.DoesNotExist:
             return None
@@ -28,7 +31,16 @@ class RemoteUserModelBackend(ModelBackend):
         return user_obj._group_perm_cache
 
     def get_user(self, user_id):
+        """
+        Returns the user from its cached snapshot, from the server if it is
+        not cached, see django_roa.remoteauth.cache.
+        """
+        user = get_cached_user(User, user_id)
+        if user is not None:
+            return user
         try:
-            return User.objects.get(pk=user_id)
+            user = User.objects.get(pk=user_id)
         except User.DoesNotExist:
             return None
+        cache_user(user)
+        return user
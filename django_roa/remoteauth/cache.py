@@ -0,0 +1,95 @@
+"""
+Cached resolution of remote users.
+
+``RemoteUserModelBackend.get_user`` runs on every authenticated request.
+Snapshots of users, the values of their fields, are kept in the
+``ROA_USER_CACHE`` Django cache for ``ROA_USER_CACHE_TIMEOUT`` seconds (60
+by default, 0 disables them), so that workers share them and requests make
+no remote call to resolve their user while it is cached. Password hashes are
+not kept: users built from snapshots have None instead and the session
+authentication hash of the cached user.
+
+Saving or deleting a user through its model forgets its snapshot. Changes
+made on the server by other clients, e.g. deactivations or new permissions,
+are not detected: they are seen once the timeout elapsed. Snapshots are
+versioned by the fields of the model, so that a deployment changing them
+ignores the snapshots of the previous one, not by the data of users.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_roa.db.mapping import get_model_key
+
+ROA_USER_CACHE = getattr(settings, 'ROA_USER_CACHE', 'default')
+ROA_USER_CACHE_TIMEOUT = getattr(settings, 'ROA_USER_CACHE_TIMEOUT', 60)
+
+# Fields left out of snapshots.
+EXCLUDED_FIELDS = ('password',)
+# Bumped when the layout of snapshots changes.
+SNAPSHOT_FORMAT = 2
+
+_versions = {}
+
+
+def get_version(model):
+    """
+    Returns the version of the snapshots of ``model``, a digest of its
+    fields.
+    """
+    version = _versions.get(model)
+    if version is None:
+        fields = '%s:%s' % (SNAPSHOT_FORMAT, ','.join(field.attname for field in model._meta.concrete_fields))
+        version = _versions[model] = hashlib.sha1(fields.encode('utf-8')).hexdigest()[:8]
+    return version
+
+
+def _get_cache_key(model, user_id):
+    return 'django_roa.remoteauth.%s.%s.%s' % (get_model_key(model), get_version(model), user_id)
+
+
+def get_cached_user(model, user_id):
+    """
+    Returns the user of ``model`` with primary key ``user_id`` built from
+    its snapshot, or None if it is not cached.
+    """
+    if not ROA_USER_CACHE_TIMEOUT:
+        return None
+    snapshot = caches[ROA_USER_CACHE].get(_get_cache_key(model, user_id))
+    if snapshot is None:
+        return None
+    values, session_auth_hash = snapshot
+    user = model(**values)
+    for name in EXCLUDED_FIELDS:
+        if hasattr(user, name):
+            setattr(user, name, None)
+    user.session_auth_hash = session_auth_hash
+    return user
+
+
+def cache_user(user):
+    """
+    Keeps a snapshot of ``user``.
+    """
+    if not ROA_USER_CACHE_TIMEOUT or user.pk is None:
+        return
+    model = user.__class__
+    values = dict((field.attname, getattr(user, field.attname))
+                  for field in model._meta.concrete_fields if field.attname not in EXCLUDED_FIELDS)
+    session_auth_hash = user.get_session_auth_hash() if hasattr(user, 'get_session_auth_hash') else None
+    caches[ROA_USER_CACHE].set(_get_cache_key(model, user.pk), (values, session_auth_hash),
+                               ROA_USER_CACHE_TIMEOUT)
+
+
+def forget_user(model, user_id):
+    """
+    Forgets the snapshot of the user of ``model`` with primary key
+    ``user_id``.
+    """
+    if ROA_USER_CACHE_TIMEOUT and user_id is not None:
+        caches[ROA_USER_CACHE].delete(_get_cache_key(model, user_id))
+
+
+def forget_saved_user(sender, instance, **kwargs):
+    forget_user(sender, instance.pk)
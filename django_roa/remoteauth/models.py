@@ -11,8 +11,10 @@ except ImportError:
     DjangoMessage = None
 from django.utils.translation import ugettext_lazy as _
 from django.db import models
+from django.db.models import signals
 
 from django_roa import Model, Manager
+from django_roa.remoteauth.cache import forget_saved_user, forget_user
 
 
 class Permission(Model, DjangoPermission):
@@ -108,6 +110,29 @@ class User(Model, DjangoUser):
         from .serializers import UserSerializer
         return UserSerializer
 
+    def get_session_auth_hash(self):
+        # Users built from cached snapshots have no password hash, see
+        # django_roa.remoteauth.cache.
+        if self.password is None:
+            return getattr(self, 'session_auth_hash', None)
+        return super(User, self).get_session_auth_hash()
+
+    def save(self, *args, **kwargs):
+        if self.password is None and self.pk is not None:
+            self.password = User.objects.get(pk=self.pk).password
+        return super(User, self).save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.pk
+        result = super(User, self).delete(*args, **kwargs)
+        forget_user(self.__class__, user_id)
+        return result
+
+
+# On post_save rather than in save(), which only records saves in roa_batch()
+# blocks.
+signals.post_save.connect(forget_saved_user, sender=User)
+
 
 Message = None
 
@@ -0,0 +1,520 @@
+"""
+Network-free testing of ROA models.
+
+``FakeClient`` serves ROA requests from ``fake_backend``, an in-memory
+store of remote rows per model that understands the parameters emitted by
+``Query.parameters`` (filters, excludes, JSON filter expressions, search,
+ordering and slicing, renamed through ``ROA_ARGS_NAMES_MAPPING``, and
+``page_size``/``page`` pagination, ``fields`` sparse fieldsets) as well as
+detail, count, aggregate, create (of a row or an array of rows), update,
+delete and ``OPTIONS`` requests, answered with the capabilities set in
+``fake_backend.capabilities`` by model, and batches of them at
+``fake_backend.batch_url`` (``ROA_BATCH_URL`` by default). ``ROATestCase``
+sets ``ROA_CLIENT`` to ``FakeClient`` during each test::
+
+    class ArticleTests(ROATestCase):
+
+        def test_headlines(self):
+            fake_backend.load(Article, [{'id': 1, 'headline': 'Hello'}])
+            with self.assertNumRemoteQueries(1):
+                self.assertEqual(Article.objects.get(id=1).headline, 'Hello')
+
+Rows are stored as the remote API represents them, i.e. as rendered by the
+model serializer. ``patch_attributes()`` sets attributes of models, e.g.
+``roa_capabilities``, for the rest of a test. ``ROADatabaseTestCase`` is the
+``TestCase`` counterpart of ``ROATestCase``, e.g. for read replicas.
+"""
+import gzip
+import json
+import threading
+import zlib
+from collections import OrderedDict
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlencode, urlsplit, parse_qsl
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Avg, Count, Max, Min, StdDev, Sum, Variance
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from django_roa.db.aggregates import AGGREGATE_PARAMETER, GROUP_BY_PARAMETER, aggregate_objects
+from django_roa.db.batch import ROA_BATCH_URL
+from django_roa.db.exceptions import ROANotImplementedYetException
+from django_roa.db.filters import FILTER_EXPRESSION_PARAMETER, split_lookup
+from django_roa.db.lookups import compile_lookup, compile_search, get_field, sort, to_python
+from django_roa.db.mapping import get_field_mapping
+from django_roa.db.querylog import record_remote_calls, format_origin
+
+ROA_ARGS_NAMES_MAPPING = getattr(settings, 'ROA_ARGS_NAMES_MAPPING', {})
+
+FILTER_PREFIX = ROA_ARGS_NAMES_MAPPING.get('FILTER_', 'filter_')
+EXCLUDE_PREFIX = ROA_ARGS_NAMES_MAPPING.get('EXCLUDE_', 'exclude_')
+PAGE_PARAMETER = 'page'
+PAGE_SIZE_PARAMETER = 'page_size'
+FIELDS_PARAMETER = 'fields'
+AGGREGATES = {
+    'avg': Avg, 'count': Count, 'max': Max, 'min': Min,
+    'stddev': StdDev, 'sum': Sum, 'variance': Variance,
+}
+# Parameters renamed one by one, e.g. {'filter_id__exact': 'user_id'}
+RENAMED_PARAMETERS = dict((remote, local) for local, remote in ROA_ARGS_NAMES_MAPPING.items()
+                          if local.startswith((FILTER_PREFIX, EXCLUDE_PREFIX)))
+
+
+class BadRequest(Exception):
+    pass
+
+
+class FakeBackend(object):
+    """
+    In-memory remote resources, one ordered collection of rows per model.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.collections = {}
+        # Capabilities answered to OPTIONS requests, by model.
+        self.capabilities = {}
+        self._models = None
+        self.batch_url = ROA_BATCH_URL
+
+    def reset(self):
+        with self.lock:
+            self.collections.clear()
+            self.capabilities.clear()
+
+    def load(self, model, rows):
+        """
+        Adds ``rows`` to the collection of ``model``, replacing rows with
+        the same primary key.
+        """
+        with self.lock:
+            collection = self.get_collection(model)
+            for row in rows:
+                collection[self.get_pk(model, row)] = dict(row)
+
+    def rows(self, model):
+        with self.lock:
+            return list(self.get_collection(model).values())
+
+    def get_collection(self, model):
+        return self.collections.setdefault(model._meta.concrete_model, OrderedDict())
+
+    def get_pk(self, model, row):
+        return str(row.get(self.remote_name(model, model._meta.pk.name)))
+
+    def remote_name(self, model, name):
+        return get_field_mapping(model)[1].get(name, name)
+
+    ###########
+    # ROUTING #
+    ###########
+
+    def get_models(self):
+        """
+        Returns ROA models by list URL.
+        """
+        if self._models is None:
+            models = {}
+            for model in apps.get_models():
+                if not hasattr(model, 'get_resource_url_list'):
+                    continue
+                try:
+                    models[model.get_resource_url_list()] = model
+                except Exception:
+                    continue
+            self._models = models
+        return self._models
+
+    def resolve(self, url):
+        """
+        Returns ``(model, pk)`` for a list (pk is None), detail or count (pk
+        is ``count``) URL.
+        """
+        models = self.get_models()
+        if url in models:
+            return models[url], None
+        base, sep, tail = url.rstrip('/').rpartition('/')
+        base += sep
+        if base in models:
+            return models[base], tail
+        return None, None
+
+    ############
+    # REQUESTS #
+    ############
+
+    def handle(self, method, url, params=None, data=None, headers=None):
+        """
+        Returns ``(model, status, data)``, ``data`` being rendered by the
+        client.
+        """
+        split = urlsplit(url)
+        params = dict(parse_qsl(split.query), **(params or {}))
+        url = split._replace(query='').geturl()
+        model, pk = self.resolve(url)
+        if model is None:
+            return None, 404, {'detail': 'Not found.'}
+        try:
+            with self.lock:
+                if pk is None and method == 'get':
+                    rows = self.select(model, self.list(model, params), params)
+                    return model, 200, self.paginate(url, rows, params)
+                if pk is None and method == 'post':
+                    if isinstance(data, list):
+                        return model, 201, [self.create(model, row) for row in data]
+                    return model, 201, self.create(model, data)
+                if pk is None and method == 'options':
+                    return model, 200, {'name': model.__name__,
+                                        'capabilities': self.capabilities.get(model, {})}
+                if pk == 'count' and method == 'get':
+                    return model, 200, len(self.list(model, params))
+                if pk == 'aggregate' and method == 'get':
+                    return model, 200, self.aggregate(model, params)
+                collection = self.get_collection(model)
+                if pk not in collection:
+                    return model, 404, {'detail': 'Not found.'}
+                if method == 'get':
+                    return model, 200, collection[pk]
+                if method in ('put', 'patch'):
+                    collection[pk].update(data)
+                    return model, 200, collection[pk]
+                if method == 'delete':
+                    del collection[pk]
+                    return model, 204, None
+        except BadRequest as e:
+            return model, 400, {'detail': str(e)}
+        return model, 405, {'detail': 'Method "%s" not allowed.' % method.upper()}
+
+    def handle_batch(self, requests):
+        """
+        Returns the responses to a batch of requests, see
+        ``django_roa.db.batch``.
+        """
+        responses = []
+        for request in requests:
+            model, status, data = self.handle(request['method'].lower(), request['url'],
+                                              data=request.get('body'))
+            responses.append({'status': status, 'body': data})
+        return responses
+
+    def create(self, model, data):
+        collection = self.get_collection(model)
+        pk_name = self.remote_name(model, model._meta.pk.name)
+        if data.get(pk_name) is None:
+            pks = [int(pk) for pk in collection if pk.isdigit()]
+            data[pk_name] = max(pks) + 1 if pks else 1
+        collection[self.get_pk(model, data)] = data
+        return data
+
+    def list(self, model, params):
+        filters, excludes, order_by, search = [], [], None, None
+        expression = None
+        limit_start = limit_stop = None
+        for name, value in params.items():
+            name = RENAMED_PARAMETERS.get(name, name)
+            if name.startswith(FILTER_PREFIX):
+                filters.append((name[len(FILTER_PREFIX):], value))
+            elif name.startswith(EXCLUDE_PREFIX):
+                excludes.append((name[len(EXCLUDE_PREFIX):], value))
+            elif name == FILTER_EXPRESSION_PARAMETER:
+                try:
+                    expression = self.compile_expression(model, json.loads(value))
+                except ValueError:
+                    raise BadRequest('Invalid filter expression: %s' % value)
+            elif name == ROA_ARGS_NAMES_MAPPING.get('ORDER_BY', 'order_by'):
+                order_by = [field for field in str(value).split(',') if field and field != '?']
+            elif name == ROA_ARGS_NAMES_MAPPING.get('SEARCH_', 'search'):
+                search = compile_search(model, str(value), lambda row, field: row.get(
+                    self.remote_name(model, field.name)))
+            elif name == ROA_ARGS_NAMES_MAPPING.get('LIMIT_START', 'limit_start'):
+                limit_start = int(value)
+            elif name == ROA_ARGS_NAMES_MAPPING.get('LIMIT_STOP', 'limit_stop'):
+                limit_stop = int(value)
+
+        filters = [self.compile_lookup(model, key, value) for key, value in filters]
+        excludes = [self.compile_lookup(model, key, value) for key, value in excludes]
+        rows = [row for row in self.get_collection(model).values()
+                if all(match(row) for match in filters)
+                and not any(match(row) for match in excludes)
+                and (expression is None or expression(row))
+                and (search is None or search(row))]
+        if order_by:
+            rows = sort(rows, order_by, lambda row, path: self.get_value(model, row, path))
+        return rows[limit_start:limit_stop]
+
+    def select(self, model, rows, params):
+        """
+        Restricts ``rows`` to the fields of the sparse fieldset, if any.
+        """
+        if FIELDS_PARAMETER not in params:
+            return rows
+        fields = str(params[FIELDS_PARAMETER]).split(',')
+        return [dict((name, value) for name, value in row.items() if name in fields) for row in rows]
+
+    def paginate(self, url, rows, params):
+        """
+        Returns a page of ``rows`` as Django REST framework's page number
+        pagination renders it, if a page size is requested.
+        """
+        if PAGE_SIZE_PARAMETER not in params:
+            return rows
+        try:
+            page_size = int(params[PAGE_SIZE_PARAMETER])
+            page = int(params.get(PAGE_PARAMETER, 1))
+        except ValueError:
+            raise BadRequest('Invalid page: %s' % params)
+        start = (page - 1) * page_size
+        next_url = None
+        if start + page_size < len(rows):
+            next_params = dict(params, **{PAGE_PARAMETER: page + 1})
+            next_url = '%s?%s' % (url, urlencode(sorted(next_params.items())))
+        return OrderedDict([('count', len(rows)), ('next', next_url), ('previous', None),
+                            ('results', rows[start:start + page_size])])
+
+    def aggregate(self, model, params):
+        annotations = OrderedDict()
+        try:
+            for item in params.get(AGGREGATE_PARAMETER, '').split(','):
+                alias, function, source = item.split(':')
+                annotations[alias] = AGGREGATES[function](source)
+        except (KeyError, ValueError):
+            raise BadRequest('Invalid aggregate: %s' % params.get(AGGREGATE_PARAMETER))
+        group_by = [name for name in params.get(GROUP_BY_PARAMETER, '').split(',') if name]
+
+        def get_value(row, name):
+            field, value = self.get_value(model, row, name.split('__'))
+            return to_python(field, value)
+        results = aggregate_objects(self.list(model, params), annotations, group_by, get_value)
+        return results if group_by else results[0]
+
+    ###########
+    # LOOKUPS #
+    ###########
+
+    def get_field(self, model, name):
+        try:
+            return get_field(model, name)
+        except FieldDoesNotExist:
+            raise BadRequest('Cannot resolve keyword "%s" on %s' % (name, model.__name__))
+
+    def get_value(self, model, row, path):
+        """
+        Returns the field at the end of ``path`` and its value in ``row``,
+        following foreign keys through their collections.
+        """
+        field = self.get_field(model, path[0])
+        if not field.concrete:
+            raise BadRequest('Cannot filter on "%s" of %s' % (path[0], model.__name__))
+        value = row.get(self.remote_name(model, field.name), row.get(field.attname))
+        if field.is_relation:
+            related = field.related_model
+            if isinstance(value, dict):
+                related_row, value = value, value.get(self.remote_name(related, related._meta.pk.name))
+            else:
+                related_row = self.get_collection(related).get(str(value))
+            if len(path) > 1:
+                if related_row is None:
+                    return None, None
+                return self.get_value(related, related_row, path[1:])
+        elif len(path) > 1:
+            raise BadRequest('Unsupported lookup "%s" on %s' % ('__'.join(path), model.__name__))
+        return field, value
+
+    def compile_lookup(self, model, key, value):
+        # Unknown fields are reported before any row is matched.
+        self.get_value(model, {}, split_lookup(key)[0].split('__'))
+        try:
+            return compile_lookup(key, value, lambda row, path: self.get_value(model, row, path))
+        except ROANotImplementedYetException as e:
+            raise BadRequest(str(e))
+
+    def compile_expression(self, model, node):
+        """
+        Compiles a JSON filter expression, see ``JSONFilterExpression``.
+        """
+        if not isinstance(node, dict) or len(node) != 1:
+            raise BadRequest('Invalid filter expression: %s' % node)
+        (key, value), = node.items()
+        if key in ('and', 'or'):
+            children = [self.compile_expression(model, child) for child in value]
+            combine = all if key == 'and' else any
+            return lambda row: combine(child(row) for child in children)
+        if key == 'not':
+            child = self.compile_expression(model, value)
+            return lambda row: not child(row)
+        return self.compile_lookup(model, key, value)
+
+
+fake_backend = FakeBackend()
+
+
+class FakeClient(object):
+    """
+    Requests-like client serving ROA requests from ``fake_backend``.
+    """
+
+    backend = fake_backend
+
+    def get(self, url, **kwargs):
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('post', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('put', url, data=data, **kwargs)
+
+    def patch(self, url, data=None, **kwargs):
+        return self.request('patch', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('delete', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        response = self.request('get', url, **kwargs)
+        response._content = b''
+        return response
+
+    def options(self, url, **kwargs):
+        return self.request('options', url, **kwargs)
+
+    def request(self, method, url, params=None, data=None, headers=None, **kwargs):
+        headers = CaseInsensitiveDict(headers or {})
+        if url == self.backend.batch_url and method == 'post':
+            batch = json.loads(self.decompress(data, headers.get('Content-Encoding')))
+            return self.response(url, 200, json.dumps(self.backend.handle_batch(batch)),
+                                 {'Content-Type': 'application/json'})
+        model, pk = self.backend.resolve(urlsplit(url)._replace(query='').geturl())
+        if data is not None and model is not None:
+            data = self.decode(model, data, headers.get('Content-Encoding'))
+        model, status, content = self.backend.handle(method, url, params=params, data=data,
+                                                     headers=headers)
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        response.headers = CaseInsensitiveDict()
+        if content is not None:
+            instance = model() if model is not None else None
+            if instance is not None:
+                response._content = instance.get_renderer().render(content)
+                response.headers.update(instance.get_serializer_content_type())
+            else:
+                response._content = str(content).encode('utf-8')
+        else:
+            response._content = b''
+        if isinstance(response._content, str):
+            response._content = response._content.encode('utf-8')
+        response.encoding = 'utf-8'
+        response._content_consumed = True
+        return response
+
+    def response(self, url, status, content, headers):
+        response = requests.Response()
+        response.status_code = status
+        response.url = url
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content.encode('utf-8')
+        response.encoding = 'utf-8'
+        response._content_consumed = True
+        return response
+
+    def decompress(self, data, content_encoding=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if content_encoding == 'gzip':
+            data = gzip.decompress(data)
+        elif content_encoding == 'deflate':
+            data = zlib.decompress(data)
+        return data
+
+    def decode(self, model, data, content_encoding=None):
+        data = model.get_parser().parse(BytesIO(self.decompress(data, content_encoding)))
+        return [dict(row) for row in data] if isinstance(data, list) else dict(data)
+
+
+class _AssertNumRemoteQueriesContext(object):
+
+    def __init__(self, test_case, num):
+        self.test_case = test_case
+        self.num = num
+
+    def __enter__(self):
+        self.recorder = record_remote_calls()
+        self.log = self.recorder.__enter__()
+        return self.log
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.recorder.__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self.log)
+        self.test_case.assertEqual(
+            executed, self.num,
+            "%d remote queries executed, %d expected\nCaptured calls were:\n%s" % (
+                executed, self.num,
+                '\n'.join('%d. %s (from %s)' % (i, logged.call, format_origin(logged.origin))
+                          for i, logged in enumerate(self.log, start=1))))
+
+
+class ROATestMixin(object):
+    """
+    Starts each test with an empty ``fake_backend``, serving ROA requests
+    through ``roa_client``, unless it is None.
+    """
+    roa_client = 'django_roa.test.FakeClient'
+
+    def _pre_setup(self):
+        super(ROATestMixin, self)._pre_setup()
+        self._roa_client_settings = None
+        if self.roa_client is not None:
+            self._roa_client_settings = override_settings(ROA_CLIENT=self.roa_client)
+            self._roa_client_settings.enable()
+        fake_backend.reset()
+
+    def _post_teardown(self):
+        try:
+            super(ROATestMixin, self)._post_teardown()
+        finally:
+            if self._roa_client_settings is not None:
+                self._roa_client_settings.disable()
+
+    def patch_attributes(self, obj, **attributes):
+        """
+        Sets ``attributes`` of ``obj``, e.g. the ``roa_capabilities`` of a
+        model or the ``batch_url`` of ``fake_backend``, until the end of the
+        test.
+        """
+        for name, value in attributes.items():
+            patcher = mock.patch.object(obj, name, value, create=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertNumRemoteQueries(self, num, func=None, *args, **kwargs):
+        """
+        Like ``assertNumQueries``, for remote calls made by ROA models.
+        """
+        context = _AssertNumRemoteQueriesContext(self, num)
+        if func is None:
+            return context
+        with context:
+            func(*args, **kwargs)
+
+
+class ROATestCase(ROATestMixin, SimpleTestCase):
+    """
+    Test case of ROA models starting each test with an empty
+    ``fake_backend``.
+    """
+
+
+class ROADatabaseTestCase(ROATestMixin, TestCase):
+    """
+    ``ROATestCase`` allowed to use the ``databases`` it declares, e.g. for
+    the replicas of mirrors, in a transaction rolled back after each test.
+    """
@@ -1,6 +1,7 @@
 from rest_framework import viewsets
 from django.db import models
 from functools import reduce
+import json
 import operator
 
 
@@ -11,6 +12,7 @@ class FilterByKeyMixin(object):
     search_param = 'search'
     order_param = 'order_by'
     filter_param_prefix = 'filter_'
+    filter_expression_param = 'filter'
 
     def construct_search(self, field_name):
         if field_name.startswith('^'):
@@ -30,6 +32,19 @@ class FilterByKeyMixin(object):
         params = request.QUERY_PARAMS.get(self.search_param, '')
         return params.replace(',', ' ').split()
 
+    def construct_q(self, node):
+        """
+        Builds a Q object from a JSON filter expression:
+        {"or": [{"headline__icontains": "django"}, {"not": {"id": 1}}]}
+        """
+        (key, value), = node.items()
+        if key in ('and', 'or'):
+            children = [self.construct_q(child) for child in value]
+            return reduce(operator.and_ if key == 'and' else operator.or_, children)
+        if key == 'not':
+            return ~self.construct_q(value)
+        return models.Q(**{key: value})
+
     def filter_queryset(self, queryset):
         """
         Parses QUERY_PARAMS and apply them
@@ -43,6 +58,11 @@ class FilterByKeyMixin(object):
                 if value_ is not None:
                     queryset = queryset.filter(**{'%s' % (key_): value_})
 
+            # filter expression ?
+            elif param == self.filter_expression_param:
+                value_ = self.request.QUERY_PARAMS[param]
+                queryset = queryset.filter(self.construct_q(json.loads(value_)))
+
             # order by ?
             elif param == self.order_param:
                 value_ = self.request.QUERY_PARAMS[param]
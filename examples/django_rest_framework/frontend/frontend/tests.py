@@ -1,10 +1,72 @@
+import gzip
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.client import HTTPMessage
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+import requests
+from requests.cookies import MockRequest, MockResponse
+from django.conf.urls import url
+from django.core.cache import caches
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import CommandError, call_command
+from django.core.signals import request_started
+from django.db import connection
+from django.db.models import Count, Max, Q
+from django.db.models.query import BaseIterable
+from django.http import JsonResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
 from django.utils.timezone import now
+from rest_framework import serializers
 from rest_framework.test import APITestCase
+from urllib3.response import HTTPResponse
+from django_roa.db import (auth, capabilities, compression, discovery, get_roa_context, get_roa_session,
+                           mapping, set_roa_context, wsgi)
+from django_roa.db.auth import DelegatedTokenAuthProvider, Token, TokenAuthProvider
+from django_roa.db.batch import roa_batch
+from django_roa.db.capabilities import get_capabilities
 from django_roa.db.exceptions import ROAException
+from django_roa.db.gather import gather
+from django_roa.db.instrumentation import PHASES, remote_call_finished
+from django_roa.db.lookups import delete_cached_value, get_cached_value, is_cached, set_cached_value
+from django_roa.db.mapping import decode_keys, encode_payload
+from django_roa.db.mirror import get_mirror
+from django_roa.db.query import RemoteQuerySet
+from django_roa.db.querylog import record_remote_calls
+from django_roa.db.transport import parse_response, send_request
+from django_roa.test import FakeClient, ROADatabaseTestCase, ROATestCase, fake_backend
 from .models import Account, Article, Tag, Reporter
 
 
-class ROATestCase(APITestCase):
+class FlatReporterSerializer(serializers.ModelSerializer):
+    account_id = serializers.IntegerField()
+
+    class Meta:
+        model = Reporter
+        fields = ('id', 'account_id', 'first_name', 'last_name')
+
+
+class CountingAuthProvider(TokenAuthProvider):
+    background_refresh = False
+
+    def __init__(self, **kwargs):
+        super(CountingAuthProvider, self).__init__(**kwargs)
+        self.fetched = 0
+
+    def fetch_token(self, key):
+        self.fetched += 1
+        return Token('%s-%s' % (key, self.fetched), time.time() + 3600)
+
+
+class LiveBackendTest(APITestCase):
 
     def test_all(self):
 
@@ -159,3 +221,715 @@ class ROATestCase(APITestCase):
             pass
 
         self.assertEqual(tags.count(), 0)
+
+    def test_query_log(self):
+        with record_remote_calls() as log:
+            Account.objects.get(id=1)
+            Account.objects.get(id=2)
+            Account.objects.get(id=1)
+
+        self.assertEqual(len(log), 3)
+        call = log.calls[0].call
+        self.assertEqual(call.method, 'GET')
+        self.assertEqual(call.url_template, 'http://127.0.0.1:8000/accounts/{pk}/')
+        self.assertEqual(call.status, 200)
+        self.assertTrue(log.calls[0].origin[0][0].endswith('tests.py'))
+
+        patterns = log.n_plus_one(threshold=3)
+        self.assertEqual(len(patterns), 1)
+        self.assertEqual(patterns[0].model, Account)
+        self.assertEqual(patterns[0].count, 3)
+        self.assertEqual(log.n_plus_one(threshold=4), [])
+
+
+class FakeBackendTest(ROATestCase):
+
+    def setUp(self):
+        fake_backend.load(Account, [
+            {'id': 1, 'email': 'john@example.com'},
+            {'id': 2, 'email': 'paul@example.com'},
+        ])
+
+    def test_queries(self):
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(Account.objects.get(id=2).email, 'paul@example.com')
+        with self.assertNumRemoteQueries(1):
+            accounts = list(Account.objects.exclude(id=1).order_by('-email'))
+        self.assertEqual([account.id for account in accounts], [2])
+        self.assertEqual(Account.objects.filter(email__startswith='john').count(), 1)
+
+        account = Account(email='george@example.com')
+        self.assertNumRemoteQueries(1, account.save)
+        self.assertEqual(account.id, 3)
+        self.assertEqual(len(fake_backend.rows(Account)), 3)
+        account.delete()
+        self.assertEqual(Account.objects.count(), 2)
+
+    def test_parameters(self):
+        query = Account.objects.filter(email='john@example.com', id__in=[1, 2]).order_by('id').query
+        same = Account.objects.filter(id__in=[1, 2]).filter(email='john@example.com').order_by('id').query
+        self.assertEqual(query.parameter_items, same.parameter_items)
+        self.assertEqual(query.parameters_hash, same.parameters_hash)
+        self.assertIs(query.parameter_items, query.parameter_items)
+        self.assertEqual([name for name, value in query.parameter_items],
+                         ['filter_email', 'filter_id__in', 'format', 'order_by'])
+        query.set_limits(0, 1)
+        self.assertNotEqual(query.parameters_hash, same.parameters_hash)
+
+    def test_filter_expression(self):
+        self.patch_attributes(Account, roa_filter_expression='json')
+        accounts = Account.objects.filter(Q(email__startswith='paul') | Q(id=1)).exclude(Q(id=2))
+        self.assertEqual(accounts.query.parameters['filter'],
+                         '{"and":[{"or":[{"email__startswith":"paul"},{"id":1}]},{"not":{"id":2}}]}')
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual([account.id for account in accounts], [1])
+        # Empty Q objects filter nothing
+        accounts = Account.objects.filter(Q()).exclude(Q())
+        self.assertEqual(accounts.query.parameters, {'format': 'json'})
+        self.assertEqual([account.id for account in accounts], [1, 2])
+
+    def test_query_plan(self):
+        fake_backend.load(Account, [{'id': 3, 'email': 'george@example.com'}])
+        self.patch_attributes(Account, roa_capabilities={
+            'filters': {'id': ['exact', 'in']}, 'ordering': ['id']})
+        accounts = Account.objects.filter(id__in=[1, 2, 3], email__lt='p').order_by('-email')[:2]
+        # Only the supported filter is sent, slicing waits for local evaluation
+        self.assertEqual(accounts.query.parameters, {'filter_id__in': (1, 2, 3), 'format': 'json'})
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual([account.id for account in accounts], [1, 3])
+        accounts = Account.objects.filter(Q(email__startswith='paul') | Q(id=3))
+        self.assertEqual(accounts.query.parameters, {'format': 'json'})
+        self.assertEqual(accounts.count(), 2)
+
+    def test_count(self):
+        self.patch_attributes(Account, roa_capabilities={
+            'ordering': ['id'], 'count': 'paginated', 'page_size_parameter': 'page_size'})
+        # Counted by the server whatever the ordering
+        with record_remote_calls() as log:
+            self.assertEqual(Account.objects.order_by('-email').count(), 2)
+            self.assertEqual(Account.objects.order_by('-email')[1:5].count(), 1)
+        self.assertEqual([entry.call.parameters for entry in log.calls], [
+            {'format': 'json', 'page_size': 1},
+            {'format': 'json', 'page_size': 1, 'limit_start': 1, 'limit_stop': 5}])
+        # Slices evaluated locally from the count of the whole query
+        self.patch_attributes(Account, roa_capabilities={'slicing': False})
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(Account.objects.order_by('-email')[1:5].count(), 1)
+
+    def test_related_predicates(self):
+        fake_backend.load(Reporter, [
+            {'id': 1, 'account_id': 1, 'first_name': 'John', 'last_name': 'Lennon'},
+            {'id': 2, 'account_id': 2, 'first_name': 'Paul', 'last_name': 'McCartney'},
+            {'id': 3, 'account_id': 1, 'first_name': 'Johnny', 'last_name': 'Silver'},
+        ])
+        self.patch_attributes(Reporter, serializer=classmethod(lambda cls: FlatReporterSerializer),
+                              roa_capabilities={'filters': {'id': ['exact']}, 'ordering': ['id']})
+        # Accounts are fetched at once, not by reporter
+        with self.assertNumRemoteQueries(2):
+            reporters = Reporter.objects.filter(account__email__startswith='john').order_by('-account__email', '-id')
+            self.assertEqual([reporter.id for reporter in reporters], [3, 1])
+        with self.assertNumRemoteQueries(2):
+            self.assertEqual(list(Reporter.objects.order_by('id').values('account__email')), [
+                {'account__email': 'john@example.com'}, {'account__email': 'paul@example.com'},
+                {'account__email': 'john@example.com'}])
+        # Before Django 2.0, related instances are cached by the descriptor
+        field = SimpleNamespace(get_cache_name=lambda: '_account_cache')
+        reporter, account = Reporter(id=1, account_id=1), Account(id=1)
+        self.assertFalse(is_cached(field, reporter))
+        set_cached_value(field, reporter, account)
+        self.assertIs(reporter._account_cache, account)
+        self.assertTrue(is_cached(field, reporter))
+        self.assertIs(get_cached_value(field, reporter), account)
+        delete_cached_value(field, reporter)
+        self.assertFalse(is_cached(field, reporter))
+
+    def test_single_row(self):
+        accounts = Account.objects.filter(id__gte=1)
+        with self.assertNumRemoteQueries(4):
+            self.assertTrue(accounts.exists())
+            self.assertEqual(accounts.first().id, 1)
+            self.assertEqual(accounts.last().id, 2)
+            self.assertEqual(accounts.latest('email').id, 2)
+        # The original query is left untouched
+        self.assertEqual(accounts.query.parameters, {'filter_id__gte': 1, 'format': 'json'})
+        self.assertFalse(Account.objects.filter(id=3).exists())
+        self.assertRaises(Account.DoesNotExist, Account.objects.filter(id=3).earliest, 'email')
+
+    def test_aggregate(self):
+        # Computed while streaming the list without an aggregation endpoint
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(Account.objects.aggregate(Max('id'), n=Count('*')), {'id__max': 2, 'n': 2})
+        self.patch_attributes(Account, roa_capabilities={'aggregates': ['count', 'max']})
+        accounts = Account.objects.filter(id__gt=1).values('email').annotate(n=Count('id'))
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(list(accounts), [{'email': 'paul@example.com', 'n': 1}])
+
+    def test_pagination(self):
+        self.patch_attributes(Account, roa_page_size=1)
+        # By keyset conditions, up to an incomplete page
+        with self.assertNumRemoteQueries(3):
+            self.assertEqual([account.id for account in Account.objects.order_by('id')], [1, 2])
+        # By next links
+        self.patch_attributes(Account, roa_capabilities={'pagination': 'page'})
+        with self.assertNumRemoteQueries(2):
+            self.assertEqual([account.id for account in Account.objects.order_by('-id')], [2, 1])
+
+    def test_iterator(self):
+        with record_remote_calls() as log:
+            accounts = list(Account.objects.order_by('-id').iterator(chunk_size=1))
+        self.assertEqual([account.id for account in accounts], [2, 1])
+        self.assertEqual([entry.call.parameters for entry in log.calls], [
+            {'format': 'json', 'order_by': '-id', 'limit_stop': 1},
+            {'format': 'json', 'order_by': '-id', 'limit_stop': 1, 'filter_id__lt': 2},
+            {'format': 'json', 'order_by': '-id', 'limit_stop': 1, 'filter_id__lt': 1},
+        ])
+        # BaseIterable takes no chunk_size before Django 2.0
+        with mock.patch.object(BaseIterable, '__init__', lambda self, queryset: None):
+            self.assertEqual([account.id for account in Account.objects.order_by('id').iterator()], [1, 2])
+
+    def test_parallel_scan(self):
+        # Bounds of the primary key, then a range per partition
+        with self.assertNumRemoteQueries(4):
+            accounts = list(Account.objects.parallel_scan(workers=2, partitions=2, ordered=True))
+        self.assertEqual([account.id for account in accounts], [1, 2])
+        with self.assertNumRemoteQueries(3):
+            accounts = Account.objects.filter(email__startswith='paul').parallel_scan(workers=2)
+            self.assertEqual([account.id for account in accounts], [2])
+
+    def test_batch(self):
+        john, paul = Account.objects.order_by('id')
+        self.patch_attributes(fake_backend, batch_url='http://127.0.0.1:8000/api/batch/')
+        with self.assertNumRemoteQueries(1):
+            with roa_batch(url=fake_backend.batch_url):
+                george = Account(email='george@example.com')
+                george.save()
+                john.delete()
+                self.assertIsNone(george.id)
+        self.assertEqual(george.id, 3)
+        self.assertIsNone(john.pk)
+        # Concurrent requests without batch endpoint
+        with self.assertNumRemoteQueries(2):
+            with roa_batch():
+                paul.email = 'ringo@example.com'
+                paul.save()
+                george.delete()
+        self.assertEqual(fake_backend.rows(Account), [{'id': 2, 'email': 'ringo@example.com'}])
+
+    def test_batch_failure(self):
+        john, paul = Account.objects.order_by('id')
+        ghost = Account(id=99, email='ghost@example.com')
+        with self.assertRaises(ROAException) as context:
+            with roa_batch():
+                paul.email = 'ringo@example.com'
+                paul.save()
+                ghost.save()
+                paul.delete()
+        error = context.exception
+        self.assertEqual([(operation.instance, operation.delete) for operation in error.applied], [(paul, False)])
+        self.assertEqual([(operation.instance, operation.delete) for operation in error.failed], [(ghost, False)])
+        self.assertEqual([(operation.instance, operation.delete) for operation in error.unsent], [(paul, True)])
+        self.assertEqual(fake_backend.rows(Account)[1], {'id': 2, 'email': 'ringo@example.com'})
+        # Answers without status are malformed, not successes
+        self.patch_attributes(fake_backend, batch_url='http://127.0.0.1:8000/api/batch/',
+                              handle_batch=lambda requests: [{'body': None} for request in requests])
+        with self.assertRaisesMessage(ROAException, 'Malformed batch response to DELETE'):
+            with roa_batch(url=fake_backend.batch_url):
+                john.delete()
+        self.assertEqual(john.pk, 1)
+
+    def test_bulk_creation(self):
+        self.patch_attributes(Account, roa_capabilities={'bulk': True})
+        with self.assertNumRemoteQueries(1):
+            with roa_batch():
+                george, ringo = Account(email='george@example.com'), Account(email='ringo@example.com')
+                george.save()
+                ringo.save()
+        self.assertEqual((george.id, ringo.id), (3, 4))
+
+    def test_sparse_fields(self):
+        self.patch_attributes(Account, roa_capabilities={'sparse_fields': 'fields'})
+        emails = Account.objects.filter(id__gt=1).values('email')
+        self.assertEqual(emails.query.parameters, {'filter_id__gt': 1, 'fields': 'email', 'format': 'json'})
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(list(emails), [{'email': 'paul@example.com'}])
+        self.assertNotIn('fields', Account.objects.all().query.parameters)
+
+    def test_gather(self):
+        reads = (Account.objects.order_by('-id'), Account.objects.get_lazy(id=1),
+                 Account.objects.get_lazy(email='paul@example.com'))
+        with self.assertNumRemoteQueries(3):
+            accounts, john, paul = gather(*reads)
+        with self.assertNumRemoteQueries(0):
+            self.assertEqual([account.id for account in accounts], [2, 1])
+        # The querysets given are not evaluated
+        self.assertIsNot(accounts, reads[0])
+        self.assertIsNone(reads[0]._result_cache)
+        self.assertEqual((john.email, paul.id), ('john@example.com', 2))
+        # One request to the batch endpoint
+        self.patch_attributes(fake_backend, batch_url='http://127.0.0.1:8000/api/batch/')
+        with self.assertNumRemoteQueries(1):
+            accounts, john, paul = gather(*reads, url=fake_backend.batch_url)
+        self.assertEqual((len(accounts), john.id, paul.email), (2, 1, 'paul@example.com'))
+        self.assertRaises(Account.DoesNotExist, gather, Account.objects.get_lazy(email='ringo@example.com'))
+
+    def test_gather_concurrency(self):
+        barrier = threading.Barrier(2, timeout=5)
+        get = FakeClient.get
+
+        def get_together(client, url, **kwargs):
+            # Breaks unless both lists are requested before either is answered
+            barrier.wait()
+            return get(client, url, **kwargs)
+
+        self.patch_attributes(FakeClient, get=get_together)
+        with self.assertNumRemoteQueries(2):
+            johns, others = gather(Account.objects.filter(id=1), Account.objects.exclude(id=1))
+        self.assertEqual(([account.id for account in johns], [account.id for account in others]),
+                         ([1], [2]))
+
+    def test_mirror(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_attributes(Account, roa_mirror={'updated_field': 'id', 'since_lookup': 'gt', 'max_age': 60,
+                                                   'path': os.path.join(directory, 'accounts.sqlite3')})
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(get_mirror(Account).sync(), 2)
+        # Served by the mirror, from the rows validated by the sync
+        with self.assertNumRemoteQueries(0), mock.patch.object(Account, 'get_serializer',
+                                                               side_effect=AssertionError):
+            self.assertEqual([account.id for account in Account.objects.order_by('-email')], [2, 1])
+            self.assertEqual(Account.objects.get(id=1).email, 'john@example.com')
+            self.assertEqual(Account.objects.filter(email__startswith='paul').count(), 1)
+            accounts = Account.objects.filter(Q(id=1) | Q(email='paul@example.com')).exclude(id__gt=1)
+            self.assertEqual([account.id for account in accounts], [1])
+            self.assertEqual(Account.objects.order_by('-id')[1:].count(), 1)
+        # Evaluated by SQLite but the lookups it lacks
+        plan = Account.objects.filter(id__in=[1, 2], email__contains='o').order_by('-email')[:1].query.plan
+        self.assertEqual((plan.filters, plan.order_by, plan.limit_stop), ({'id__in': [1, 2]}, ['-email'], None))
+        self.assertEqual((len(plan.predicates), plan.local_limits), (1, (0, 1)))
+        fake_backend.load(Account, [{'id': 3, 'email': 'george@example.com'}])
+        with record_remote_calls() as log:
+            self.assertEqual(get_mirror(Account).sync(), 1)
+        self.assertEqual(log.calls[0].call.parameters, {'format': 'json', 'filter_id__gt': 2})
+        with self.assertNumRemoteQueries(0):
+            self.assertEqual(Account.objects.count(), 3)
+
+
+class AuthTest(ROATestCase):
+
+    def setUp(self):
+        caches[auth.ROA_AUTH_CACHE].clear()
+        self.addCleanup(caches[auth.ROA_AUTH_CACHE].clear)
+
+    def test_refresh(self):
+        provider = CountingAuthProvider()
+        self.assertEqual(provider.get_headers(), {'Authorization': 'Bearer shared-1'})
+        # Shared with the other workers
+        self.assertEqual(CountingAuthProvider().get_headers(), {'Authorization': 'Bearer shared-1'})
+        self.assertTrue(provider.refresh({'Authorization': 'Bearer shared-1'}))
+        self.assertEqual(provider.get_headers(), {'Authorization': 'Bearer shared-2'})
+        # Already replaced by another thread
+        self.assertTrue(provider.refresh({'Authorization': 'Bearer shared-1'}))
+        self.assertEqual(provider.fetched, 2)
+
+    def test_retry(self):
+        self.patch_attributes(auth, ROA_AUTH_PROVIDER='frontend.tests.CountingAuthProvider',
+                              _provider=CountingAuthProvider())
+        rejected, accepted = mock.Mock(status_code=401), mock.Mock(status_code=200)
+        responses, sent = [rejected, accepted], []
+
+        def get(url, headers, **kwargs):
+            sent.append(headers['Authorization'])
+            return responses.pop(0)
+        client = mock.Mock(**{'get.side_effect': get})
+        self.assertIs(send_request(client, 'get', 'http://127.0.0.1:8000/accounts/'), accepted)
+        self.assertEqual(sent, ['Bearer shared-1', 'Bearer shared-2'])
+        rejected.close.assert_called_once_with()
+
+    def test_lock(self):
+        provider = CountingAuthProvider(lock_timeout=5)
+        cache = caches[auth.ROA_AUTH_CACHE]
+        # Another worker fetches the shared token
+        cache.add('%s:lock' % provider._cache_key('shared'), 1)
+        tokens = []
+        waiter = threading.Thread(target=lambda: tokens.append(provider.get_token('shared')))
+        waiter.start()
+        # Waiting for it blocks no other token
+        self.assertEqual(provider.get_token('other').value, 'other-1')
+        cache.set(provider._cache_key('shared'), tuple(Token('theirs', time.time() + 3600)))
+        waiter.join(5)
+        self.assertEqual(tokens[0].value, 'theirs')
+        self.assertEqual(provider.fetched, 1)
+
+    def test_max_tokens(self):
+        provider = CountingAuthProvider(max_tokens=2)
+        for key in ('a', 'b', 'c'):
+            provider.get_token(key)
+        self.assertEqual(list(provider._tokens), ['b', 'c'])
+
+    def test_delegated_tokens(self):
+        provider = DelegatedTokenAuthProvider(lambda user: ('token-%s' % user.pk, 60))
+        request = RequestFactory().get('/')
+        request.user = mock.Mock(pk=7, is_authenticated=True)
+        self.addCleanup(set_roa_context, get_roa_context())
+        set_roa_context((None, request))
+        self.assertEqual(provider.get_headers(), {'Authorization': 'Bearer token-7'})
+        # Kept in the process, under a key that does not name the user
+        self.assertNotIn('user:7', provider._cache_key('user:7'))
+        self.assertIsNone(caches[auth.ROA_AUTH_CACHE].get(provider._cache_key('user:7')))
+
+
+class InstrumentationTest(ROATestCase):
+
+    def setUp(self):
+        fake_backend.load(Account, [{'id': 1, 'email': 'john@example.com'}])
+        self.calls = []
+
+        def record(sender, call, **kwargs):
+            self.calls.append((sender, call))
+
+        remote_call_finished.connect(record)
+        self.addCleanup(remote_call_finished.disconnect, record)
+
+    def test_read(self):
+        self.assertEqual([account.id for account in Account.objects.all()], [1])
+        self.assertEqual(len(self.calls), 1)
+        sender, call = self.calls[0]
+        self.assertEqual((sender, call.method, call.status, call.exception), (Account, 'GET', 200, None))
+        self.assertTrue(all(call.timings[name] > 0 for name in PHASES), call.timings)
+        self.assertGreater(call.response_bytes, 0)
+        self.assertGreaterEqual(call.duration, sum(call.timings.values()))
+
+    def test_errors(self):
+        # Network errors
+        self.patch_attributes(FakeClient, get=mock.Mock(side_effect=requests.ConnectionError('refused')))
+        with self.assertRaises(ROAException):
+            list(Account.objects.all())
+        self.assertEqual(len(self.calls), 1)
+        sender, call = self.calls[0]
+        self.assertIsInstance(call.exception, requests.ConnectionError)
+        self.assertGreater(call.timings['network'], 0)
+        self.assertIsNotNone(call.duration)
+        # Malformed responses
+        response = requests.Response()
+        response.status_code, response._content = 200, b'{'
+        self.patch_attributes(FakeClient, get=mock.Mock(return_value=response))
+        with self.assertRaises(Exception):
+            list(Account.objects.all())
+        self.assertEqual(len(self.calls), 2)
+        sender, call = self.calls[1]
+        self.assertIsNotNone(call.exception)
+        self.assertTrue(call.timings['network'] > 0 and call.timings['parse'] > 0, call.timings)
+
+    def test_save_errors(self):
+        self.patch_attributes(FakeClient, put=mock.Mock(side_effect=requests.ConnectionError('refused')))
+        account = Account(id=1, email='paul@example.com')
+        with self.assertRaises(requests.ConnectionError):
+            account.save()
+        self.assertEqual(len(self.calls), 1)
+        sender, call = self.calls[0]
+        self.assertEqual((sender, call.method), (Account, 'PUT'))
+        self.assertIsInstance(call.exception, requests.ConnectionError)
+        self.assertIsNotNone(call.duration)
+
+
+class MappingTest(ROATestCase):
+
+    def setUp(self):
+        self.patch_attributes(mapping, _compiled={}, _nested={},
+                              ROA_FIELD_NAME_MAPPING=[('email', 'mail')],
+                              ROA_MODEL_FIELD_MAPPING={'frontend.reporter': {'first_name': 'firstName'}},
+                              ROA_MODEL_NAME_MAPPING=[('frontend.', 'backend.')])
+
+    def test_round_trip(self):
+        local = {'id': 1, 'headline': 'Hello', 'pub_date': '2014-01-01', 'reporter': {
+            'id': 2, 'first_name': 'John', 'last_name': 'Doe',
+            'account': {'id': 3, 'email': 'john@example.com'}}}
+        remote = {'id': 1, 'headline': 'Hello', 'pub_date': '2014-01-01', 'reporter': {
+            'id': 2, 'firstName': 'John', 'last_name': 'Doe',
+            'account': {'id': 3, 'mail': 'john@example.com'}}}
+        self.assertEqual(encode_payload(Article, local, created=True), remote)
+        self.assertEqual(decode_keys(Article, remote), local)
+        self.assertEqual(decode_keys(Article, [remote]), [local])
+        self.assertEqual(decode_keys(Article, {'count': 1, 'results': [remote]})['results'], [local])
+        # Foreign keys as primary keys
+        local = {'id': 2, 'first_name': 'John', 'account': 3}
+        remote = {'id': 2, 'firstName': 'John', 'account': 3}
+        self.assertEqual(encode_payload(Reporter, local, created=False), remote)
+        self.assertEqual(decode_keys(Reporter, remote), local)
+
+    def test_model_names(self):
+        # Only model labels are renamed, not free text
+        self.assertEqual(decode_keys(Tag, [{'id': 1, 'label': 'backend.article', 'model': 'backend.tag'}]),
+                         [{'id': 1, 'label': 'backend.article', 'model': 'frontend.tag'}])
+        self.assertEqual(decode_keys(Tag, {'model': 'see backend.tag'}), {'model': 'see backend.tag'})
+        fake_backend.load(Account, [{'id': 1, 'mail': 'backend.john@example.com'}])
+        account = Account.objects.get(id=1)
+        self.assertEqual(account.email, 'backend.john@example.com')
+        account.save()
+        self.assertEqual(fake_backend.rows(Account), [{'id': 1, 'mail': 'backend.john@example.com'}])
+
+    def test_remote_rows(self):
+        fake_backend.load(Account, [{'id': 1, 'mail': 'john@example.com'}])
+        account = Account.objects.get(id=1)
+        self.assertEqual(account.email, 'john@example.com')
+        account.email = 'paul@example.com'
+        account.save()
+        self.assertEqual(fake_backend.rows(Account), [{'id': 1, 'mail': 'paul@example.com'}])
+
+
+class CompressionTest(ROATestCase):
+
+    def test_accept_encoding(self):
+        # Codings are advertised only if urllib3 decodes them
+        self.patch_attributes(HTTPResponse, CONTENT_DECODERS=['gzip', 'x-gzip', 'deflate'])
+        self.assertEqual(compression.get_accept_encoding(), 'gzip, deflate')
+        self.patch_attributes(HTTPResponse, CONTENT_DECODERS=['gzip', 'x-gzip', 'deflate', 'br', 'zstd'])
+        self.assertEqual(compression.get_accept_encoding(), 'br, zstd, gzip, deflate')
+        self.patch_attributes(compression, ROA_ACCEPT_ENCODING='identity')
+        self.assertEqual(compression.get_accept_encoding(), 'identity')
+
+    def test_request_compression(self):
+        self.patch_attributes(compression, ROA_REQUEST_COMPRESSION_MIN_SIZE=100)
+        url = Account.get_resource_url_list()
+        self.assertEqual(compression.compress_payload(Account, url, 'x' * 200), (b'x' * 200, None))
+        self.patch_attributes(Account, roa_request_encoding='gzip')
+        self.assertEqual(compression.compress_payload(Account, url, 'x' * 99), (b'x' * 99, None))
+        payload, encoding = compression.compress_payload(Account, url, 'x' * 100)
+        self.assertEqual((gzip.decompress(payload), encoding), (b'x' * 100, 'gzip'))
+        self.patch_attributes(Account, roa_request_encoding='lzma')
+        with self.assertRaisesMessage(ValueError, 'Unsupported request encoding "lzma"'):
+            compression.compress_payload(Account, url, 'x' * 100)
+        # Compressed bodies are decoded by the server
+        self.patch_attributes(Account, roa_request_encoding='deflate')
+        self.patch_attributes(compression, ROA_REQUEST_COMPRESSION_MIN_SIZE=10)
+        account = Account(email='john@example.com')
+        account.save()
+        self.assertEqual(fake_backend.get_collection(Account)[str(account.pk)]['email'], account.email)
+
+    def test_parse_response(self):
+        response = mock.Mock(raw=None, content=b'{"id": 1}')
+        self.assertEqual(parse_response(Account.get_parser(), response), {'id': 1})
+        response.close.assert_called_once_with()
+        # Responses are closed when parsing fails
+        response = mock.Mock(raw=None, content=b'{')
+        with self.assertRaises(Exception):
+            parse_response(Account.get_parser(), response)
+        response.close.assert_called_once_with()
+
+
+class DiscoveryTest(ROATestCase):
+
+    def setUp(self):
+        self.patch_attributes(discovery, ROA_DISCOVERY='options', _discovered={}, _documents={}, _failures={})
+        self.patch_attributes(capabilities, _capabilities={})
+        caches[discovery.ROA_DISCOVERY_CACHE].clear()
+        self.addCleanup(caches[discovery.ROA_DISCOVERY_CACHE].clear)
+
+    def test_options(self):
+        fake_backend.capabilities[Account] = {'ordering': ['id'], 'bulk': True, 'unknown': 1}
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(discovery.discover(Account), {'ordering': ['id'], 'bulk': True})
+            self.assertTrue(get_capabilities(Account).bulk)
+        self.assertFalse(get_capabilities(Account).supports_ordering('email'))
+
+    def test_openapi(self):
+        document = {'paths': {
+            '/api/accounts/': {
+                'get': {'parameters': [{'in': 'query', 'name': name} for name in (
+                    'filter_id', 'filter_email__startswith', 'order_by', 'page', 'page_size', 'fields')]},
+                'post': {'requestBody': {'content': {'application/json': {'schema': {
+                    'oneOf': [{'type': 'object'}, {'type': 'array'}]}}}}},
+            },
+            '/api/accounts/count/': {},
+        }}
+        parsed = discovery.parse_openapi(document, 'http://127.0.0.1:8000/api/accounts/')
+        self.assertEqual(parsed['filters'], {'id': ['exact'], 'email': ['startswith']})
+        self.assertEqual((parsed['ordering'], parsed['slicing'], parsed['search']), ('__all__', False, False))
+        self.assertEqual((parsed['pagination'], parsed['page_size_parameter']), ('page', 'page_size'))
+        self.assertEqual((parsed['count'], parsed['sparse_fields'], parsed['bulk']), ('endpoint', 'fields', True))
+        self.assertEqual(discovery.parse_openapi(document, 'http://127.0.0.1:8000/api/tags/'), {})
+
+    def test_fallback(self):
+        self.patch_attributes(Account, get_resource_url_list=staticmethod(
+            lambda: 'http://127.0.0.1:8000/api/unknown/'))
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(discovery.discover(Account), {})
+            # Declared capabilities alone until the retry delay elapsed
+            self.assertEqual(discovery.discover(Account), {})
+            self.assertEqual(get_capabilities(Account).ordering, '__all__')
+        self.patch_attributes(discovery, ROA_DISCOVERY_RETRY=0)
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(discovery.discover(Account), {})
+
+
+class ReplicaTest(ROADatabaseTestCase):
+    databases = {'default'}
+
+    def setUp(self):
+        fake_backend.load(Account, [
+            {'id': 1, 'email': 'john@example.com'},
+            {'id': 2, 'email': 'paul@example.com'},
+        ])
+        self.patch_attributes(Account, roa_mirror={'updated_field': 'id', 'since_lookup': 'gt', 'max_age': 60,
+                                                   'database': 'default'})
+
+    def sync(self):
+        call_command('roa_sync', 'frontend.account', '--create-tables', stdout=StringIO())
+
+    def test_create_tables(self):
+        with self.assertRaisesMessage(ROAException, 'roa_sync --create-tables'):
+            get_mirror(Account).sync()
+        out = StringIO()
+        call_command('roa_sync', 'frontend.account', '--create-tables', stdout=out)
+        self.assertEqual(out.getvalue(), 'frontend.Account: 2 row(s)\n')
+        self.assertTrue(get_mirror(Account).exists())
+
+    def test_reads(self):
+        self.sync()
+        # The manager returns remote querysets, served by the table
+        with self.assertNumRemoteQueries(0):
+            accounts = Account.objects.filter(Q(id=1) | Q(email__startswith='paul'))
+            self.assertIsInstance(accounts, RemoteQuerySet)
+            self.assertEqual(accounts.aggregate(n=Count('id'))['n'], 2)
+            self.assertEqual(Account.objects.get(email='john@example.com').id, 1)
+            accounts = Account.objects.exclude(id=1).order_by('-email')
+            self.assertEqual([account.id for account in accounts], [2])
+            self.assertEqual(Account.objects.filter(email__contains='o')[1:].count(), 1)
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(Account.objects.remote().count(), 2)
+        # Django querysets of the table are asked for
+        with self.assertNumRemoteQueries(0), self.assertNumQueries(1):
+            accounts = Account.objects.replica().filter(email__endswith='example.com')
+            self.assertNotIsInstance(accounts, RemoteQuerySet)
+            self.assertEqual(list(accounts.values_list('id', flat=True).order_by('id')), [1, 2])
+        with self.assertNumRemoteQueries(1):
+            self.assertEqual(Account.objects.replica(max_staleness=0).count(), 2)
+        with self.assertRaisesMessage(ROAException, 'frontend.Tag has no replica'):
+            Tag.objects.replica()
+
+    def test_write_through(self):
+        self.sync()
+        account = Account.objects.get(id=2)
+        account.email = 'ringo@example.com'
+        with self.assertNumRemoteQueries(1):
+            account.save()
+        with self.assertNumRemoteQueries(1):
+            Account.objects.filter(id=1).delete()
+        with self.assertNumRemoteQueries(0):
+            self.assertEqual(list(Account.objects.replica().values_list('email', flat=True)),
+                             ['ringo@example.com'])
+
+
+class WarmupTest(ROATestCase):
+
+    def test_session(self):
+        session = get_roa_session()
+        self.assertIs(get_roa_session(), session)
+        # The session is shared by every user, cookies are not kept
+        headers = HTTPMessage()
+        headers['Set-Cookie'] = 'sessionid=john; Path=/'
+        request = requests.Request('GET', 'http://127.0.0.1:8000/accounts/').prepare()
+        session.cookies.extract_cookies(MockResponse(headers), MockRequest(request))
+        self.assertEqual(len(session.cookies), 0)
+
+    def test_roa_warmup(self):
+        fake_backend.load(Account, [{'id': 1, 'email': 'john@example.com'}])
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.patch_attributes(Account, roa_mirror={'updated_field': 'id', 'since_lookup': 'gt', 'max_age': 60,
+                                                   'path': os.path.join(directory, 'accounts.sqlite3')})
+        out = StringIO()
+        with self.assertNumRemoteQueries(1):
+            call_command('roa_warmup', 'frontend.account', stdout=out)
+        self.assertEqual([line.rsplit(':', 1)[0] for line in out.getvalue().splitlines()],
+                         ['http://127.0.0.1:8000', 'frontend.account'])
+        self.assertEqual(get_mirror(Account).get(1).email, 'john@example.com')
+        with self.assertNumRemoteQueries(0):
+            self.assertEqual(Account.objects.get(id=1).email, 'john@example.com')
+        # Models without mirror have nothing to load
+        err = StringIO()
+        with self.assertRaisesMessage(CommandError, '1 warmup step(s) failed.'):
+            call_command('roa_warmup', 'frontend.tag', '--fail-on-error', stdout=out, stderr=err)
+        self.assertIn('frontend.Tag has no mirror', err.getvalue())
+
+    def test_inspectresources(self):
+        out = StringIO()
+        call_command('inspectresources', stdout=out)
+        self.assertIn('Account (http://127.0.0.1:8000/accounts/)\n  id (IntegerField)\n  email (CharField)\n',
+                      out.getvalue())
+
+
+def account_view(request, pk):
+    return JsonResponse({'id': int(pk), 'email': 'john@example.com'})
+
+
+# Served in-process by WSGITest
+urlpatterns = [
+    url(r'^accounts/(?P<pk>\d+)/$', account_view),
+]
+
+
+# Sets Django up without ROA models, then imports django_roa.db.models and
+# prints the modules it imported and those its modules asked for.
+IMPORT_CHILD = """
+import builtins, json, sys
+import django
+from django.conf import settings
+settings.configure(INSTALLED_APPS=['django.contrib.contenttypes', 'django.contrib.auth'],
+                   ROA_MODELS=True, ROA_FORMAT='json')
+django.setup()
+modules, requested = set(sys.modules), set()
+import_module = builtins.__import__
+
+def record(name, globals=None, *args, **kwargs):
+    if (globals or {}).get('__name__', '').startswith('django_roa'):
+        requested.add(name)
+    return import_module(name, globals, *args, **kwargs)
+
+builtins.__import__ = record
+import django_roa.db.models
+sys.stdout.write(json.dumps(sorted((set(sys.modules) - modules) | requested)))
+"""
+
+
+class ImportTest(SimpleTestCase):
+
+    def test_lazy_imports(self):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        env.pop('DJANGO_SETTINGS_MODULE', None)
+        output = subprocess.run([sys.executable, '-c', IMPORT_CHILD], stdout=subprocess.PIPE, env=env,
+                                universal_newlines=True, check=True).stdout
+        imported = set(json.loads(output))
+        self.assertIn('django_roa.db.query', imported)
+        for name in ('rest_framework_xml', 'rest_framework_yaml', 'defusedxml', 'yaml', 'concurrent.futures'):
+            self.assertFalse(any(module == name or module.startswith(name + '.') for module in imported), name)
+
+
+@override_settings(ROA_CLIENT='django_roa.db.wsgi.WSGIClient', ROOT_URLCONF=__name__,
+                   MIDDLEWARE=['django.contrib.sessions.middleware.SessionMiddleware',
+                               'django_roa.db.middleware.ROAMiddleware'])
+class WSGITest(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(wsgi._applications, {'127.0.0.1:8000': WSGIHandler()})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_nested_request(self):
+        context = ({'Authorization': 'Token john'}, RequestFactory().get('/'))
+        set_roa_context(context)
+        self.addCleanup(set_roa_context, (None, None))
+        started = []
+        receiver = lambda **kwargs: started.append(kwargs)
+        request_started.connect(receiver)
+        self.addCleanup(request_started.disconnect, receiver)
+        connection.ensure_connection()
+        outer_connection = connection.connection
+
+        self.assertEqual(Account.objects.get(id=1).email, 'john@example.com')
+        # The outer request keeps its ROA headers and user
+        self.assertEqual(get_roa_context(), context)
+        # and its database connection, request signals are not sent
+        self.assertEqual(started, [])
+        self.assertIs(connection.connection, outer_connection)
@@ -45,6 +45,8 @@ from django_roa_client.models import RemotePage, RemotePageWithManyFields, \
     RemotePageWithCustomPrimaryKeyCountOverridden
 from django_roa_client.forms import TestForm, RemotePageForm
 from django_roa.db.exceptions import ROAException
+from django_roa.db.querylog import record_remote_calls
+from django_roa.remoteauth.backends import RemoteUserModelBackend
 
 ROA_FILTERS = getattr(settings, 'ROA_FILTERS', {})
 
@@ -579,6 +581,17 @@ class ROARemoteAuthTests(ROAUserTestCase):
             self.assertEqual(repr(Message.objects.all()), '[<Message: Test message>]')
             self.assertEqual(repr(alice.message_set.all()), '[<Message: Test message>]')
 
+    def test_cached_user(self):
+        backend = RemoteUserModelBackend()
+        alice = User.objects.create_user(username='alice', password='secret', email='alice@example.com')
+        self.assertEqual(backend.authenticate(username='alice', password='secret'), alice)
+        with record_remote_calls() as log:
+            self.assertEqual(backend.get_user(alice.id).email, 'alice@example.com')
+        self.assertEqual(len(log), 0)
+        alice.email = 'alice@example.org'
+        alice.save()
+        self.assertEqual(backend.get_user(alice.id).email, 'alice@example.org')
+
     def test_select_related(self):
         # Not supported, we just verify that it doesn't break anything
         if Message:
@@ -40,7 +40,7 @@ setup(
     description="Turn your models into remote resources that you can access through Django's ORM.",
     author='Jeroen Arnoldus',
     author_email='jeroen@repleo.nl',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     include_package_data=True,
     classifiers=[
         'Development Status :: 4 - Beta',